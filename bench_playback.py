@@ -0,0 +1,399 @@
+"""
+Playback-engine micro-benchmarks for Profex Player.
+
+Drives the real `playback_loop` / VLC backend from main.py against local audio
+fixtures (lib/sounds/error.mp3 plus generated tone files) and emits the
+results as JSON so runs can be compared across builds.
+
+Measured:
+  * skip latency      - time from skip_song() to the first audio frame of the next track
+  * inter-track gap   - time from natural end of a track to the first audio frame of the next
+  * switch memory     - RSS / Python object growth over N track switches (Instance/MediaPlayer leaks)
+  * idle wakeups      - CPU time and context switches per minute while idle and while paused
+
+Usage:
+  python bench_playback.py [--switches 1000] [--idle-seconds 10] [--output bench.json]
+  python bench_playback.py --compare old.json new.json
+"""
+import argparse
+import gc
+import json
+import math
+import os
+import platform
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+# main.py resolves lib/ paths relative to the working directory
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+os.chdir(BASE_DIR)
+
+import main  # noqa: E402  (must be imported after chdir)
+
+FIXTURE_SAMPLE_RATE = 44100
+POLL_INTERVAL = 0.001  # seconds, resolution for first-frame detection
+STEP_TIMEOUT = 10.0  # seconds, give up on a single measurement after this long
+
+
+# --- Fixtures ---
+def generate_tone_file(path: str, frequency: float, duration: float):
+    """Writes a mono 16-bit sine tone WAV file."""
+    frame_count = int(FIXTURE_SAMPLE_RATE * duration)
+    with wave.open(path, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(FIXTURE_SAMPLE_RATE)
+        frames = bytearray()
+        for i in range(frame_count):
+            sample = int(12000 * math.sin(2 * math.pi * frequency * i / FIXTURE_SAMPLE_RATE))
+            frames += struct.pack("<h", sample)
+        wav.writeframes(bytes(frames))
+
+
+def build_fixtures(fixture_dir: str, tone_duration: float) -> list[str]:
+    """Returns a list of local audio files to use as queue entries."""
+    fixtures = []
+    for freq in (220.0, 330.0, 440.0, 550.0):
+        path = os.path.join(fixture_dir, f"tone_{int(freq)}.wav")
+        generate_tone_file(path, freq, tone_duration)
+        fixtures.append(os.path.abspath(path))
+    if os.path.exists(main.ERROR_SOUND_PATH):
+        fixtures.append(os.path.abspath(main.ERROR_SOUND_PATH))
+    return fixtures
+
+
+# --- Process Probes ---
+def read_rss_bytes() -> int | None:
+    """Current resident set size of this process, or None if unavailable."""
+    try:
+        if sys.platform.startswith("linux"):
+            with open("/proc/self/statm", "r") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        if os.name == "nt":
+            import ctypes
+            from ctypes import wintypes
+
+            class PROCESS_MEMORY_COUNTERS(ctypes.Structure):
+                _fields_ = [
+                    ("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD),
+                    ("PeakWorkingSetSize", ctypes.c_size_t), ("WorkingSetSize", ctypes.c_size_t),
+                    ("QuotaPeakPagedPoolUsage", ctypes.c_size_t), ("QuotaPagedPoolUsage", ctypes.c_size_t),
+                    ("QuotaPeakNonPagedPoolUsage", ctypes.c_size_t), ("QuotaNonPagedPoolUsage", ctypes.c_size_t),
+                    ("PagefileUsage", ctypes.c_size_t), ("PeakPagefileUsage", ctypes.c_size_t),
+                ]
+
+            counters = PROCESS_MEMORY_COUNTERS()
+            counters.cb = ctypes.sizeof(counters)
+            handle = ctypes.windll.kernel32.GetCurrentProcess()
+            if ctypes.windll.psapi.GetProcessMemoryInfo(handle, ctypes.byref(counters), counters.cb):
+                return counters.WorkingSetSize
+            return None
+        import resource
+        # ru_maxrss is a peak value (kilobytes on Linux, bytes on macOS); better than nothing
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+    except Exception:
+        return None
+
+
+def read_context_switches() -> int | None:
+    """Total voluntary + involuntary context switches of this process (a proxy for wakeups)."""
+    try:
+        if sys.platform.startswith("linux"):
+            total = 0
+            for tid in os.listdir("/proc/self/task"):
+                try:
+                    with open(f"/proc/self/task/{tid}/status", "r") as f:
+                        for line in f:
+                            if line.startswith(("voluntary_ctxt_switches", "nonvoluntary_ctxt_switches")):
+                                total += int(line.split()[1])
+                except OSError:
+                    continue  # Thread exited while we were reading
+            return total
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        return usage.ru_nvcsw + usage.ru_nivcsw
+    except Exception:
+        return None
+
+
+def percentile(values: list[float], pct: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(values: list[float]) -> dict:
+    """Summarizes a list of millisecond samples."""
+    return {
+        "count": len(values),
+        "min_ms": round(min(values), 3) if values else None,
+        "p50_ms": round(percentile(values, 50), 3) if values else None,
+        "p95_ms": round(percentile(values, 95), 3) if values else None,
+        "max_ms": round(max(values), 3) if values else None,
+        "mean_ms": round(sum(values) / len(values), 3) if values else None,
+    }
+
+
+# --- Player Observation ---
+# The VLC player object is only used as an identity token for "which track is
+# open"; its state and time are read through the backend, which holds its lock.
+def current_player():
+    """The backend's current VLC player (None if nothing is open), read under the backend lock."""
+    backend = main.playback_backend
+    with backend.lock:
+        return backend.player
+
+
+def wait_for_first_frame(previous_player, timeout: float = STEP_TIMEOUT) -> float | None:
+    """
+    Blocks until a player other than `previous_player` is producing audio
+    (state Playing and a positive media time). Returns the perf_counter timestamp or None on timeout.
+    """
+    backend = main.playback_backend
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        current = current_player()
+        if current is not None and current is not previous_player:
+            if backend.state() is main.PlaybackState.PLAYING and (backend.get_time() or 0) > 0:
+                return time.perf_counter()
+        time.sleep(POLL_INTERVAL)
+    return None
+
+
+def wait_for_end(player, timeout: float = STEP_TIMEOUT) -> float | None:
+    """Blocks until `player` reaches Ended or Stopped (or is replaced). Returns the timestamp or None."""
+    backend = main.playback_backend
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if current_player() is not player:
+            return time.perf_counter()
+        if backend.state() in (main.PlaybackState.ENDED, main.PlaybackState.STOPPED):
+            return time.perf_counter()
+        time.sleep(POLL_INTERVAL)
+    return None
+
+
+def reset_queue():
+    """Stops playback and waits for the playback loop to settle on an empty queue."""
+    main.stop_song()
+    time.sleep(0.6)  # Longer than the playback loop's empty-queue poll
+
+
+# --- Benchmarks ---
+def bench_skip_latency(fixtures: list[str], samples: int) -> dict:
+    """skip_song() -> first audio frame of the next queued track."""
+    reset_queue()
+    main.playlist_manager.add_songs([fixtures[i % len(fixtures)] for i in range(samples + 1)])
+    if wait_for_first_frame(None) is None:
+        return {"error": "first track never started"}
+
+    latencies = []
+    for _ in range(samples):
+        previous = current_player()
+        start = time.perf_counter()
+        main.skip_song()
+        first_frame = wait_for_first_frame(previous)
+        if first_frame is None:
+            break
+        latencies.append((first_frame - start) * 1000.0)
+    reset_queue()
+    return summarize(latencies)
+
+
+def bench_inter_track_gap(fixtures: list[str], samples: int) -> dict:
+    """Natural end of a track -> first audio frame of the next one."""
+    reset_queue()
+    main.playlist_manager.add_songs([fixtures[i % len(fixtures)] for i in range(samples + 1)])
+    if wait_for_first_frame(None) is None:
+        return {"error": "first track never started"}
+
+    gaps = []
+    for _ in range(samples):
+        current = current_player()
+        ended = wait_for_end(current, timeout=STEP_TIMEOUT * 3)
+        if ended is None:
+            break
+        first_frame = wait_for_first_frame(current)
+        if first_frame is None:
+            break
+        gaps.append((first_frame - ended) * 1000.0)
+    reset_queue()
+    return summarize(gaps)
+
+
+def bench_switch_memory(fixtures: list[str], switches: int) -> dict:
+    """RSS and Python object growth across many skip-driven track switches."""
+    reset_queue()
+    gc.collect()
+    rss_start = read_rss_bytes()
+    objects_start = len(gc.get_objects())
+    threads_start = threading.active_count()
+
+    main.playlist_manager.add_songs([fixtures[i % len(fixtures)] for i in range(switches + 1)])
+    if wait_for_first_frame(None) is None:
+        return {"error": "first track never started"}
+
+    rss_samples = []
+    completed = 0
+    started = time.perf_counter()
+    for i in range(switches):
+        previous = current_player()
+        main.skip_song()
+        if wait_for_first_frame(previous) is None:
+            break
+        completed += 1
+        if i % max(1, switches // 20) == 0:
+            rss_samples.append({"switch": i, "rss_bytes": read_rss_bytes()})
+    elapsed = time.perf_counter() - started
+
+    reset_queue()
+    gc.collect()
+    rss_end = read_rss_bytes()
+    return {
+        "switches_requested": switches,
+        "switches_completed": completed,
+        "switches_per_second": round(completed / elapsed, 3) if elapsed > 0 else None,
+        "rss_start_bytes": rss_start,
+        "rss_end_bytes": rss_end,
+        "rss_growth_bytes": (rss_end - rss_start) if rss_start is not None and rss_end is not None else None,
+        "rss_growth_per_switch_bytes": round((rss_end - rss_start) / completed, 1) if completed and rss_start is not None and rss_end is not None else None,
+        "python_object_growth": len(gc.get_objects()) - objects_start,
+        "thread_growth": threading.active_count() - threads_start,
+        "rss_samples": rss_samples,
+    }
+
+
+def measure_wakeups(seconds: float) -> dict:
+    """CPU time and context switches over a quiet window, extrapolated to one minute."""
+    cpu_start = time.process_time()
+    switches_start = read_context_switches()
+    time.sleep(seconds)
+    cpu_used = time.process_time() - cpu_start
+    switches_end = read_context_switches()
+    scale = 60.0 / seconds
+    return {
+        "window_seconds": seconds,
+        "cpu_ms_per_minute": round(cpu_used * 1000.0 * scale, 3),
+        "context_switches_per_minute": round((switches_end - switches_start) * scale, 1) if switches_start is not None and switches_end is not None else None,
+        "threads": threading.active_count(),
+    }
+
+
+def bench_idle_cpu(fixtures: list[str], seconds: float) -> dict:
+    """Wakeups with an empty queue, and with a long track paused."""
+    reset_queue()
+    idle = measure_wakeups(seconds)
+
+    long_tone = os.path.join(os.path.dirname(fixtures[0]), "tone_long.wav")
+    if not os.path.exists(long_tone):
+        generate_tone_file(long_tone, 440.0, seconds + 30)
+    main.playlist_manager.add_song(long_tone)
+    paused = None
+    if wait_for_first_frame(None) is not None:
+        main.pause_song()
+        time.sleep(0.5)
+        paused = measure_wakeups(seconds)
+    reset_queue()
+    return {"idle": idle, "paused": paused}
+
+
+# --- Reporting ---
+def git_revision() -> str | None:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BASE_DIR, stderr=subprocess.DEVNULL, encoding="utf-8"
+        ).strip()
+    except Exception:
+        return None
+
+
+def environment_info() -> dict:
+    try:
+        vlc_version = main.vlc.libvlc_get_version().decode("utf-8", "ignore")
+    except Exception:
+        vlc_version = None
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "git_revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "vlc": vlc_version,
+        "frozen": bool(getattr(sys, "frozen", False)),
+    }
+
+
+def compare_reports(old_path: str, new_path: str):
+    """Prints the relative change of every numeric leaf shared by two reports."""
+    with open(old_path, "r", encoding="utf-8") as f:
+        old = json.load(f)
+    with open(new_path, "r", encoding="utf-8") as f:
+        new = json.load(f)
+
+    def walk(a, b, prefix=""):
+        for key, value in a.items():
+            if key in ("environment", "rss_samples") or key not in b:
+                continue
+            path = f"{prefix}{key}"
+            if isinstance(value, dict) and isinstance(b[key], dict):
+                walk(value, b[key], path + ".")
+            elif isinstance(value, (int, float)) and isinstance(b[key], (int, float)) and not isinstance(value, bool):
+                change = ((b[key] - value) / value * 100.0) if value else 0.0
+                print(f"  {path:<55} {value:>14} -> {b[key]:>14}  ({change:+.1f}%)")
+
+    print(f"--- {old_path} -> {new_path} ---")
+    walk(old.get("results", {}), new.get("results", {}))
+
+
+def run_benchmarks(args) -> dict:
+    main.CONFIG["idle_timeout"] = 0  # Never let the idle monitor fire mid-run
+    if not isinstance(main.playback_backend, main.VlcBackend):
+        main.playback_backend = main.VlcBackend()  # These benchmarks measure VLC itself
+    threading.Thread(target=main.playback_loop, daemon=True).start()
+
+    with tempfile.TemporaryDirectory(prefix="profex_bench_") as fixture_dir:
+        fixtures = build_fixtures(fixture_dir, args.tone_seconds)
+        results = {}
+        print("Running skip latency...", file=sys.stderr)
+        results["skip_to_first_frame"] = bench_skip_latency(fixtures, args.samples)
+        print("Running inter-track gap...", file=sys.stderr)
+        results["inter_track_gap"] = bench_inter_track_gap(fixtures, args.samples)
+        print(f"Running {args.switches} track switches...", file=sys.stderr)
+        results["switch_memory"] = bench_switch_memory(fixtures, args.switches)
+        print("Running idle/paused wakeups...", file=sys.stderr)
+        results["idle_cpu"] = bench_idle_cpu(fixtures, args.idle_seconds)
+
+    return {"environment": environment_info(), "parameters": vars(args), "results": results}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profex Player playback-engine benchmarks")
+    parser.add_argument("--samples", type=int, default=20, help="Samples for skip latency and inter-track gap")
+    parser.add_argument("--switches", type=int, default=1000, help="Track switches for the memory test")
+    parser.add_argument("--idle-seconds", type=float, default=10.0, help="Measurement window for idle/paused wakeups")
+    parser.add_argument("--tone-seconds", type=float, default=1.5, help="Duration of generated tone fixtures")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two saved reports and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_reports(*args.compare)
+        sys.exit(0)
+
+    report = run_benchmarks(args)
+    report["parameters"].pop("compare", None)
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        print(f"Benchmark report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+    os._exit(0)  # VLC threads can keep the interpreter alive
@@ -1,49 +1,191 @@
+from __future__ import annotations # Annotations must not force the lazy imports below
+
 # Standard Library Imports
+import abc
+import collections
+import contextlib
+import ctypes
+import enum
+import hashlib
+import heapq
+import hmac
+import http.client
+import http.server
+import importlib
+import io
+import itertools
 import json
 import logging
+import logging.handlers
+import math
+import mimetypes
+import mmap
 import os
+import queue
 import random # <-- Added for shuffle
+import re
+import secrets
+import shutil
+import sqlite3
 import subprocess
+import sys
 import threading
 import time
 import tkinter as tk
+import urllib.error
 import urllib.parse # <-- Added for URL decoding in queue view
+import urllib.request
+
+from typing import Callable, NamedTuple, TypeAlias # Import TypeAlias
+
+import resolver_worker # Light; yt-dlp itself is only imported on first use
+
+if __name__ == "__main__" and "--resolver-worker" in sys.argv:
+    # Frozen builds re-launch their own executable as resolver pool workers (see ResolverPool)
+    resolver_worker.serve()
+    sys.exit(0)
+
+PROCESS_START = time.perf_counter() # Reference point for --startup-trace
+
+
+# --- Startup Tracing ---
+class StartupTrace:
+    """
+    Records how long each startup phase and lazy import takes. With
+    `--startup-trace` on the command line, every phase is printed as it completes.
+    """
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.phases: list[tuple[str, float, float, str]] = [] # (name, offset_ms, duration_ms, thread)
+
+    def record(self, name: str, started_at: float):
+        now = time.perf_counter()
+        entry = (name, (now - PROCESS_START) * 1000.0, (now - started_at) * 1000.0, threading.current_thread().name)
+        with self.lock:
+            self.phases.append(entry)
+        if self.enabled:
+            print(f"[startup-trace] +{entry[1]:8.1f} ms  {name:<28} {entry[2]:8.1f} ms  ({entry[3]})", flush=True)
+
+    @contextlib.contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, start)
+
+
+startup_trace = StartupTrace("--startup-trace" in sys.argv)
 
-# Third-Party Imports
+
+class LazyModule:
+    """
+    Stand-in for a heavy third-party module: the real import happens on first
+    attribute access (and is timed by the startup trace), so importing main.py
+    stays cheap and the window/tray can appear before VLC, yt-dlp or spotipy load.
+    """
+    def __init__(self, name: str):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    start = time.perf_counter()
+                    module = importlib.import_module(self._name)
+                    startup_trace.record(f"import {self._name}", start)
+                    self._module = module
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+
+# Third-Party Imports (lazy; listed in main.spec hiddenimports for PyInstaller)
 # Ensure you have these installed: pip install python-vlc Pillow pystray keyboard yt-dlp spotipy
-import keyboard
-import pystray
-from typing import TypeAlias # Import TypeAlias
-import spotipy
-import vlc
-import yt_dlp as youtube_dl
-from PIL import Image, ImageDraw
-from spotipy.oauth2 import SpotifyClientCredentials
+keyboard = LazyModule("keyboard")
+pystray = LazyModule("pystray")
+spotipy = LazyModule("spotipy")
+spotipy_oauth2 = LazyModule("spotipy.oauth2")
+spotipy_cache_handler = LazyModule("spotipy.cache_handler")
+requests = LazyModule("requests") # Installed with spotipy
+requests_adapters = LazyModule("requests.adapters")
+urllib3_retry = LazyModule("urllib3.util.retry")
+vlc = LazyModule("vlc")
+youtube_dl = LazyModule("yt_dlp")
+mutagen = LazyModule("mutagen") # Optional; tags fall back to the file name without it
+Image = LazyModule("PIL.Image")
+ImageDraw = LazyModule("PIL.ImageDraw")
 
 # Define the alias
-PystrayIconType: TypeAlias = pystray.Icon # type: ignore
+PystrayIconType: TypeAlias = "pystray.Icon"
 
 # Setup logging
-logging.basicConfig(
-    level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s"
-)
+# Records are only queued on the calling thread; formatting and I/O happen on a
+# QueueListener thread started by setup_logging() once the config is loaded.
+# Records emitted before that (e.g. during config loading) wait in the queue.
+LOG_QUEUE: queue.SimpleQueue = queue.SimpleQueue()
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that leaves message formatting to the listener thread."""
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record # Same-process queue: no need to pre-format or strip args
+
+logging.getLogger().addHandler(LazyQueueHandler(LOG_QUEUE))
+logging.getLogger().setLevel(logging.INFO)
+log_listener: logging.handlers.QueueListener | None = None
+
+# Per-subsystem loggers (levels configurable via "log_levels" in config.json)
+playback_log = logging.getLogger("profex.playback")
+resolve_log = logging.getLogger("profex.resolve")
+spotify_log = logging.getLogger("profex.spotify")
+queue_log = logging.getLogger("profex.queue")
+library_log = logging.getLogger("profex.library") # Library scans and the local search index
 
 # --- Constants ---
 APP_NAME = "Windows Defender Terminal"
 WINDOW_TITLE = APP_NAME
 TRAY_ICON_NAME = APP_NAME
 DEFAULT_IDLE_TIMEOUT = 120  # seconds
+VALID_LOG_LEVELS = (logging.DEBUG, logging.INFO, logging.WARNING, logging.ERROR, logging.CRITICAL)
 DEFAULT_VOLUME = 50
 CONFIG_FILE_PATH = os.path.join("lib", "config", "config.json")
+LOG_FILE_PATH = os.path.join("lib", "logs", "profex.jsonl")
 ICON_PATH = os.path.join("lib", "icons", "icon.ico")
 ERROR_SOUND_PATH = os.path.join("lib", "sounds", "error.mp3")
 PLAYLISTS_DIR = os.path.join("lib", "playlists") # <-- Added directory for playlists
+PROFILES_DIR = os.path.join("lib", "profiles")
+STREAM_CACHE_DIR = os.path.join("lib", "cache", "stream")
+DOWNLOADS_DIR = os.path.join("lib", "downloads")
+APP_DB_PATH = os.path.join("lib", "data", "profex.db") # SQLite database: library, search index and play history
+QUEUE_JOURNAL_PATH = os.path.join("lib", "data", "queue.journal") # Append-only log of queue changes for session restore
+SPOTIFY_TOKEN_CACHE_PATH = os.path.join("lib", "config", ".spotify_token_cache")
+SPOTIFY_METADATA_CACHE_PATH = os.path.join("lib", "config", "spotify_metadata.json")
+SPOTIFY_HTTP_RETRIES = 3 # Per request, for connection errors, 429 and 5xx
+SPOTIFY_HTTP_BACKOFF = 0.5 # seconds; urllib3 backoff factor between retries
+SPOTIFY_MAX_RETRY_AFTER = 30 # seconds; cap on a 429 Retry-After wait so imports never stall for minutes
+SPOTIFY_TOKEN_REFRESH_MARGIN = 300 # seconds before expiry to refresh the token in the background
+PLAYER_STATE_RECHECK_INTERVAL = 5 # seconds; fallback re-check of the player state if a backend event is missed
+SCHEDULER_COALESCE_WINDOW = 1.0 # seconds; jobs due this close together run in the same wakeup
+SPOTIFY_CACHE_EVICT_INTERVAL = 24 * 60 * 60 # seconds between stale Spotify metadata sweeps
+LOCK_CHECK_INTERVAL = 10 # seconds between lock screen checks
+LOCK_DETECTION_BACKENDS = ("wts", "input_desktop", "tasklist") # In "auto" preference order
+PLAYBACK_BACKEND_NAMES = ("vlc", "simulated")
+STREAM_PROXY_CHUNK_SIZE = 256 * 1024 # bytes; unit of caching and of upstream range requests
+STREAM_PROXY_READAHEAD = 4 # chunks fetched per upstream request on a cache miss
+STREAM_PROXY_MAX_STREAMS = 64 # Registered upstream URLs kept (oldest forgotten first)
+STREAM_PROXY_TIMEOUT = 15 # seconds per upstream request
+DOWNLOAD_TIMEOUT = 20 # seconds per socket operation
+DOWNLOAD_SEGMENT_RETRIES = 3 # Attempts per range before the download fails
+DOWNLOAD_READ_SIZE = 1024 * 1024 # bytes read into the reusable buffer per socket read
+HOTKEY_QUEUE_SIZE = 32 # Pending hotkey actions; presses beyond this are dropped
+HOTKEY_SEEK_DEBOUNCE = 0.15 # seconds without another seek press before a coalesced seek is applied
+HOTKEY_SEEK_MAX_DELAY = 0.5 # seconds; a held seek key still moves at least this often
 
 
-# Global variable for the VLC player instance
-player: vlc.MediaPlayer | None = None
-last_activity_time = time.time() # Used for idle timeout
-
 # --- Configuration Loading ---
 def load_config() -> dict:
     """Loads configuration from JSON file, using defaults if necessary."""
@@ -61,12 +203,46 @@ def load_config() -> dict:
         "loop_toggle": "ctrl+alt+l",
         "shuffle_queue": "ctrl+alt+h",
         "view_queue_hotkey": "ctrl+alt+v", # Example for a new feature
+        "profile_toggle": "ctrl+alt+f12",
         "default_volume": DEFAULT_VOLUME,
         "idle_timeout": DEFAULT_IDLE_TIMEOUT,
         "CLIENT_ID": "YOUR_CLIENT_ID_HERE",
         "CLIENT_SECRET": "YOUR_CLIENT_SECRET_HERE",
         "enable_discord_rpc": False, # Example for a new boolean feature
-        "discord_rpc_update_interval": 15 # seconds
+        "discord_rpc_update_interval": 15, # seconds
+        "metrics_dump_path": "", # Empty disables the periodic JSON metrics dump
+        "metrics_dump_interval": 60, # seconds
+        "error_sound_min_interval": 1.0, # seconds; error sounds closer together are coalesced into one
+        "spotify_cache_max_age_days": 30, # Unused track/playlist metadata older than this is evicted
+        "playback_retry_budget": 2, # Retries per queue entry (re-resolving stale streams) before it is skipped
+        "prefetch_lookahead": 3, # Upcoming queue entries validated in the background (0 disables)
+        "prefetch_interval": 30, # seconds between background validation passes
+        "stream_expiry_margin": 300, # seconds; stream URLs expiring sooner than this are re-resolved
+        "stream_proxy_enabled": False, # Play network streams through the local caching proxy
+        "stream_proxy_memory_mb": 64, # In-memory chunk cache size
+        "stream_proxy_disk_mb": 0, # Extra on-disk chunk cache (cleared at startup); 0 disables
+        "download_connections": 4, # Parallel range requests per download
+        "download_segment_mb": 2, # Size of each range request
+        "library_folders": [], # Folders of local music indexed for `play` and `library`
+        "library_rescan_minutes": 60, # Incremental rescan interval; 0 scans only at startup and on `library rescan`
+        "local_search": True, # `play` uses strong matches from the local search index (library, past resolutions) before YouTube
+        "history_enabled": True, # Record every play (source, latency, bytes) in lib/data/profex.db for `history`
+        "restore_session": True, # Restore the queue and resume the current track at its position on launch
+        "resolver_backend": "inline", # "inline" (yt-dlp in this process) or "process" (warm pool of worker processes)
+        "resolver_workers": 2, # Worker processes for the "process" resolver backend
+        "lock_detection_backend": "auto", # "auto", "wts", "input_desktop", "tasklist" or "off" (Windows only)
+        "playback_backend": "vlc", # "vlc", or "simulated" (virtual-time player without audio, for headless testing)
+        "control_api_enabled": False, # Localhost HTTP API for commands, status and pushed events (see README)
+        "control_api_port": 8765,
+        "control_api_token": "", # Required by every API request; generated when the API is first enabled
+        "profiler_rate_hz": 100, # Stack samples per second while profiling
+        "profiler_format": "speedscope", # "speedscope" (JSON) or "collapsed" (flamegraph.pl input)
+        "log_level": "INFO",
+        "log_levels": {}, # Per-subsystem overrides, e.g. {"playback": "WARNING", "resolve": "DEBUG"}
+        "log_file": LOG_FILE_PATH, # Rotating JSONL log; empty disables file logging
+        "log_max_bytes": 1048576,
+        "log_backup_count": 3,
+        "log_to_console": True
     }
 
     config = {}
@@ -132,6 +308,113 @@ def load_config() -> dict:
             config["discord_rpc_update_interval"] = 15
             needs_saving = True
 
+        # Error Sound Rate Limit
+        try:
+            config["error_sound_min_interval"] = max(0.0, float(config.get("error_sound_min_interval", 1.0)))
+        except (ValueError, TypeError):
+            logging.warning(f"Invalid error_sound_min_interval '{config.get('error_sound_min_interval')}' in config, using default 1.0.")
+            config["error_sound_min_interval"] = 1.0
+            needs_saving = True
+
+        # Spotify Metadata Cache Age
+        try:
+            config["spotify_cache_max_age_days"] = max(1, int(config.get("spotify_cache_max_age_days", 30)))
+        except (ValueError, TypeError):
+            logging.warning(f"Invalid spotify_cache_max_age_days '{config.get('spotify_cache_max_age_days')}' in config, using default 30.")
+            config["spotify_cache_max_age_days"] = 30
+            needs_saving = True
+
+        # Integer Settings: (key, default, minimum, maximum or None), clamped into range
+        for key, default_value, minimum, maximum in (
+            # Prefetcher
+            ("prefetch_lookahead", 3, 0, None), ("prefetch_interval", 30, 5, None), ("stream_expiry_margin", 300, 0, None),
+            # Playback Retries
+            ("playback_retry_budget", 2, 0, None),
+            # Stream Proxy
+            ("stream_proxy_memory_mb", 64, 1, None), ("stream_proxy_disk_mb", 0, 0, None),
+            # Downloads
+            ("download_connections", 4, 1, None), ("download_segment_mb", 2, 1, None),
+            # Resolver Workers
+            ("resolver_workers", 2, 1, None),
+            # Library Rescan
+            ("library_rescan_minutes", 60, 0, None),
+            # Control API
+            ("control_api_port", 8765, 1, 65535),
+        ):
+            try:
+                value = max(minimum, int(config.get(key, default_value)))
+                config[key] = value if maximum is None else min(maximum, value)
+            except (ValueError, TypeError):
+                logging.warning(f"Invalid {key} '{config.get(key)}' in config, using default {default_value}.")
+                config[key] = default_value
+                needs_saving = True
+
+        # Metrics Dump Interval
+        try:
+            dump_interval = int(config.get("metrics_dump_interval", 60))
+            config["metrics_dump_interval"] = max(5, dump_interval) # Min 5 seconds
+        except (ValueError, TypeError):
+            logging.warning(f"Invalid metrics_dump_interval '{config.get('metrics_dump_interval')}' in config, using default 60.")
+            config["metrics_dump_interval"] = 60
+            needs_saving = True
+
+        # Profiler Sample Rate
+        try:
+            rate = int(config.get("profiler_rate_hz", 100))
+            config["profiler_rate_hz"] = max(1, min(1000, rate))
+        except (ValueError, TypeError):
+            logging.warning(f"Invalid profiler_rate_hz '{config.get('profiler_rate_hz')}' in config, using default 100.")
+            config["profiler_rate_hz"] = 100
+            needs_saving = True
+
+        # Logging
+        if not isinstance(config.get("log_level"), str) or logging.getLevelName(config["log_level"].upper()) not in VALID_LOG_LEVELS:
+            logging.warning(f"Invalid log_level '{config.get('log_level')}' in config, using default 'INFO'.")
+            config["log_level"] = "INFO"
+            needs_saving = True
+        if not isinstance(config.get("log_levels"), dict):
+            logging.warning(f"Invalid log_levels '{config.get('log_levels')}' in config (expected an object), ignoring.")
+            config["log_levels"] = {}
+            needs_saving = True
+        try:
+            config["log_max_bytes"] = max(65536, int(config.get("log_max_bytes", 1048576))) # Min 64 KB
+            config["log_backup_count"] = max(0, int(config.get("log_backup_count", 3)))
+        except (ValueError, TypeError):
+            logging.warning("Invalid log_max_bytes/log_backup_count in config, using defaults.")
+            config["log_max_bytes"] = 1048576
+            config["log_backup_count"] = 3
+            needs_saving = True
+
+        # Library Folders
+        if not isinstance(config.get("library_folders", []), list) or not all(isinstance(f, str) for f in config.get("library_folders", [])):
+            logging.warning(f"Invalid library_folders '{config.get('library_folders')}' in config (expected a list of paths), using [].")
+            config["library_folders"] = []
+            needs_saving = True
+
+        # Resolver Backend
+        if config.get("resolver_backend") not in ("inline", "process"):
+            logging.warning(f"Invalid resolver_backend '{config.get('resolver_backend')}' in config, using default 'inline'.")
+            config["resolver_backend"] = "inline"
+            needs_saving = True
+
+        # Playback Backend
+        if config.get("playback_backend") not in PLAYBACK_BACKEND_NAMES:
+            logging.warning(f"Invalid playback_backend '{config.get('playback_backend')}' in config, using default 'vlc'.")
+            config["playback_backend"] = "vlc"
+            needs_saving = True
+
+        # Lock Detection Backend
+        if config.get("lock_detection_backend") not in ("auto", *LOCK_DETECTION_BACKENDS, "off"):
+            logging.warning(f"Invalid lock_detection_backend '{config.get('lock_detection_backend')}' in config, using default 'auto'.")
+            config["lock_detection_backend"] = "auto"
+            needs_saving = True
+
+        # Profiler Output Format
+        if config.get("profiler_format") not in ("speedscope", "collapsed"):
+            logging.warning(f"Invalid profiler_format '{config.get('profiler_format')}' in config, using default 'speedscope'.")
+            config["profiler_format"] = "speedscope"
+            needs_saving = True
+
         # Ensure all default keys exist in the current config, adding them if missing
         for key, default_value in config_defaults.items():
             if key not in config:
@@ -154,7 +437,7 @@ def load_config() -> dict:
         # This is a simplistic check. The `keyboard` library will do more robust checks later.
         hotkey_keys = [k for k, v in config_defaults.items() if isinstance(v, str) and ('hotkey' in k or k in [
             "terminate", "play", "pause", "resume", "skip", "stop", "volume_up", "volume_down",
-            "skip_forward", "skip_backward", "loop_toggle", "shuffle_queue"
+            "skip_forward", "skip_backward", "loop_toggle", "shuffle_queue", "profile_toggle"
         ])]
         for key in hotkey_keys:
             if not isinstance(config[key], str) or not config[key].strip():
@@ -164,6 +447,15 @@ def load_config() -> dict:
             # Consider adding a regex here for basic format check if desired, e.g., r"([a-z0-9]+|\S+)(\s*\+\s*([a-z0-9]+|\S+))*"
             # For now, relies on the keyboard library to fail during registration for more complex issues.
 
+        # Control API token: without one, any local program or web page could drive the player
+        if not isinstance(config.get("control_api_token"), str):
+            config["control_api_token"] = ""
+            needs_saving = True
+        if config.get("control_api_enabled") and not config["control_api_token"].strip():
+            config["control_api_token"] = secrets.token_urlsafe(24)
+            logging.info(f"Generated a control_api_token in {CONFIG_FILE_PATH}.")
+            needs_saving = True
+
         if needs_saving:
             try:
                 with open(CONFIG_FILE_PATH, "w", encoding='utf-8') as f:
@@ -185,7 +477,7 @@ def load_config() -> dict:
             "volume_up": "ctrl+alt+up", "volume_down": "ctrl+alt+down",
             "skip_forward": "ctrl+alt+right", "skip_backward": "ctrl+alt+left",
             "loop_toggle": "ctrl+alt+l", "shuffle_queue": "ctrl+alt+h",
-            "view_queue_hotkey": "ctrl+alt+v",
+            "view_queue_hotkey": "ctrl+alt+v", "profile_toggle": "ctrl+alt+f12",
             "default_volume": int(DEFAULT_VOLUME),
             "idle_timeout": int(DEFAULT_IDLE_TIMEOUT),
             "CLIENT_ID": "YOUR_CLIENT_ID_HERE",
@@ -200,31 +492,605 @@ def load_config() -> dict:
         return minimal_config
 
 # Load config once at startup
-CONFIG = load_config()
+with startup_trace.phase("load config"):
+    CONFIG = load_config()
+
+
+# --- Logging Pipeline ---
+class JsonLogFormatter(logging.Formatter):
+    """Formats records as one JSON object per line (JSONL)."""
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": f"{self.formatTime(record, '%Y-%m-%dT%H:%M:%S')}.{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+def setup_logging(config: dict):
+    """
+    Applies configured levels and starts the background listener that formats
+    queued records to the console (if one exists) and a rotating JSONL file.
+    """
+    global log_listener
+    logging.getLogger().setLevel(config.get("log_level", "INFO").upper())
+    for subsystem, level_name in config.get("log_levels", {}).items():
+        logger_name = subsystem if subsystem.startswith("profex") else f"profex.{subsystem}"
+        if isinstance(level_name, str) and logging.getLevelName(level_name.upper()) in VALID_LOG_LEVELS:
+            logging.getLogger(logger_name).setLevel(level_name.upper())
+        else:
+            logging.warning(f"Invalid level '{level_name}' for logger '{logger_name}' in log_levels, ignoring.")
+
+    handlers = []
+    # The windowed PyInstaller build (console=False) has no stderr at all
+    if config.get("log_to_console", True) and sys.stderr is not None:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(logging.Formatter("%(asctime)s [%(levelname)s] %(message)s"))
+        handlers.append(console_handler)
+    log_file = config.get("log_file")
+    if log_file:
+        try:
+            os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+            file_handler = logging.handlers.RotatingFileHandler(
+                log_file, maxBytes=config.get("log_max_bytes", 1048576),
+                backupCount=config.get("log_backup_count", 3), encoding="utf-8", delay=True
+            )
+            file_handler.setFormatter(JsonLogFormatter())
+            handlers.append(file_handler)
+        except Exception as e:
+            logging.error(f"Could not open log file {log_file}: {e}")
+
+    log_listener = logging.handlers.QueueListener(LOG_QUEUE, *handlers, respect_handler_level=True)
+    log_listener.start()
+
+def shutdown_logging():
+    """Flushes queued records; call before os._exit(), which skips atexit handlers."""
+    global log_listener
+    if log_listener is not None:
+        try:
+            log_listener.stop()
+        except Exception:
+            pass
+        log_listener = None
+
+setup_logging(CONFIG)
+
+
+# --- Metrics ---
+class MetricsRegistry:
+    """
+    Thread-safe counters and latency histograms for the player's hot paths.
+    Histograms keep a bounded window of recent samples (in milliseconds) so
+    percentiles reflect the current session without growing unbounded.
+    """
+    def __init__(self, max_samples: int = 1024):
+        self.lock = threading.Lock()
+        self.max_samples = max_samples
+        self.counters: dict[str, int] = {}
+        self.histograms: dict[str, collections.deque] = {}
+        self.histogram_totals: dict[str, int] = {}
+        self.started_at = time.time()
+
+    def incr(self, name: str, amount: int = 1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def observe(self, name: str, value_ms: float):
+        with self.lock:
+            samples = self.histograms.get(name)
+            if samples is None:
+                samples = self.histograms[name] = collections.deque(maxlen=self.max_samples)
+            samples.append(value_ms)
+            self.histogram_totals[name] = self.histogram_totals.get(name, 0) + 1
+
+    @contextlib.contextmanager
+    def timer(self, name: str):
+        """Times the enclosed block into histogram `name`; exceptions also bump `<name>.errors`."""
+        start = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            self.incr(f"{name}.errors")
+            raise
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000.0)
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.histogram_totals.clear()
+            self.started_at = time.time()
+
+    @staticmethod
+    def _percentile(ordered: list[float], pct: float) -> float:
+        index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+        return ordered[index]
+
+    def snapshot(self) -> dict:
+        """Returns a JSON-serializable view of all counters and histogram summaries."""
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {name: (sorted(samples), self.histogram_totals.get(name, 0))
+                          for name, samples in self.histograms.items()}
+        stages = {}
+        for name, (ordered, total) in histograms.items():
+            if not ordered:
+                continue
+            stages[name] = {
+                "count": total,
+                "p50_ms": round(self._percentile(ordered, 50), 2),
+                "p95_ms": round(self._percentile(ordered, 95), 2),
+                "max_ms": round(ordered[-1], 2),
+                "mean_ms": round(sum(ordered) / len(ordered), 2),
+            }
+        return {
+            "timestamp": time.time(),
+            "uptime_s": round(time.time() - self.started_at, 1),
+            "counters": counters,
+            "stages": stages,
+        }
+
+    def format_stats(self) -> str:
+        """Human-readable p50/p95 table for the `stats` command."""
+        snap = self.snapshot()
+        lines = [f"\n--- Timing Stats (uptime {snap['uptime_s']}s) ---"]
+        if snap["stages"]:
+            lines.append(f"  {'stage':<28}{'count':>7}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}")
+            for name in sorted(snap["stages"]):
+                st = snap["stages"][name]
+                lines.append(f"  {name:<28}{st['count']:>7}{st['p50_ms']:>10}{st['p95_ms']:>10}{st['max_ms']:>10}")
+        else:
+            lines.append("  No timings recorded yet.")
+        if snap["counters"]:
+            lines.append("Counters:")
+            for name in sorted(snap["counters"]):
+                lines.append(f"  {name:<28}{snap['counters'][name]:>7}")
+        lines.append("------------------------------\n")
+        return "\n".join(lines)
+
+    def dump(self, path: str):
+        """Writes the current snapshot to `path` as JSON (atomically via a temp file)."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.snapshot(), f, indent=4)
+        os.replace(tmp_path, path)
+
+
+metrics = MetricsRegistry()
+
+
+# --- Sampling Profiler ---
+class SamplingProfiler:
+    """
+    Stdlib-only sampling profiler: a daemon thread snapshots every thread's
+    stack via sys._current_frames() at a fixed rate and aggregates identical
+    stacks. Works in the frozen PyInstaller build since it needs no C extension.
+    """
+    MAX_STACK_DEPTH = 128
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.thread: threading.Thread | None = None
+        self.stop_event = threading.Event()
+        self.stacks: collections.Counter = collections.Counter() # (thread_name, frame keys...) -> sample count
+        self.rate_hz = 100
+        self.started_at = 0.0
+        self.stopped_at = 0.0
+        self.sample_count = 0
+
+    def is_running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def start(self, rate_hz: int) -> bool:
+        """Starts sampling at `rate_hz`. Returns False if already running."""
+        with self.lock:
+            if self.is_running():
+                return False
+            self.rate_hz = max(1, min(1000, rate_hz))
+            self.stacks = collections.Counter()
+            self.sample_count = 0
+            self.stop_event.clear()
+            self.started_at = time.perf_counter()
+            self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+            self.thread.start()
+        logging.info(f"Sampling profiler started at {self.rate_hz} Hz.")
+        return True
+
+    def stop(self, output_path: str | None = None, output_format: str = "speedscope") -> str | None:
+        """
+        Stops sampling and writes the profile in `output_format` ("speedscope" or
+        "collapsed"); a file name without an extension gets the format's one.
+        Returns the written path, or None if not running.
+        """
+        with self.lock:
+            if not self.is_running():
+                return None
+            self.stop_event.set()
+            self.thread.join(timeout=2)
+            self.thread = None
+            self.stopped_at = time.perf_counter()
+
+        extension = ".speedscope.json" if output_format == "speedscope" else ".folded"
+        if not output_path:
+            output_path = os.path.join(PROFILES_DIR, f"profile_{time.strftime('%Y%m%d_%H%M%S')}{extension}")
+        else:
+            if not os.path.dirname(output_path):
+                output_path = os.path.join(PROFILES_DIR, output_path)
+            if not os.path.splitext(output_path)[1]:
+                output_path += extension
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+
+        if output_format == "speedscope":
+            self._write_speedscope(output_path)
+        else:
+            self._write_collapsed(output_path)
+        logging.info(f"Sampling profiler stopped: {self.sample_count} samples written to {output_path}")
+        return output_path
+
+    def _run(self):
+        interval = 1.0 / self.rate_hz
+        own_ident = threading.get_ident()
+        while not self.stop_event.wait(interval):
+            thread_names = {t.ident: t.name for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.MAX_STACK_DEPTH:
+                    code = frame.f_code
+                    stack.append((code.co_name, code.co_filename, code.co_firstlineno))
+                    frame = frame.f_back
+                stack.reverse()
+                self.stacks[(thread_names.get(ident, f"thread-{ident}"), *stack)] += 1
+            self.sample_count += 1
+
+    @staticmethod
+    def _frame_label(frame_key: tuple) -> str:
+        name, filename, lineno = frame_key
+        return f"{name} ({os.path.basename(filename)}:{lineno})"
+
+    def _write_collapsed(self, path: str):
+        """Brendan Gregg collapsed-stack format: 'thread;outer;...;inner count' per line."""
+        with open(path, "w", encoding="utf-8") as f:
+            for (thread_name, *frames), count in self.stacks.most_common():
+                labels = [thread_name] + [self._frame_label(fr).replace(";", ":") for fr in frames]
+                f.write(f"{';'.join(labels)} {count}\n")
+
+    def _write_speedscope(self, path: str):
+        """speedscope.app file format: one sampled profile per thread, weights in milliseconds."""
+        frame_index: dict[tuple, int] = {}
+        shared_frames = []
+        per_thread: dict[str, tuple[list, list]] = {}
+        interval_ms = 1000.0 / self.rate_hz
+        for (thread_name, *frames), count in self.stacks.items():
+            indices = []
+            for fr in frames:
+                if fr not in frame_index:
+                    frame_index[fr] = len(shared_frames)
+                    shared_frames.append({"name": fr[0], "file": fr[1], "line": fr[2]})
+                indices.append(frame_index[fr])
+            samples, weights = per_thread.setdefault(thread_name, ([], []))
+            samples.append(indices)
+            weights.append(count * interval_ms)
+
+        profiles = []
+        for thread_name, (samples, weights) in sorted(per_thread.items()):
+            profiles.append({
+                "type": "sampled",
+                "name": thread_name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": sum(weights),
+                "samples": samples,
+                "weights": weights,
+            })
+        document = {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": f"{APP_NAME} profile ({self.sample_count} samples @ {self.rate_hz} Hz)",
+            "exporter": APP_NAME,
+            "activeProfileIndex": 0,
+            "shared": {"frames": shared_frames},
+            "profiles": profiles,
+        }
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(document, f)
+
+
+profiler = SamplingProfiler()
+
+# --- Event Bus ---
+TRACK_STARTED = "track_started" # url, title, first_audio_ms; audio is actually playing
+TRACK_ENDED = "track_ended" # url, title, state ("ended", "stopped", "error" or "released")
+QUEUE_CHANGED = "queue_changed" # snapshot (QueueSnapshot)
+VOLUME_CHANGED = "volume_changed" # volume
+PLAYBACK_PAUSED = "playback_paused"
+PLAYBACK_RESUMED = "playback_resumed"
+COMMAND_EXECUTED = "command_executed" # command, args, source ("console", "hotkey", ...)
+ALL_EVENTS = "*" # Subscribe to this to receive every event
+
+class EventBus:
+    """
+    Minimal in-process publish/subscribe hub. Handlers are called as
+    `handler(event, payload)` on the publishing thread, so they must be quick
+    (set a threading.Event, enqueue work) and never block. A failing handler is
+    logged and does not affect the others.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.handlers: dict[str, tuple[Callable[[str, dict], None], ...]] = {}
+
+    def subscribe(self, event: str, handler: Callable[[str, dict], None]):
+        with self.lock:
+            self.handlers[event] = self.handlers.get(event, ()) + (handler,)
+
+    def unsubscribe(self, event: str, handler: Callable[[str, dict], None]):
+        with self.lock:
+            self.handlers[event] = tuple(h for h in self.handlers.get(event, ()) if h is not handler)
+
+    def publish(self, event: str, **payload):
+        # Handler tuples are replaced, never mutated, so reading them needs no lock
+        handlers = self.handlers.get(event, ()) + self.handlers.get(ALL_EVENTS, ())
+        metrics.incr(f"events.{event}")
+        for handler in handlers:
+            try:
+                handler(event, payload)
+            except Exception as e:
+                logging.error("Error in '%s' event handler %s: %s", event, handler, e, exc_info=True)
+
+
+event_bus = EventBus()
+
+
+# --- Scheduler ---
+class ScheduledJob:
+    """A job registered with the Scheduler; keep it to reschedule or cancel the job later."""
+    __slots__ = ("name", "func", "interval", "due", "generation", "cancelled")
+
+    def __init__(self, name: str, func: Callable[[], bool | None], interval: float | None):
+        self.name = name
+        self.func = func
+        self.interval = interval # None for one-shot jobs
+        self.due = 0.0 # time.monotonic() of the next run
+        self.generation = 0 # Bumped on every (re)schedule; older heap entries for the job are ignored
+        self.cancelled = False
+
+
+class Scheduler:
+    """
+    Runs all timed and periodic jobs from one thread, ordered by a heap of due
+    times. Jobs due within SCHEDULER_COALESCE_WINDOW of the earliest one run in
+    the same wakeup, so the thread sleeps as long as possible and the number of
+    wakeups does not grow with every feature. Jobs run on the scheduler thread
+    and should be short; a periodic job that returns False is not repeated.
+    """
+    def __init__(self, coalesce_window: float = SCHEDULER_COALESCE_WINDOW):
+        self.coalesce_window = coalesce_window
+        self.condition = threading.Condition()
+        self.heap: list[tuple[float, int, int, ScheduledJob]] = []
+        self.counter = itertools.count() # Tie-breaker so jobs themselves are never compared
+        self.thread: threading.Thread | None = None
+
+    def schedule(self, name: str, func: Callable[[], bool | None], delay: float, interval: float | None = None) -> ScheduledJob:
+        """Runs `func` after `delay` seconds, then every `interval` seconds if given."""
+        job = ScheduledJob(name, func, interval)
+        with self.condition:
+            self._push(job, time.monotonic() + delay)
+        return job
+
+    def reschedule(self, job: ScheduledJob, delay: float):
+        """Moves the job's next run to `delay` seconds from now (also revives a cancelled job)."""
+        with self.condition:
+            job.cancelled = False
+            self._push(job, time.monotonic() + delay)
+
+    def cancel(self, job: ScheduledJob):
+        with self.condition:
+            job.cancelled = True
+
+    def _push(self, job: ScheduledJob, due: float):
+        # Caller holds the condition
+        job.due = due
+        job.generation += 1
+        heapq.heappush(self.heap, (due, next(self.counter), job.generation, job))
+        if self.heap[0][3] is job:
+            self.condition.notify() # New earliest job; shorten the current sleep
+
+    def start(self):
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="scheduler", daemon=True)
+                self.thread.start()
+
+    def run(self):
+        while True:
+            due_jobs = self._wait_for_due_jobs()
+            metrics.incr("scheduler.wakeups")
+            for job in due_jobs:
+                try:
+                    with metrics.timer(f"job.{job.name}"):
+                        repeat = job.func()
+                except Exception as e:
+                    logging.error("Error in scheduled job '%s': %s", job.name, e, exc_info=True)
+                    repeat = None
+                if repeat is False:
+                    self.cancel(job)
+
+    def _wait_for_due_jobs(self) -> list[ScheduledJob]:
+        """Blocks until at least one job is due, then pops every live job due within the coalescing window."""
+        with self.condition:
+            while True:
+                while self.heap and (self.heap[0][3].cancelled or self.heap[0][2] != self.heap[0][3].generation):
+                    heapq.heappop(self.heap) # Stale entry of a cancelled or rescheduled job
+                if not self.heap:
+                    self.condition.wait()
+                    continue
+                wait = self.heap[0][0] - time.monotonic()
+                if wait <= 0:
+                    break
+                self.condition.wait(wait)
+            now = time.monotonic()
+            due_jobs = []
+            while self.heap and self.heap[0][0] <= now + self.coalesce_window:
+                _, _, generation, job = heapq.heappop(self.heap)
+                if job.cancelled or generation != job.generation:
+                    continue
+                due_jobs.append(job)
+            for job in due_jobs:
+                if job.interval is not None:
+                    # Keep the job's phase; skip missed runs instead of bursting to catch up
+                    self._push(job, max(job.due + job.interval, now))
+            return due_jobs
+
+
+scheduler = Scheduler()
+
 
 # --- API Setup using config.json ---
 CLIENT_ID = CONFIG.get("CLIENT_ID")
 CLIENT_SECRET = CONFIG.get("CLIENT_SECRET")
-sp = None  # Initialize API client as None
-
-if not CLIENT_ID or CLIENT_ID == "YOUR_CLIENT_ID_HERE" or \
-   not CLIENT_SECRET or CLIENT_SECRET == "YOUR_CLIENT_SECRET_HERE":
-    logging.warning("CLIENT_ID or CLIENT_SECRET is missing or not set in config.json.")
-    logging.warning(f"Please add your credentials to: {CONFIG_FILE_PATH}")
-    logging.warning("API-dependent features (e.g., Spotify links) will be disabled.")
-else:
+sp = None  # Initialize API client as None; built in the background by init_spotify_client()
+spotify_auth_manager = None
+spotify_ready = threading.Event() # Set once initialization has finished (successfully or not)
+spotify_init_lock = threading.Lock()
+spotify_init_started = False
+spotify_refresh_job: ScheduledJob | None = None
+
+def build_spotify_session():
+    """
+    Shared keep-alive session for the Spotify API and token endpoint, with
+    retry/backoff on connection errors, 429 and 5xx. 429 responses wait for the
+    server's Retry-After (capped at SPOTIFY_MAX_RETRY_AFTER).
+    """
+    class CappedRetry(urllib3_retry.Retry):
+        def get_retry_after(self, response):
+            retry_after = super().get_retry_after(response)
+            if retry_after is None:
+                return None
+            metrics.incr("spotify.rate_limited")
+            return min(retry_after, SPOTIFY_MAX_RETRY_AFTER)
+
+    retry = CappedRetry(
+        total=SPOTIFY_HTTP_RETRIES,
+        backoff_factor=SPOTIFY_HTTP_BACKOFF,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(["GET", "POST", "PUT", "DELETE"]),
+        respect_retry_after_header=True,
+        raise_on_status=False, # Let spotipy turn the final response into a SpotifyException
+    )
+    adapter = requests_adapters.HTTPAdapter(pool_connections=2, pool_maxsize=8, max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    return session
+
+def get_cached_spotify_token_expiry() -> float | None:
+    """Returns the expires_at timestamp of the cached token, if any."""
+    if spotify_auth_manager is None:
+        return None
     try:
-        auth_manager = SpotifyClientCredentials(client_id=CLIENT_ID, client_secret=CLIENT_SECRET)
-        sp = spotipy.Spotify(auth_manager=auth_manager)
-        sp.search(q='test', type='track', limit=1) # Test authentication
-        logging.info("API authentication successful using credentials from config.json.")
-    except spotipy.SpotifyException as e:
-        logging.error(f"API authentication failed (SpotifyException): {e}")
-        logging.error("Please ensure CLIENT_ID and CLIENT_SECRET in config.json are correct.")
-        sp = None
+        token_info = spotify_auth_manager.cache_handler.get_cached_token()
+        return float(token_info["expires_at"]) if token_info else None
+    except Exception as e:
+        logging.debug(f"Could not read cached Spotify token: {e}")
+        return None
+
+def refresh_spotify_token():
+    """Fetches a fresh token ahead of expiry (persisted to the cache) and schedules the next refresh."""
+    try:
+        with metrics.timer("spotify.token_refresh"):
+            spotify_auth_manager.get_access_token(as_dict=False, check_cache=False)
+        logging.info("Spotify access token refreshed in the background.")
+    except Exception as e:
+        logging.warning(f"Background Spotify token refresh failed: {e}")
+    schedule_spotify_token_refresh()
+
+def schedule_spotify_token_refresh():
+    """Schedules a token refresh SPOTIFY_TOKEN_REFRESH_MARGIN seconds before it expires."""
+    global spotify_refresh_job
+    expires_at = get_cached_spotify_token_expiry()
+    if expires_at is None:
+        return
+    delay = max(30.0, expires_at - time.time() - SPOTIFY_TOKEN_REFRESH_MARGIN)
+    if spotify_refresh_job is None:
+        spotify_refresh_job = scheduler.schedule("spotify_token_refresh", refresh_spotify_token, delay)
+    else:
+        scheduler.reschedule(spotify_refresh_job, delay)
+    logging.debug(f"Next Spotify token refresh in {delay:.0f}s.")
+
+def evict_stale_spotify_metadata():
+    """Drops stale entries from the Spotify metadata cache and persists it if anything changed (including last-used stamps)."""
+    try:
+        evicted = spotify_cache.evict_stale()
+        if evicted:
+            spotify_log.info("Evicted %s stale tracks from the Spotify metadata cache.", evicted)
+            spotify_cache.save()
+        else:
+            spotify_cache.save_if_dirty()
     except Exception as e:
-        logging.error(f"An unexpected error occurred during API authentication: {e}")
-        sp = None
+        logging.error(f"Error evicting stale Spotify metadata: {e}")
+
+def init_spotify_client():
+    """
+    Builds the Spotify client and validates the credentials by fetching a token.
+    A still-valid token cached by a previous run is reused without any request.
+    Runs on a background thread so startup never waits on the network.
+    """
+    global sp, spotify_auth_manager
+    try:
+        if not CLIENT_ID or CLIENT_ID == "YOUR_CLIENT_ID_HERE" or \
+           not CLIENT_SECRET or CLIENT_SECRET == "YOUR_CLIENT_SECRET_HERE":
+            logging.warning("CLIENT_ID or CLIENT_SECRET is missing or not set in config.json.")
+            logging.warning(f"Please add your credentials to: {CONFIG_FILE_PATH}")
+            logging.warning("API-dependent features (e.g., Spotify links) will be disabled.")
+            return
+        evict_stale_spotify_metadata()
+        try:
+            with startup_trace.phase("spotify client"):
+                session = build_spotify_session()
+                cache_handler = spotipy_cache_handler.CacheFileHandler(cache_path=SPOTIFY_TOKEN_CACHE_PATH)
+                auth_manager = spotipy_oauth2.SpotifyClientCredentials(
+                    client_id=CLIENT_ID, client_secret=CLIENT_SECRET,
+                    cache_handler=cache_handler, requests_session=session
+                )
+                client = spotipy.Spotify(auth_manager=auth_manager, requests_session=session, requests_timeout=10)
+                with metrics.timer("spotify.auth"):
+                    auth_manager.get_access_token(as_dict=False) # Cached token if still valid, else one token request
+            spotify_auth_manager = auth_manager
+            sp = client
+            logging.info("API authentication successful using credentials from config.json.")
+            schedule_spotify_token_refresh()
+        except spotipy.SpotifyException as e:
+            logging.error(f"API authentication failed (SpotifyException): {e}")
+            logging.error("Please ensure CLIENT_ID and CLIENT_SECRET in config.json are correct.")
+            sp = None
+        except Exception as e:
+            logging.error(f"An unexpected error occurred during API authentication: {e}")
+            sp = None
+    finally:
+        spotify_ready.set()
+
+def start_spotify_client_init():
+    """Starts init_spotify_client() on a background thread (once)."""
+    global spotify_init_started
+    with spotify_init_lock:
+        if spotify_init_started:
+            return
+        spotify_init_started = True
+    threading.Thread(target=init_spotify_client, name="spotify_init", daemon=True).start()
+
+def get_spotify_client(timeout: float = 15.0):
+    """Returns the Spotify client (or None), waiting for background initialization if needed."""
+    start_spotify_client_init()
+    if not spotify_ready.wait(timeout):
+        logging.warning("Spotify client is still initializing; try again shortly.")
+    return sp
 # --- End API Setup ---
 
 
@@ -233,176 +1099,1782 @@ def is_spotify_url(url: str) -> bool:
     """Check if the URL is a Spotify URL."""
     return url.startswith(("https://open.spotify.com/", "spotify:"))
 
+# --- Spotify Metadata Cache ---
+SPOTIFY_ID_PATTERN = re.compile(r"(track|playlist)[/:]([A-Za-z0-9]{22})")
+
+def parse_spotify_url(url: str) -> tuple[str, str] | None:
+    """Returns (kind, id) for a Spotify track/playlist URL or URI, e.g. ("playlist", "37i9dQZF1DXcBWIGoYBM5M")."""
+    match = SPOTIFY_ID_PATTERN.search(url)
+    return (match.group(1), match.group(2)) if match else None
+
+class SpotifyMetadataCache:
+    """
+    Local JSON cache of Spotify metadata keyed by Spotify id.
+    Tracks are immutable, so a cached track never needs a request; playlists
+    are stored with their snapshot_id and track list, so an unchanged
+    playlist is validated with one tiny request and only new tracks are fetched.
+    Playlist items without a track id (local files) are stored as {"query": str}.
+    Hits only stamp last_used in memory; it is written out with the next save.
+    """
+    def __init__(self, path: str, max_age_days: int = 30):
+        self.path = path
+        self.max_age = max_age_days * 86400
+        self.lock = threading.Lock()
+        self.tracks: dict[str, dict] = {}    # track id -> {"query": str, "cached_at": float, "last_used": float}
+        self.playlists: dict[str, dict] = {} # playlist id -> {"snapshot_id": str, "track_ids": [id or {"query": str}, ...], "cached_at": float, "last_used": float}
+        self.loaded = False
+        self.dirty = False # last_used stamps not yet written to disk
+
+    def _ensure_loaded(self):
+        if self.loaded:
+            return
+        self.loaded = True
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.tracks = data.get("tracks", {})
+            self.playlists = data.get("playlists", {})
+            spotify_log.info("Loaded Spotify metadata cache: %s tracks, %s playlists.", len(self.tracks), len(self.playlists))
+        except Exception as e:
+            logging.error(f"Error reading Spotify metadata cache {self.path}: {e}. Starting empty.")
+            self.tracks, self.playlists = {}, {}
+
+    def save(self):
+        with self.lock:
+            data = {"version": 1, "tracks": dict(self.tracks), "playlists": dict(self.playlists)}
+            self.dirty = False
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logging.error(f"Error writing Spotify metadata cache {self.path}: {e}")
+
+    def save_if_dirty(self):
+        if self.dirty:
+            self.save()
+
+    def _touch(self, entry: dict):
+        """Stamps a hit; eviction goes by last use, not by when the entry was fetched."""
+        entry["last_used"] = time.time()
+        self.dirty = True
+
+    def get_track_query(self, track_id: str) -> str | None:
+        with self.lock:
+            self._ensure_loaded()
+            entry = self.tracks.get(track_id)
+            if not entry:
+                return None
+            self._touch(entry)
+            return entry["query"]
+
+    def put_track_query(self, track_id: str, query: str):
+        with self.lock:
+            self._ensure_loaded()
+            now = time.time()
+            self.tracks[track_id] = {"query": query, "cached_at": now, "last_used": now}
+
+    def get_playlist(self, playlist_id: str) -> dict | None:
+        with self.lock:
+            self._ensure_loaded()
+            entry = self.playlists.get(playlist_id)
+            if entry:
+                self._touch(entry)
+            return entry
+
+    def put_playlist(self, playlist_id: str, snapshot_id: str, track_ids: list):
+        with self.lock:
+            self._ensure_loaded()
+            now = time.time()
+            self.playlists[playlist_id] = {"snapshot_id": snapshot_id, "track_ids": track_ids, "cached_at": now, "last_used": now}
+
+    def evict_stale(self) -> int:
+        """Drops playlists not used within max_age and tracks neither used since nor referenced by a cached playlist."""
+        def last_used(entry: dict) -> float:
+            return entry.get("last_used", entry.get("cached_at", 0))
+
+        with self.lock:
+            self._ensure_loaded()
+            cutoff = time.time() - self.max_age
+            self.playlists = {pid: p for pid, p in self.playlists.items() if last_used(p) >= cutoff}
+            referenced = {tid for p in self.playlists.values() for tid in p.get("track_ids", []) if isinstance(tid, str)}
+            before = len(self.tracks)
+            self.tracks = {tid: t for tid, t in self.tracks.items() if tid in referenced or last_used(t) >= cutoff}
+            return before - len(self.tracks)
+
+
+spotify_cache = SpotifyMetadataCache(SPOTIFY_METADATA_CACHE_PATH, CONFIG.get("spotify_cache_max_age_days", 30))
+
+def format_spotify_track_query(track: dict) -> str:
+    artists = ", ".join([artist["name"] for artist in track.get("artists", [])])
+    return f"{track['name']} {artists}"
+
+def fetch_spotify_track_queries(sp, track_ids: list[str]) -> int:
+    """Fetches and caches search queries for `track_ids` in batches of 50. Returns the number cached."""
+    fetched = 0
+    for i in range(0, len(track_ids), 50):
+        batch = track_ids[i:i + 50]
+        with metrics.timer("spotify.tracks"):
+            results = sp.tracks(batch)
+        for track in (results or {}).get("tracks", []):
+            if track and track.get("id") and track.get("name"):
+                spotify_cache.put_track_query(track["id"], format_spotify_track_query(track))
+                fetched += 1
+    return fetched
+
+def list_spotify_playlist_track_ids(sp, playlist_id: str) -> list:
+    """
+    Lists all tracks of a playlist (following pagination) as track ids, requesting
+    only the id, name and artist fields. Items without an id (local files) can't be
+    fetched later, so they are kept as {"query": str} built from their name and artists.
+    """
+    track_ids = []
+    with metrics.timer("spotify.playlist_items"):
+        results = sp.playlist_items(playlist_id, fields="items(track(id,name,artists(name))),next", limit=100)
+        while results:
+            for item in results.get("items", []):
+                track = item.get("track") if item else None
+                if track and track.get("id"):
+                    track_ids.append(track["id"])
+                elif track and track.get("name"):
+                    track_ids.append({"query": format_spotify_track_query(track)})
+                else:
+                    spotify_log.debug("Skipping partial track data in playlist: %s", playlist_id)
+            results = sp.next(results) if results.get("next") else None
+    return track_ids
+
+def cached_playlist_queries(playlist: dict) -> list[str]:
+    queries = []
+    for track_id in playlist.get("track_ids", []):
+        query = track_id.get("query") if isinstance(track_id, dict) else spotify_cache.get_track_query(track_id)
+        if query:
+            queries.append(query)
+    return queries
+
 def get_spotify_track_search_queries(url: str) -> list[str] | None:
     """
     Extract track search queries (e.g., "Track Name Artist1, Artist2")
-    from a Spotify track or playlist URL.
+    from a Spotify track or playlist URL, served from the local metadata cache when possible.
     Returns a list of search strings or None if an error occurs or API is unavailable.
     """
+    parsed = parse_spotify_url(url)
+    if not parsed:
+        spotify_log.warning("Unsupported Spotify URL type: %s. Expected 'track/' or 'playlist/'.", url)
+        return None
+    kind, spotify_id = parsed
+
+    # Cached tracks never change, and need no client at all (works offline)
+    if kind == "track":
+        cached_query = spotify_cache.get_track_query(spotify_id)
+        if cached_query:
+            metrics.incr("spotify.cache_hits")
+            return [cached_query]
+    cached_playlist = spotify_cache.get_playlist(spotify_id) if kind == "playlist" else None
+
+    sp = get_spotify_client()
     if not sp:
-        logging.error("Spotify API client not authenticated. Cannot process Spotify URL.")
-        logging.info(f"Ensure CLIENT_ID and CLIENT_SECRET are set correctly in {CONFIG_FILE_PATH}")
+        if cached_playlist:
+            spotify_log.warning("Spotify API unavailable; using cached playlist %s (may be outdated).", spotify_id)
+            metrics.incr("spotify.cache_offline_hits")
+            return cached_playlist_queries(cached_playlist) or None
+        spotify_log.error("Spotify API client not authenticated. Cannot process Spotify URL.")
+        spotify_log.info("Ensure CLIENT_ID and CLIENT_SECRET are set correctly in %s", CONFIG_FILE_PATH)
         return None
     try:
-        if "track/" in url:
-            track_info = sp.track(url)
+        if kind == "track":
+            metrics.incr("spotify.cache_misses")
+            with metrics.timer("spotify.track"):
+                track_info = sp.track(spotify_id)
             if not track_info or not track_info.get("name"):
-                logging.warning(f"Could not retrieve valid track info for Spotify URL: {url}")
+                spotify_log.warning("Could not retrieve valid track info for Spotify URL: %s", url)
                 return None
-            artists = ", ".join([artist["name"] for artist in track_info.get("artists", [])])
-            return [f"{track_info['name']} {artists}"]
-        elif "playlist/" in url:
-            results = sp.playlist_items(url, fields='items(track(name, artists(name)))')
-            if not results or not results.get("items"):
-                logging.warning(f"Could not retrieve valid playlist items for Spotify URL: {url}")
+            query = format_spotify_track_query(track_info)
+            spotify_cache.put_track_query(spotify_id, query)
+            spotify_cache.save()
+            return [query]
+        else:
+            try:
+                with metrics.timer("spotify.playlist_snapshot"):
+                    snapshot_id = (sp.playlist(spotify_id, fields="snapshot_id") or {}).get("snapshot_id")
+            except spotipy.SpotifyException:
+                raise
+            except Exception as e: # Network trouble: fall back to the cached copy if there is one
+                if cached_playlist:
+                    spotify_log.warning("Could not validate playlist %s (%s); using cached copy.", spotify_id, e)
+                    metrics.incr("spotify.cache_offline_hits")
+                    return cached_playlist_queries(cached_playlist) or None
+                raise
+
+            if cached_playlist and snapshot_id and cached_playlist.get("snapshot_id") == snapshot_id:
+                queries = cached_playlist_queries(cached_playlist)
+                if len(queries) == len(cached_playlist.get("track_ids", [])):
+                    metrics.incr("spotify.cache_hits")
+                    spotify_log.info("Playlist %s unchanged (snapshot %s); %s tracks served from cache.", spotify_id, snapshot_id, len(queries))
+                    return queries or None
+
+            metrics.incr("spotify.cache_misses")
+            track_ids = list_spotify_playlist_track_ids(sp, spotify_id)
+            if not track_ids:
+                spotify_log.warning("Could not retrieve valid playlist items for Spotify URL: %s", url)
                 return None
-            queries = []
-            for item in results["items"]:
-                if item and item.get("track") and item["track"].get("name"):
-                    track = item["track"]
-                    artists = ", ".join([artist["name"] for artist in track.get("artists", [])])
-                    queries.append(f"{track['name']} {artists}")
-                else:
-                    logging.debug(f"Skipping invalid or partial track data in playlist: {url}")
+            missing_ids = list(dict.fromkeys(tid for tid in track_ids if isinstance(tid, str) and spotify_cache.get_track_query(tid) is None))
+            if missing_ids:
+                fetch_spotify_track_queries(sp, missing_ids)
+            spotify_log.info("Playlist %s: %s tracks, %s fetched, %s from cache.", spotify_id, len(track_ids), len(missing_ids), len(track_ids) - len(missing_ids))
+            spotify_cache.put_playlist(spotify_id, snapshot_id or "", track_ids)
+            spotify_cache.save()
+            queries = cached_playlist_queries({"track_ids": track_ids})
             return queries if queries else None # Return None if no valid queries were generated
-        else:
-            logging.warning(f"Unsupported Spotify URL type: {url}. Expected 'track/' or 'playlist/'.")
-            return None
     except spotipy.SpotifyException as e:
-        logging.error(f"Spotify API error for {url}: {e}")
+        spotify_log.error("Spotify API error for %s: %s", url, e)
         if e.http_status == 401: # Unauthorized
-             logging.error("Spotify API request unauthorized. Check your CLIENT_ID and CLIENT_SECRET.")
+             spotify_log.error("Spotify API request unauthorized. Check your CLIENT_ID and CLIENT_SECRET.")
         elif e.http_status == 403: # Forbidden
-             logging.error("Spotify API request forbidden. Your credentials might be correct but lack permissions for this resource.")
+             spotify_log.error("Spotify API request forbidden. Your credentials might be correct but lack permissions for this resource.")
         elif e.http_status == 404: # Not Found
-             logging.error(f"Spotify resource not found: {url}")
+             spotify_log.error("Spotify resource not found: %s", url)
         # Add more specific Spotify error handling if needed
         return None
     except Exception as e: # Catch other potential errors (network issues, etc.)
-        logging.error(f"Unexpected error fetching Spotify data for {url}: {e}")
+        spotify_log.error("Unexpected error fetching Spotify data for %s: %s", url, e)
         return None
 
-def play_error_sound():
+# --- Notification Sounds ---
+class NotificationSound:
     """
-    Plays a short error sound.
-    Logs a warning if the sound file is missing or if playback fails.
+    Plays a short sound through one persistent, preloaded VLC player.
+    trigger() never blocks: it only flags a pending request for a worker thread,
+    so a burst of triggers (e.g. a failing 200-track import) coalesces into a
+    single playback, and playbacks are at least `min_interval` seconds apart.
     """
-    if not os.path.exists(ERROR_SOUND_PATH):
-        logging.warning(f"Error sound file not found at: {ERROR_SOUND_PATH}")
-        return
-    try:
-        error_player = vlc.MediaPlayer(ERROR_SOUND_PATH)
-        error_player.play()
-        time.sleep(0.1) # Small delay to allow playback start
-        error_player.release() # Release immediately
-    except Exception as e:
-        logging.error(f"Error playing error sound: {e}")
+    def __init__(self, path: str, min_interval: float = 1.0):
+        self.path = path
+        self.min_interval = min_interval
+        self.pending = threading.Event()
+        self.lock = threading.Lock()
+        self.thread: threading.Thread | None = None
+        self.player = None
+        self.last_played = 0.0
+        self.available = True # Cleared if the file is missing or VLC cannot open it
 
-def get_stream_url(query: str) -> list[str] | None:
-    """Get direct audio stream URL(s) from YouTube based on query or URL."""
-    global last_activity_time
-    last_activity_time = time.time()
-
-    ydl_opts = {
-        "format": "bestaudio/best",
-        "quiet": True,
-        "extract_audio": True,
-        "noplaylist": True,
-        "no_warnings": True,
-        "source_address": "0.0.0.0",
-        "default_search": "ytsearch1",
-        "skip_download": True,
-        "logtostderr": False,
-        "ignoreerrors": True, # Suppress yt-dlp's own error messages to console for unavailable videos
-        "no_warnings": True,
-        # "verbose": True, # Uncomment for debugging yt-dlp issues
-        # "dump_json": True, # Uncomment to see full JSON extract for debugging
-    }
-    stream_urls = []
-    try:
-        with youtube_dl.YoutubeDL(ydl_opts) as ydl:
-            logging.info(f"Searching for stream(s) for query/URL: '{query}'")
-            # extract_info can raise DownloadError for various reasons (video unavailable, network issues etc.)
-            info_dict = ydl.extract_info(query, download=False)
+    def start(self):
+        """Starts the worker thread, which preloads the sound before waiting for triggers."""
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="notification_sound", daemon=True)
+                self.thread.start()
 
-            if not info_dict:
-                logging.warning(f"yt-dlp found no information for query: '{query}'")
-                return None
+    def trigger(self):
+        """Requests the sound; returns immediately."""
+        if not self.available:
+            return
+        metrics.incr("notify.triggers")
+        if self.pending.is_set():
+            metrics.incr("notify.coalesced")
+        self.pending.set()
+        self.start()
+
+    def _prepare(self) -> bool:
+        if not os.path.exists(self.path):
+            logging.warning(f"Error sound file not found at: {self.path}")
+            return False
+        try:
+            instance = vlc.Instance("--no-xlib", "--quiet")
+            media = instance.media_new(self.path)
+            media.parse() # Local file: read headers now so the first trigger starts instantly
+            self.player = instance.media_player_new()
+            self.player.set_media(media)
+            return True
+        except Exception as e:
+            logging.error(f"Error preparing error sound: {e}")
+            return False
 
-            # Handle playlists or multiple search results
-            if "entries" in info_dict and info_dict["entries"]:
-                logging.info(f"Processing {len(info_dict['entries'])} entries from yt-dlp result...")
-                for entry in info_dict["entries"]:
-                    if entry and entry.get("url"): # 'url' here is the direct streamable URL
-                        stream_urls.append(entry["url"])
-                        logging.debug(f"Found stream URL for: {entry.get('title', 'Unknown Entry')}")
-                    else:
-                        logging.warning(f"Skipping entry with no stream URL: {entry.get('title', 'Unknown Entry') if entry else 'Invalid Entry'}")
-            # Handle single video result
-            elif info_dict.get("url"):
-                 stream_urls.append(info_dict["url"])
-                 logging.info(f"Found single stream URL for: {info_dict.get('title', 'Unknown Title')}")
-            else:
-                 logging.warning(f"No direct stream URL found in yt-dlp result for: '{query}'")
-                 # This case might occur if yt-dlp returns metadata but no streamable format.
-                 return None # No usable URLs
+    def _run(self):
+        if not self._prepare():
+            self.available = False
+            return
+        while True:
+            self.pending.wait()
+            wait = self.last_played + self.min_interval - time.monotonic()
+            if wait > 0:
+                time.sleep(wait) # Further triggers during the wait fold into this playback
+            self.pending.clear()
+            try:
+                self.player.stop() # Rewind if the previous playback is still running
+                self.player.play()
+                self.last_played = time.monotonic()
+                metrics.incr("notify.played")
+            except Exception as e:
+                logging.error(f"Error playing error sound: {e}")
 
-        return stream_urls if stream_urls else None
 
-    except youtube_dl.utils.DownloadError as e:
-        # This is a broad exception from yt-dlp, often for unavailable videos or network issues.
-        # yt-dlp (with ignoreerrors=True) might still return some info for playlists even if some items fail.
-        # However, if the initial query itself fails (e.g. invalid URL, no search results), it can land here.
-        logging.warning(f"yt-dlp download error for '{query}': {e}. This may indicate the video/playlist is unavailable or a network issue.")
-        # play_error_sound() # Potentially annoying if many items in a playlist fail
-        return stream_urls if stream_urls else None # Return any URLs found so far, or None
-    except Exception as e:
-        logging.error(f"Unexpected error during yt-dlp processing for '{query}': {e}", exc_info=True)
-        play_error_sound() # Play error for unexpected issues
-        return None
+error_sound = NotificationSound(ERROR_SOUND_PATH, CONFIG.get("error_sound_min_interval", 1.0))
 
+def play_error_sound():
+    """
+    Plays a short error sound without blocking the caller.
+    Logs a warning if the sound file is missing or if playback fails.
+    """
+    error_sound.trigger()
 
-# --- Playlist Management ---
-class PlaylistManager:
-    def __init__(self):
-        self.playlist: list[str] = []
+# --- Stream Sources ---
+class StreamSourceRegistry:
+    """
+    Remembers where each resolved stream URL came from (the video page URL or
+    search query) and its title, so expired or dead stream URLs can be
+    re-resolved later. Bounded LRU; the oldest entries are dropped first.
+    """
+    def __init__(self, max_entries: int = 5000):
         self.lock = threading.Lock()
-        self.current_song_url: str | None = None
-        self.loop_queue = False
-        # Playlist directory ensured during config load
+        self.max_entries = max_entries
+        self.entries: collections.OrderedDict[str, dict] = collections.OrderedDict()
 
-    def add_song(self, url: str):
+    def record(self, stream_url: str, source: str, title: str | None = None):
         with self.lock:
-            self.playlist.append(url)
-            logging.info(f"Added to queue: {url[:50]}...")
+            self.entries[stream_url] = {"source": source, "title": title, "resolved_at": time.time()}
+            self.entries.move_to_end(stream_url)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
 
-    def add_songs(self, urls: list[str]):
+    def get(self, stream_url: str) -> dict | None:
         with self.lock:
-            self.playlist.extend(urls)
-            logging.info(f"Added {len(urls)} songs to the queue.")
+            return self.entries.get(stream_url)
 
-    def get_next_song(self) -> str | None:
-        # Method unchanged
+    def forget(self, stream_url: str):
         with self.lock:
-            if not self.playlist:
-                if self.loop_queue and self.current_song_url:
-                    logging.info("Looping: Re-playing last song.")
-                    return self.current_song_url
-                else:
-                    self.current_song_url = None
-                    return None
-            next_song_url = self.playlist.pop(0)
-            if self.loop_queue and self.current_song_url:
-                if not self.playlist or self.playlist[-1] != self.current_song_url:
-                    self.playlist.append(self.current_song_url)
-            self.current_song_url = next_song_url
-            return self.current_song_url
+            self.entries.pop(stream_url, None)
 
-    def toggle_loop(self):
-        # Method unchanged
+    def find_fresh(self, source: str, min_lifetime: float) -> str | None:
+        """Newest stream URL resolved from `source` whose `expire=` timestamp is at least `min_lifetime` seconds away."""
+        deadline = time.time() + min_lifetime
         with self.lock:
-            self.loop_queue = not self.loop_queue
-            status = "ON" if self.loop_queue else "OFF"
+            candidates = [url for url, info in reversed(self.entries.items()) if info["source"] == source]
+        for stream_url in candidates:
+            expires_at = parse_stream_expiry(stream_url)
+            if expires_at is not None and expires_at > deadline:
+                return stream_url
+        return None
+
+
+stream_sources = StreamSourceRegistry()
+
+STREAM_EXPIRY_PATTERN = re.compile(r"[?&/]expire[=/](\d+)")
+
+def parse_stream_expiry(url: str) -> float | None:
+    """Returns the `expire=` timestamp embedded in a googlevideo-style stream URL, if any."""
+    match = STREAM_EXPIRY_PATTERN.search(url)
+    return float(match.group(1)) if match else None
+
+def re_resolve_stream(stream_url: str) -> str | None:
+    """Resolves a fresh stream URL for the source of `stream_url`. Returns None if unknown or unavailable."""
+    info = stream_sources.get(stream_url)
+    if not info:
+        return None
+    metrics.incr("resolve.re_resolutions")
+    fresh_urls = get_stream_url(info["source"])
+    return fresh_urls[0] if fresh_urls else None
+
+class ResolverProcess:
+    """One resolver worker process speaking resolver_worker's JSON-lines protocol over its stdin/stdout."""
+    def __init__(self, index: int):
+        self.index = index
+        self.process: subprocess.Popen | None = None
+
+    @staticmethod
+    def command() -> list[str]:
+        if getattr(sys, "frozen", False):
+            return [sys.executable, "--resolver-worker"]
+        return [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "resolver_worker.py")]
+
+    def ensure_started(self):
+        if self.process is not None and self.process.poll() is None:
+            return
+        with metrics.timer("resolve.worker_start"):
+            self.process = subprocess.Popen(
+                self.command(), stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                text=True, encoding="ascii", bufsize=1, # Protocol lines are ASCII-only JSON
+                creationflags=getattr(subprocess, "CREATE_NO_WINDOW", 0)
+            )
+            if not self.process.stdout.readline(): # "ready" once yt-dlp is imported
+                self.close()
+                raise OSError("resolver worker exited during startup")
+        resolve_log.info("Resolver worker %s started (pid %s).", self.index, self.process.pid)
+
+    def request(self, request_id: int, query: str) -> dict:
+        self.ensure_started()
+        try:
+            self.process.stdin.write(json.dumps({"id": request_id, "query": query}) + "\n")
+            self.process.stdin.flush()
+            line = self.process.stdout.readline()
+        except OSError:
+            self.close()
+            raise
+        if not line:
+            self.close()
+            raise OSError("resolver worker exited mid-request")
+        response = json.loads(line)
+        if response.get("id") != request_id:
+            self.close() # Out of sync; start over with a fresh process
+            raise OSError("resolver worker answered a different request")
+        return response
+
+    def close(self):
+        if self.process is not None:
+            with contextlib.suppress(Exception):
+                self.process.kill()
+            self.process = None
+
+
+class ResolverPool:
+    """
+    Warm pool of resolver worker processes for the "process" resolver backend.
+    Workers import yt-dlp once at startup and then serve requests for the life
+    of the app, so extraction runs outside this process's GIL without per-call
+    spawn cost. Only compact result records cross the pipe. Workers exit on
+    their own when the app's end of the pipe closes.
+    """
+    def __init__(self, size: int):
+        self.size = size
+        self.lock = threading.Lock()
+        self.idle: queue.SimpleQueue[ResolverProcess] = queue.SimpleQueue()
+        self.counter = itertools.count(1)
+        self.started = False
+
+    def start(self):
+        """Spawns and warms up all workers (called from the preload thread)."""
+        with self.lock:
+            if self.started:
+                return
+            self.started = True
+            workers = [ResolverProcess(i) for i in range(self.size)]
+        for worker in workers:
+            try:
+                worker.ensure_started()
+            except Exception as e:
+                resolve_log.error("Could not start resolver worker %s: %s", worker.index, e)
+            self.idle.put(worker) # A failed worker is retried on its first request
+
+    def extract(self, query: str) -> dict:
+        self.start()
+        worker = self.idle.get()
+        try:
+            return worker.request(next(self.counter), query)
+        finally:
+            self.idle.put(worker)
+
+
+resolver_pool = ResolverPool(CONFIG.get("resolver_workers", 2))
+
+def extract_stream_record(query: str) -> dict:
+    """Runs the extraction on the configured resolver backend, falling back to in-process if the pool fails."""
+    if CONFIG.get("resolver_backend") == "process":
+        try:
+            return resolver_pool.extract(query)
+        except Exception as e:
+            metrics.incr("resolve.worker_failures")
+            resolve_log.error("Resolver worker failed (%s); resolving in-process instead.", e)
+    return resolver_worker.extract(query)
+
+def get_stream_url(query: str) -> list[str] | None:
+    """Get direct audio stream URL(s) from YouTube based on query or URL."""
+    metrics.incr("resolve.calls")
+    resolve_log.info("Searching for stream(s) for query/URL: '%s'", query)
+    started = time.perf_counter()
+    with metrics.timer("resolve"):
+        record = extract_stream_record(query)
+    resolve_ms = (time.perf_counter() - started) * 1000.0
+
+    status = record["status"]
+    stream_urls = []
+    for stream_url, webpage_url, title in record["entries"]:
+        stream_urls.append(stream_url)
+        stream_sources.record(stream_url, webpage_url or query, title)
+        history.note_resolution(stream_url, "network", resolve_ms)
+        resolve_log.debug("Found stream URL for: %s", title or "Unknown Entry")
+    if record.get("skipped"):
+        resolve_log.warning("Skipped %s entries with no stream URL for: '%s'", record["skipped"], query)
+    if record["entries"]:
+        search_index.record_resolution(query, record["entries"])
+
+    if status == "empty":
+        resolve_log.warning("yt-dlp found no information for query: '%s'", query)
+        metrics.incr("resolve.empty")
+        return None
+    if status == "no_stream":
+        # This case might occur if yt-dlp returns metadata but no streamable format.
+        resolve_log.warning("No direct stream URL found in yt-dlp result for: '%s'", query)
+        return None
+    if status == "download_error":
+        # This is a broad exception from yt-dlp, often for unavailable videos or network issues.
+        resolve_log.warning("yt-dlp download error for '%s': %s. This may indicate the video/playlist is unavailable or a network issue.", query, record["error"])
+        metrics.incr("resolve.download_errors")
+        # play_error_sound() # Potentially annoying if many items in a playlist fail
+        return stream_urls if stream_urls else None
+    if status == "error":
+        resolve_log.error("Unexpected error during yt-dlp processing for '%s': %s", query, record["error"])
+        play_error_sound() # Play error for unexpected issues
+        return None
+    resolve_log.info("Found %s stream URL(s) for: '%s'", len(stream_urls), query)
+    return stream_urls if stream_urls else None
+
+
+# --- Stream Proxy ---
+class ChunkCache:
+    """
+    Bounded LRU of fixed-size stream chunks keyed by (stream token, chunk index).
+    Chunks evicted from memory spill to `disk_dir` when a disk budget is set;
+    the disk tier is per-session and cleared when the cache is created.
+    """
+    def __init__(self, memory_bytes: int, disk_dir: str, disk_bytes: int):
+        self.lock = threading.Lock()
+        self.memory_bytes = memory_bytes
+        self.disk_dir = disk_dir
+        self.disk_bytes = disk_bytes
+        self.memory: collections.OrderedDict[tuple[str, int], bytes] = collections.OrderedDict()
+        self.memory_used = 0
+        self.disk: collections.OrderedDict[tuple[str, int], int] = collections.OrderedDict() # key -> size
+        self.disk_used = 0
+        if disk_bytes > 0:
+            shutil.rmtree(disk_dir, ignore_errors=True)
+            os.makedirs(disk_dir, exist_ok=True)
+
+    def _disk_path(self, key: tuple[str, int]) -> str:
+        return os.path.join(self.disk_dir, f"{key[0]}_{key[1]}.chunk")
+
+    def contains(self, key: tuple[str, int]) -> bool:
+        with self.lock:
+            return key in self.memory or key in self.disk
+
+    def get(self, key: tuple[str, int]) -> bytes | None:
+        with self.lock:
+            data = self.memory.get(key)
+            if data is not None:
+                self.memory.move_to_end(key)
+                return data
+            if key not in self.disk:
+                return None
+            try:
+                with open(self._disk_path(key), "rb") as f:
+                    data = f.read()
+            except OSError:
+                self.disk_used -= self.disk.pop(key)
+                return None
+            self._put_memory(key, data) # Promote; a replay is likely to need its neighbours too
+            return data
+
+    def put(self, key: tuple[str, int], data: bytes):
+        with self.lock:
+            if key not in self.memory:
+                self._put_memory(key, data)
+
+    def _put_memory(self, key: tuple[str, int], data: bytes):
+        # Caller holds the lock
+        self.memory[key] = data
+        self.memory_used += len(data)
+        while self.memory_used > self.memory_bytes and len(self.memory) > 1:
+            old_key, old_data = self.memory.popitem(last=False)
+            self.memory_used -= len(old_data)
+            self._spill(old_key, old_data)
+
+    def _spill(self, key: tuple[str, int], data: bytes):
+        # Caller holds the lock
+        if self.disk_bytes <= 0 or key in self.disk:
+            return
+        try:
+            with open(self._disk_path(key), "wb") as f:
+                f.write(data)
+        except OSError as e:
+            playback_log.warning("Could not spill stream chunk to disk: %s", e)
+            return
+        self.disk[key] = len(data)
+        self.disk_used += len(data)
+        while self.disk_used > self.disk_bytes and self.disk:
+            old_key, size = self.disk.popitem(last=False)
+            self.disk_used -= size
+            with contextlib.suppress(OSError):
+                os.remove(self._disk_path(old_key))
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"memory_chunks": len(self.memory), "memory_bytes": self.memory_used,
+                    "disk_chunks": len(self.disk), "disk_bytes": self.disk_used}
+
+
+class StreamProxyHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, so VLC's range requests reuse the connection
+    headers_sent = False # Set once the current response's headers are out; an error can then only close the connection
+
+    def end_headers(self):
+        super().end_headers()
+        self.headers_sent = True
+
+    def do_GET(self):
+        stream_proxy.serve(self, send_body=True)
+
+    def do_HEAD(self):
+        stream_proxy.serve(self, send_body=False)
+
+    def log_message(self, format, *args):
+        playback_log.debug("Stream proxy: " + format, *args)
+
+
+class StreamProxy:
+    """
+    Localhost HTTP proxy that VLC plays network streams from. Upstream bytes are
+    fetched with range requests in STREAM_PROXY_CHUNK_SIZE chunks (plus a little
+    read-ahead) and kept in a ChunkCache, so backward seeks, replays and forward
+    seeks into already-fetched data are served locally without touching the
+    network. Upstreams that ignore Range are passed through uncached.
+    """
+    HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.server: http.server.ThreadingHTTPServer | None = None
+        self.streams: collections.OrderedDict[str, dict] = collections.OrderedDict() # token -> upstream info
+        self.cache: ChunkCache | None = None
+
+    def start(self):
+        with self.lock:
+            if self.server is not None:
+                return
+            self.cache = ChunkCache(
+                CONFIG.get("stream_proxy_memory_mb", 64) * 1024 * 1024,
+                STREAM_CACHE_DIR, CONFIG.get("stream_proxy_disk_mb", 0) * 1024 * 1024
+            )
+            server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StreamProxyHandler)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name="stream_proxy", daemon=True).start()
+            self.server = server
+            playback_log.info("Stream proxy listening on 127.0.0.1:%s", server.server_address[1])
+
+    def proxy_url(self, upstream_url: str) -> str:
+        """Registers `upstream_url` and returns the local URL VLC should open instead."""
+        self.start()
+        token = hashlib.sha1(upstream_url.encode("utf-8")).hexdigest()[:20] # Same URL (e.g. loop replay) -> same cached chunks
+        with self.lock:
+            if token not in self.streams:
+                self.streams[token] = {"url": upstream_url, "length": None, "content_type": None, "ranged": True,
+                                       "fetch_lock": threading.Lock()}
+            self.streams.move_to_end(token)
+            while len(self.streams) > STREAM_PROXY_MAX_STREAMS:
+                self.streams.popitem(last=False)
+        return f"http://127.0.0.1:{self.server.server_address[1]}/{token}"
+
+    def serve(self, handler: StreamProxyHandler, send_body: bool):
+        token = handler.path.lstrip("/").split("?", 1)[0]
+        handler.headers_sent = False
+        with self.lock:
+            stream = self.streams.get(token)
+            learned = stream is not None and (stream["length"] is not None or not stream["ranged"])
+        if stream is None:
+            handler.send_error(404)
+            return
+        try:
+            if not learned:
+                self._get_chunk(token, stream, 0) # Learns length and content type from the first range response
+            with self.lock:
+                length, ranged, content_type = stream["length"], stream["ranged"], stream["content_type"]
+            if not ranged:
+                self._pass_through(handler, stream, send_body)
+                return
+            byte_range = self._parse_range(handler.headers.get("Range"), length)
+            if byte_range is None:
+                handler.send_response(416)
+                handler.send_header("Content-Range", f"bytes */{length}")
+                handler.send_header("Content-Length", "0")
+                handler.end_headers()
+                return
+            start, end = byte_range
+            handler.send_response(206 if handler.headers.get("Range") else 200)
+            handler.send_header("Content-Type", content_type or "application/octet-stream")
+            handler.send_header("Accept-Ranges", "bytes")
+            handler.send_header("Content-Length", str(end - start + 1))
+            if handler.headers.get("Range"):
+                handler.send_header("Content-Range", f"bytes {start}-{end}/{length}")
+            handler.end_headers()
+            if not send_body:
+                return
+            position = start
+            while position <= end:
+                index = position // STREAM_PROXY_CHUNK_SIZE
+                chunk = self._get_chunk(token, stream, index)
+                offset = position - index * STREAM_PROXY_CHUNK_SIZE
+                piece = chunk[offset:offset + end - position + 1]
+                if not piece:
+                    break # Upstream shorter than advertised
+                handler.wfile.write(piece)
+                position += len(piece)
+        except (BrokenPipeError, ConnectionResetError, ConnectionAbortedError):
+            pass # VLC closed the connection (seek or stop); normal
+        except Exception as e:
+            metrics.incr("proxy.upstream_errors")
+            playback_log.warning("Stream proxy upstream error for %s...: %s", stream["url"][:70], e)
+            if handler.headers_sent:
+                handler.close_connection = True # Mid-body: a second status line would corrupt the stream VLC reads
+            else:
+                with contextlib.suppress(Exception):
+                    handler.send_error(502)
+
+    @staticmethod
+    def _parse_range(header: str | None, length: int) -> tuple[int, int] | None:
+        """Parses a single `bytes=` range against a known `length`; returns the inclusive (start, end) or None if unsatisfiable."""
+        if not header:
+            return (0, length - 1) if length > 0 else None
+        match = re.fullmatch(r"bytes=(\d*)-(\d*)", header.strip())
+        if not match or not (match.group(1) or match.group(2)):
+            return (0, length - 1) if length > 0 else None # Unsupported form; serve everything
+        if not match.group(1): # Suffix range: last N bytes
+            start, end = max(0, length - int(match.group(2))), length - 1
+        else:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), length - 1) if match.group(2) else length - 1
+        return (start, end) if start <= end else None
+
+    def _get_chunk(self, token: str, stream: dict, index: int) -> bytes:
+        key = (token, index)
+        chunk = self.cache.get(key)
+        if chunk is not None:
+            metrics.incr("proxy.chunk_hits")
+            return chunk
+        with stream["fetch_lock"]: # One upstream fetch per stream at a time; a waiting reader usually finds its chunk cached
+            chunk = self.cache.get(key)
+            if chunk is not None:
+                metrics.incr("proxy.chunk_hits")
+                return chunk
+            last = index + STREAM_PROXY_READAHEAD - 1
+            if stream["length"] is not None:
+                last = min(last, (stream["length"] - 1) // STREAM_PROXY_CHUNK_SIZE)
+            for ahead in range(index + 1, last + 1):
+                if self.cache.contains((token, ahead)):
+                    last = ahead - 1 # Stop the read-ahead at data we already have
+                    break
+            end = (last + 1) * STREAM_PROXY_CHUNK_SIZE - 1
+            if stream["length"] is not None:
+                end = min(end, stream["length"] - 1)
+            data = self._fetch_range(stream, index * STREAM_PROXY_CHUNK_SIZE, end)
+            metrics.incr("proxy.chunk_misses")
+            metrics.incr("proxy.bytes_fetched", len(data))
+            for offset in range(0, len(data), STREAM_PROXY_CHUNK_SIZE):
+                self.cache.put((token, index + offset // STREAM_PROXY_CHUNK_SIZE), data[offset:offset + STREAM_PROXY_CHUNK_SIZE])
+            return data[:STREAM_PROXY_CHUNK_SIZE]
+
+    def _fetch_range(self, stream: dict, start: int, end: int) -> bytes:
+        request = urllib.request.Request(stream["url"], headers={**self.HEADERS, "Range": f"bytes={start}-{end}"})
+        with metrics.timer("proxy.upstream_fetch"):
+            with urllib.request.urlopen(request, timeout=STREAM_PROXY_TIMEOUT) as response:
+                total = response.headers.get("Content-Range", "").rsplit("/", 1)[-1]
+                with self.lock: # serve() reads these without the fetch lock
+                    stream["content_type"] = stream["content_type"] or response.headers.get("Content-Type")
+                    if response.status != 206 or (stream["length"] is None and not total.isdigit()):
+                        # Range ignored, or total unknown ("bytes 0-N/*"): serve this stream by plain pass-through
+                        stream["ranged"] = False
+                        if response.status != 206:
+                            stream["length"] = int(response.headers.get("Content-Length") or 0)
+                        return b""
+                    if stream["length"] is None:
+                        stream["length"] = int(total)
+                data = response.read()
+        expected_end = end if stream["length"] is None else min(end, stream["length"] - 1)
+        if len(data) != expected_end - start + 1:
+            raise IOError(f"short read from upstream ({len(data)} of {expected_end - start + 1} bytes)")
+        return data
+
+    def _pass_through(self, handler: StreamProxyHandler, stream: dict, send_body: bool):
+        request = urllib.request.Request(stream["url"], headers=self.HEADERS)
+        with urllib.request.urlopen(request, timeout=STREAM_PROXY_TIMEOUT) as response:
+            handler.send_response(200)
+            handler.send_header("Content-Type", response.headers.get("Content-Type") or "application/octet-stream")
+            if response.headers.get("Content-Length"):
+                handler.send_header("Content-Length", response.headers["Content-Length"])
+            handler.end_headers()
+            if send_body:
+                shutil.copyfileobj(response, handler.wfile, STREAM_PROXY_CHUNK_SIZE)
+
+    def format_stats(self) -> str:
+        if self.cache is None:
+            return "Stream proxy not running."
+        stats = self.cache.stats()
+        return (f"Stream proxy: {len(self.streams)} streams, {stats['memory_chunks']} chunks in memory "
+                f"({stats['memory_bytes'] / 1048576:.1f} MB), {stats['disk_chunks']} on disk ({stats['disk_bytes'] / 1048576:.1f} MB)")
+
+
+stream_proxy = StreamProxy()
+
+def media_url_for(url: str) -> str:
+    """The URL VLC should open for a queue entry: the local proxy for network streams when enabled."""
+    if not CONFIG.get("stream_proxy_enabled") or not url.startswith(("http://", "https://")):
+        return url
+    try:
+        return stream_proxy.proxy_url(url)
+    except Exception as e:
+        playback_log.error("Stream proxy unavailable, playing directly: %s", e)
+        return url
+
+
+# --- Downloads ---
+class PositionalWriter:
+    """
+    Writes blocks at absolute offsets of a preallocated file from several
+    threads without seeking: os.pwrite where available, otherwise (Windows)
+    through a shared writable mmap of the file.
+    """
+    def __init__(self, file, length: int):
+        self.fd = file.fileno()
+        self.map = None
+        if not hasattr(os, "pwrite") and length > 0:
+            self.map = mmap.mmap(self.fd, length, access=mmap.ACCESS_WRITE)
+
+    def write(self, offset: int, data: memoryview):
+        if self.map is not None:
+            self.map[offset:offset + len(data)] = data
+            return
+        while data:
+            written = os.pwrite(self.fd, data, offset)
+            data = data[written:]
+            offset += written
+
+    def close(self):
+        if self.map is not None:
+            self.map.flush()
+            self.map.close()
+
+
+class RangeDownloader:
+    """
+    Downloads a stream over several keep-alive connections: the file is split
+    into `segment_size` ranges that worker threads pull from a shared queue,
+    each reading straight into a reusable buffer and writing it at its offset
+    in a preallocated `.part` file. The result is checked against the
+    server-reported length before being renamed into place. Servers that do not
+    support ranges get a single plain download.
+    """
+    HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+    def __init__(self, connections: int, segment_size: int):
+        self.connections = connections
+        self.segment_size = segment_size
+        self.lock = threading.Lock()
+
+    def probe(self, url: str) -> tuple[str, int | None, str | None]:
+        """Returns (final URL after redirects, total length if ranges are supported, content type)."""
+        request = urllib.request.Request(url, headers={**self.HEADERS, "Range": "bytes=0-0"})
+        with urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT) as response:
+            content_type = response.headers.get("Content-Type")
+            total = response.headers.get("Content-Range", "").rsplit("/", 1)[-1]
+            if response.status == 206 and total.isdigit():
+                return response.geturl(), int(total), content_type
+            return response.geturl(), None, content_type
+
+    def download(self, url: str, dest_path: str, probed: tuple[str, int | None, str | None] | None = None) -> dict:
+        """Downloads `url` (reusing an earlier probe() result if given) to `dest_path`; returns {"bytes", "seconds", "mb_per_s", "connections"}."""
+        if os.path.exists(dest_path):
+            raise FileExistsError(f"'{dest_path}' already exists")
+        started = time.perf_counter()
+        final_url, length, _content_type = probed or self.probe(url)
+        part_path = dest_path + ".part"
+        try:
+            if length is None:
+                written, connections = self._download_single(final_url, part_path), 1
+            else:
+                written, connections = self._download_ranges(final_url, part_path, length), None
+            os.replace(part_path, dest_path)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(part_path)
+            raise
+        seconds = max(time.perf_counter() - started, 1e-6)
+        return {"bytes": written, "seconds": seconds, "mb_per_s": written / 1048576 / seconds,
+                "connections": connections or min(self.connections, max(1, -(-length // self.segment_size)))}
+
+    def _download_ranges(self, url: str, part_path: str, length: int) -> int:
+        segments: queue.SimpleQueue[tuple[int, int]] = queue.SimpleQueue()
+        for start in range(0, length, self.segment_size):
+            segments.put((start, min(start + self.segment_size, length) - 1))
+        received = collections.Counter()
+        errors: list[Exception] = []
+        with open(part_path, "wb+") as f:
+            f.truncate(length) # Preallocate so every worker can write at its own offset
+            writer = PositionalWriter(f, length)
+            try:
+                workers = [
+                    threading.Thread(target=self._range_worker, args=(url, segments, writer, received, errors),
+                                     name=f"download_{i}", daemon=True)
+                    for i in range(min(self.connections, segments.qsize()))
+                ]
+                for worker in workers:
+                    worker.start()
+                for worker in workers:
+                    worker.join()
+            finally:
+                writer.close()
+        if errors:
+            raise errors[0]
+        if received["bytes"] != length or os.path.getsize(part_path) != length:
+            raise IOError(f"download incomplete: got {received['bytes']} of {length} bytes")
+        return length
+
+    def _range_worker(self, url: str, segments: queue.SimpleQueue, writer: PositionalWriter,
+                      received: collections.Counter, errors: list):
+        parsed = urllib.parse.urlsplit(url)
+        connection_class = http.client.HTTPSConnection if parsed.scheme == "https" else http.client.HTTPConnection
+        path = parsed.path + (f"?{parsed.query}" if parsed.query else "")
+        connection = None
+        buffer = bytearray(DOWNLOAD_READ_SIZE)
+        view = memoryview(buffer)
+        while not errors:
+            try:
+                start, end = segments.get_nowait()
+            except queue.Empty:
+                break
+            for attempt in range(1, DOWNLOAD_SEGMENT_RETRIES + 1):
+                try:
+                    if connection is None:
+                        connection = connection_class(parsed.netloc, timeout=DOWNLOAD_TIMEOUT)
+                    connection.request("GET", path, headers={**self.HEADERS, "Range": f"bytes={start}-{end}"})
+                    response = connection.getresponse()
+                    if response.status != 206 or not response.headers.get("Content-Range", "").startswith(f"bytes {start}-{end}/"):
+                        response.read()
+                        raise IOError(f"unexpected response for range {start}-{end}: HTTP {response.status}")
+                    position = start
+                    while position <= end:
+                        count = response.readinto(view[:min(DOWNLOAD_READ_SIZE, end - position + 1)])
+                        if not count:
+                            raise IOError(f"connection closed at byte {position} of range {start}-{end}")
+                        writer.write(position, view[:count])
+                        position += count
+                    with self.lock:
+                        received["bytes"] += end - start + 1
+                    break
+                except Exception as e:
+                    if connection is not None:
+                        connection.close()
+                        connection = None
+                    if attempt == DOWNLOAD_SEGMENT_RETRIES:
+                        errors.append(e)
+                        break
+                    resolve_log.debug("Retrying range %s-%s (attempt %s): %s", start, end, attempt + 1, e)
+        if connection is not None:
+            connection.close()
+
+    def _download_single(self, url: str, part_path: str) -> int:
+        request = urllib.request.Request(url, headers=self.HEADERS)
+        with urllib.request.urlopen(request, timeout=DOWNLOAD_TIMEOUT) as response, open(part_path, "wb") as f:
+            expected = response.headers.get("Content-Length")
+            shutil.copyfileobj(response, f, DOWNLOAD_READ_SIZE)
+            written = f.tell()
+        if expected is not None and int(expected) != written:
+            raise IOError(f"download incomplete: got {written} of {expected} bytes")
+        return written
+
+
+def download_file_name(stream_url: str, content_type: str | None) -> str:
+    """Builds a safe file name from the stream's recorded title and its content type."""
+    info = stream_sources.get(stream_url) or {}
+    title = info.get("title") or urllib.parse.urlsplit(stream_url).path.rsplit("/", 1)[-1] or "download"
+    title = re.sub(r'[<>:"/\\|?*\x00-\x1f]', "_", title).strip(" .")[:100] or "download"
+    mime = (content_type or "").split(";", 1)[0].strip()
+    extension = {"audio/webm": ".webm", "audio/mp4": ".m4a", "audio/mpeg": ".mp3"}.get(mime) or mimetypes.guess_extension(mime) or ".bin"
+    return title + extension
+
+def reserve_download_path(directory: str, file_name: str) -> str:
+    """
+    Returns a path in `directory` that no earlier or running download uses:
+    "Title.webm", else "Title (2).webm", ... The name is claimed by creating
+    its .part file exclusively, so two downloads of one title never share it.
+    """
+    stem, extension = os.path.splitext(file_name)
+    for n in itertools.count(1):
+        dest_path = os.path.join(directory, file_name if n == 1 else f"{stem} ({n}){extension}")
+        if os.path.exists(dest_path):
+            continue
+        try:
+            with open(dest_path + ".part", "xb"):
+                pass
+        except FileExistsError:
+            continue
+        return dest_path
+
+def download_streams(stream_urls: list[str]):
+    """Downloads resolved streams one after another into DOWNLOADS_DIR, printing the rate for each."""
+    os.makedirs(DOWNLOADS_DIR, exist_ok=True)
+    downloader = RangeDownloader(CONFIG.get("download_connections", 4), CONFIG.get("download_segment_mb", 2) * 1024 * 1024)
+    for stream_url in stream_urls:
+        try:
+            probed = downloader.probe(stream_url)
+            dest_path = reserve_download_path(DOWNLOADS_DIR, download_file_name(stream_url, probed[2]))
+            with metrics.timer("download"):
+                result = downloader.download(stream_url, dest_path, probed)
+            metrics.incr("downloads.completed")
+            metrics.incr("downloads.bytes", result["bytes"])
+            logging.info(f"Downloaded {dest_path}: {result['bytes']} bytes in {result['seconds']:.1f}s "
+                         f"({result['mb_per_s']:.2f} MB/s, {result['connections']} connections)")
+            print(f"Downloaded '{os.path.basename(dest_path)}': {result['bytes'] / 1048576:.1f} MB in "
+                  f"{result['seconds']:.1f}s ({result['mb_per_s']:.2f} MB/s over {result['connections']} connections)")
+        except Exception as e:
+            metrics.incr("downloads.failed")
+            logging.error(f"Download failed for {stream_url[:70]}...: {e}")
+            print(f"Error: Download failed: {e}")
+            play_error_sound()
+
+
+# --- Local Music Library ---
+def read_audio_tags(path: str) -> dict:
+    """
+    Title/artist/album/duration for a local file. Uses mutagen when installed;
+    otherwise (or for untagged files) parses "Artist - Title" from the file name.
+    """
+    tags = {"title": None, "artist": None, "album": None, "duration": None}
+    try:
+        audio = mutagen.File(path, easy=True)
+        if audio is not None:
+            for key in ("title", "artist", "album"):
+                values = audio.get(key) if audio.tags is not None else None
+                tags[key] = values[0] if values else None
+            tags["duration"] = getattr(audio.info, "length", None)
+    except ImportError:
+        pass # mutagen not installed
+    except Exception as e:
+        library_log.debug("Could not read tags from %s: %s", path, e)
+    if not tags["title"]:
+        stem = os.path.splitext(os.path.basename(path))[0]
+        artist, separator, title = stem.partition(" - ")
+        tags["title"] = title.strip() if separator else stem
+        tags["artist"] = tags["artist"] or (artist.strip() if separator else None)
+    return tags
+
+
+class MusicLibrary:
+    """
+    SQLite index of local audio files under the configured folders. Each row
+    keeps the file's mtime/size fingerprint, so a rescan only reads tags for
+    new or changed files and deletes rows for files that are gone. Scans run on
+    a worker thread; searches work against whatever is indexed so far.
+    """
+    AUDIO_EXTENSIONS = {".mp3", ".flac", ".m4a", ".aac", ".ogg", ".opus", ".wav", ".wma", ".webm"}
+    WRITE_BATCH = 200 # Rows per transaction during a scan, so searches are never blocked for long
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.lock = threading.Lock() # Serializes use of the shared connection
+        self.db: sqlite3.Connection | None = None
+        self.scan_lock = threading.Lock() # Held for the duration of a scan
+        self.last_scan: dict | None = None
+
+    def _connection(self) -> sqlite3.Connection:
+        # Caller holds self.lock
+        if self.db is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS library_tracks (
+                    path TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL,
+                    size INTEGER NOT NULL,
+                    title TEXT, artist TEXT, album TEXT, duration REAL,
+                    search_text TEXT NOT NULL,
+                    indexed_at REAL NOT NULL
+                )""")
+            db.commit()
+            self.db = db
+        return self.db
+
+    @staticmethod
+    def iter_audio_files(folder: str):
+        """Yields (path, stat) for audio files under `folder`, recursively, using scandir's cached stat data."""
+        pending = [folder]
+        while pending:
+            directory = pending.pop()
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                pending.append(entry.path)
+                            elif os.path.splitext(entry.name)[1].lower() in MusicLibrary.AUDIO_EXTENSIONS:
+                                yield os.path.abspath(entry.path), entry.stat()
+                        except OSError:
+                            continue
+            except OSError as e:
+                library_log.warning("Cannot scan library folder %s: %s", directory, e)
+
+    def rescan(self, folders: list[str]) -> dict:
+        """Incrementally syncs the index with `folders`; returns counts of added/updated/removed/unchanged files."""
+        with self.scan_lock:
+            started = time.perf_counter()
+            with self.lock:
+                known = {path: (mtime_ns, size) for path, mtime_ns, size in
+                         self._connection().execute("SELECT path, mtime_ns, size FROM library_tracks")}
+            counts = collections.Counter()
+            seen = set()
+            batch = []
+            for folder in folders:
+                for path, stat in self.iter_audio_files(os.path.expanduser(folder)):
+                    seen.add(path)
+                    fingerprint = (stat.st_mtime_ns, stat.st_size)
+                    previous = known.get(path)
+                    if previous == fingerprint:
+                        counts["unchanged"] += 1
+                        continue
+                    counts["updated" if previous else "added"] += 1
+                    tags = read_audio_tags(path)
+                    search_text = " ".join(filter(None, (tags["artist"], tags["title"], tags["album"], os.path.basename(path)))).lower()
+                    batch.append((path, *fingerprint, tags["title"], tags["artist"], tags["album"], tags["duration"], search_text, time.time()))
+                    if len(batch) >= self.WRITE_BATCH:
+                        self._write(batch, [])
+                        batch = []
+            removed = [(path,) for path in known if path not in seen]
+            self._write(batch, removed)
+            counts["removed"] = len(removed)
+            if counts["added"] or counts["updated"] or counts["removed"]:
+                search_index.request_library_sync()
+            self.last_scan = {**counts, "seconds": time.perf_counter() - started, "finished_at": time.time()}
+            metrics.observe("library.rescan", self.last_scan["seconds"] * 1000.0)
+            return self.last_scan
+
+    def _write(self, rows: list[tuple], removed: list[tuple]):
+        if not rows and not removed:
+            return
+        with self.lock:
+            db = self._connection()
+            with db:
+                db.executemany("INSERT OR REPLACE INTO library_tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+                db.executemany("DELETE FROM library_tracks WHERE path = ?", removed)
+
+    def start_rescan(self, folders: list[str], announce: bool = False) -> bool:
+        """Starts a background rescan unless one is already running. Returns False if one was running."""
+        if self.scan_lock.locked():
+            return False
+        def run():
+            try:
+                result = self.rescan(folders)
+                message = (f"Library scan finished in {result['seconds']:.1f}s: {result.get('added', 0)} added, "
+                           f"{result.get('updated', 0)} updated, {result.get('removed', 0)} removed, {result.get('unchanged', 0)} unchanged.")
+                library_log.info(message)
+                if announce:
+                    print(message)
+            except Exception as e:
+                library_log.error("Library scan failed: %s", e, exc_info=True)
+                if announce:
+                    print(f"Error: Library scan failed: {e}")
+        threading.Thread(target=run, name="library_scan", daemon=True).start()
+        return True
+
+    def search(self, query: str, limit: int = 20) -> list[dict]:
+        """Tracks whose artist/title/album/file name contain every word of `query`."""
+        words = query.lower().split()
+        if not words:
+            return []
+        clauses = " AND ".join(["search_text LIKE ? ESCAPE '\\'"] * len(words))
+        patterns = ["%" + re.sub(r"([%_\\])", r"\\\1", word) + "%" for word in words]
+        with self.lock:
+            rows = self._connection().execute(
+                f"SELECT path, title, artist, album, duration FROM library_tracks WHERE {clauses} ORDER BY artist, title LIMIT ?",
+                (*patterns, limit)
+            ).fetchall()
+        return [{"path": path, "title": title, "artist": artist, "album": album, "duration": duration}
+                for path, title, artist, album, duration in rows]
+
+    def title_for(self, path: str) -> str | None:
+        with self.lock:
+            row = self._connection().execute("SELECT title, artist FROM library_tracks WHERE path = ?", (path,)).fetchone()
+        if not row:
+            return None
+        return f"{row[1]} - {row[0]}" if row[1] else row[0]
+
+    def count(self) -> int:
+        with self.lock:
+            return self._connection().execute("SELECT COUNT(*) FROM library_tracks").fetchone()[0]
+
+
+library = MusicLibrary(APP_DB_PATH)
+
+def format_library_track(track: dict) -> str:
+    name = f"{track['artist']} - {track['title']}" if track["artist"] else track["title"]
+    duration = f" [{int(track['duration']) // 60}:{int(track['duration']) % 60:02d}]" if track.get("duration") else ""
+    return f"{name}{duration}"
+
+def start_library_rescans():
+    """Scans the library folders now and then every library_rescan_minutes (if configured)."""
+    folders = CONFIG.get("library_folders")
+    if not folders:
+        return
+    library.start_rescan(folders)
+    minutes = CONFIG.get("library_rescan_minutes", 60)
+    if minutes > 0:
+        def rescan_job():
+            library.start_rescan(folders) # Returns at once; the scan runs on its own worker thread
+        scheduler.schedule("library_rescan", rescan_job, minutes * 60, interval=minutes * 60)
+
+
+# --- Local Search Index ---
+SEARCH_PREFIX_PATTERN = re.compile(r"^ytsearch\d*:")
+
+def normalize_search_query(query: str) -> str | None:
+    """Lower-cased, whitespace-collapsed free text of a query; None for URLs."""
+    text = " ".join(SEARCH_PREFIX_PATTERN.sub("", query.strip()).lower().split())
+    if not text or text.startswith(("http://", "https://")):
+        return None
+    return text
+
+def trigrams(text: str) -> set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """
+    Fuzzy lookup over everything known locally: library tracks, past
+    query -> YouTube video resolutions and how often each was played, kept in
+    one SQLite FTS5 table with the trigram tokenizer. A search first requires
+    every word as a substring (ranked by bm25 and play count); if nothing
+    matches it falls back to trigram overlap, which tolerates typos. Without
+    FTS5/trigram support in the SQLite build, LIKE matching is used instead.
+
+    Writes from the resolver and playback threads are queued and flushed by a
+    scheduler job in one transaction, so callers never wait on the database.
+    """
+    FLUSH_DELAY = 2.0 # seconds; writes arriving within this window share a transaction
+    MAX_QUERIES = 10 # Remembered queries per resolution
+    FUZZY_MIN_SIMILARITY = 0.5 # Share of the query's trigrams a fuzzy match must contain
+    STRONG_MATCH_COVERAGE = 0.5 # Query length / title length above which `play` trusts a past resolution
+    CANDIDATES = 200 # Rows ranked in Python per search
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.lock = threading.Lock() # Serializes use of the shared connection
+        self.db: sqlite3.Connection | None = None
+        self.fts = False
+        self.pending: collections.deque[tuple] = collections.deque()
+        self.pending_lock = threading.Lock() # Makes "was empty + append" atomic with flush() taking the batch
+        self.flush_job = ScheduledJob("search_index_flush", self.flush, None)
+
+    def _connection(self) -> sqlite3.Connection:
+        # Caller holds self.lock
+        if self.db is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            db = sqlite3.connect(self.db_path, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS search_entries (
+                    id INTEGER PRIMARY KEY,
+                    kind TEXT NOT NULL, -- "library" (target: file path) or "resolution" (target: video page URL)
+                    target TEXT NOT NULL,
+                    title TEXT NOT NULL,
+                    keywords TEXT NOT NULL DEFAULT '', -- Library: tags and file name; resolution: queries that found it
+                    plays INTEGER NOT NULL DEFAULT 0,
+                    last_used REAL,
+                    UNIQUE (kind, target)
+                )""")
+            try:
+                db.executescript("""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS search_fts USING fts5(
+                        title, keywords, content='search_entries', content_rowid='id', tokenize='trigram');
+                    CREATE TRIGGER IF NOT EXISTS search_entries_ai AFTER INSERT ON search_entries BEGIN
+                        INSERT INTO search_fts(rowid, title, keywords) VALUES (new.id, new.title, new.keywords);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS search_entries_ad AFTER DELETE ON search_entries BEGIN
+                        INSERT INTO search_fts(search_fts, rowid, title, keywords) VALUES ('delete', old.id, old.title, old.keywords);
+                    END;
+                    CREATE TRIGGER IF NOT EXISTS search_entries_au AFTER UPDATE OF title, keywords ON search_entries BEGIN
+                        INSERT INTO search_fts(search_fts, rowid, title, keywords) VALUES ('delete', old.id, old.title, old.keywords);
+                        INSERT INTO search_fts(rowid, title, keywords) VALUES (new.id, new.title, new.keywords);
+                    END;""")
+                self.fts = True
+            except sqlite3.OperationalError as e:
+                library_log.info("SQLite FTS5 trigram search unavailable (%s); using LIKE matching.", e)
+            self.db = db
+            with db:
+                self._sync_library(db)
+        return self.db
+
+    # --- Writes (queued) ---
+    def _enqueue(self, operation: tuple):
+        # The first write after a flush took the batch schedules the next flush
+        with self.pending_lock:
+            first = not self.pending
+            self.pending.append(operation)
+        if first:
+            scheduler.reschedule(self.flush_job, self.FLUSH_DELAY)
+
+    def record_resolution(self, query: str, entries: list):
+        """Remembers which videos a query (or URL) resolved to; `entries` are [stream_url, webpage_url, title]."""
+        self._enqueue(("resolution", normalize_search_query(query), time.time(),
+                       [(webpage_url, title) for _, webpage_url, title in entries if webpage_url and title]))
+
+    def request_library_sync(self):
+        self._enqueue(("library",))
+
+    def on_track_started(self, event: str, payload: dict):
+        url = payload["url"]
+        if url.startswith(("http://", "https://")):
+            info = stream_sources.get(url)
+            if not info:
+                return
+            kind, target = "resolution", info["source"]
+        else:
+            kind, target = "library", url
+        self._enqueue(("play", kind, target, time.time()))
+
+    def flush(self):
+        """Applies all queued writes in one transaction."""
+        with self.pending_lock:
+            operations = list(self.pending)
+            self.pending.clear()
+        if not operations:
+            return
+        try:
+            with self.lock:
+                db = self._connection()
+                with db:
+                    for operation in operations:
+                        if operation[0] == "resolution":
+                            self._write_resolution(db, *operation[1:])
+                        elif operation[0] == "play":
+                            db.execute("UPDATE search_entries SET plays = plays + 1, last_used = ? WHERE kind = ? AND target = ?",
+                                       (operation[3], operation[1], operation[2]))
+                        elif operation[0] == "library":
+                            self._sync_library(db)
+        except Exception as e:
+            library_log.error("Search index update failed (%s queued changes dropped): %s", len(operations), e)
+
+    def _write_resolution(self, db: sqlite3.Connection, query: str | None, resolved_at: float, videos: list[tuple]):
+        for webpage_url, title in videos:
+            row = db.execute("SELECT keywords FROM search_entries WHERE kind = 'resolution' AND target = ?", (webpage_url,)).fetchone()
+            queries = row[0].split("\n") if row and row[0] else []
+            if query and query not in queries:
+                queries = (queries + [query])[-self.MAX_QUERIES:]
+            db.execute("""
+                INSERT INTO search_entries (kind, target, title, keywords, last_used) VALUES ('resolution', ?, ?, ?, ?)
+                ON CONFLICT (kind, target) DO UPDATE SET title = excluded.title, keywords = excluded.keywords, last_used = excluded.last_used""",
+                (webpage_url, title, "\n".join(queries), resolved_at))
+
+    @staticmethod
+    def _sync_library(db: sqlite3.Connection):
+        """
+        Mirrors library_tracks into the index (the library scanner owns that table).
+        Runs in the caller's transaction, so it commits together with the rest of the flush.
+        """
+        if not db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'library_tracks'").fetchone():
+            return
+        db.execute("""
+            INSERT INTO search_entries (kind, target, title, keywords)
+            SELECT 'library', path, CASE WHEN artist IS NULL THEN title ELSE artist || ' - ' || title END, search_text
+            FROM library_tracks WHERE true
+            ON CONFLICT (kind, target) DO UPDATE SET title = excluded.title, keywords = excluded.keywords
+            WHERE search_entries.title IS NOT excluded.title OR search_entries.keywords IS NOT excluded.keywords""")
+        db.execute("DELETE FROM search_entries WHERE kind = 'library' AND target NOT IN (SELECT path FROM library_tracks)")
+
+    # --- Reads ---
+    def search(self, query: str, limit: int = 10) -> tuple[list[dict], bool]:
+        """Ranked matches for free text; returns (results, fuzzy) where fuzzy means no entry contained every word."""
+        text = normalize_search_query(query)
+        if not text:
+            return [], False
+        words = text.split()
+        with self.lock:
+            db = self._connection()
+            long_words = [word for word in words if len(word) >= 3] # The trigram tokenizer cannot match shorter terms
+            if self.fts and long_words:
+                expression = " ".join('"' + word.replace('"', '""') + '"' for word in long_words)
+                rows = db.execute(
+                    "SELECT e.kind, e.target, e.title, e.keywords, e.plays, e.last_used, -bm25(search_fts) FROM search_fts "
+                    "JOIN search_entries e ON e.id = search_fts.rowid WHERE search_fts MATCH ? ORDER BY bm25(search_fts) LIMIT ?",
+                    (expression, self.CANDIDATES)
+                ).fetchall()
+            else:
+                clauses = " AND ".join(["(title || ' ' || keywords) LIKE ? ESCAPE '\\'"] * len(words))
+                patterns = ["%" + re.sub(r"([%_\\])", r"\\\1", word) + "%" for word in words]
+                rows = db.execute(
+                    f"SELECT kind, target, title, keywords, plays, last_used, 1.0 FROM search_entries WHERE {clauses} LIMIT ?",
+                    (*patterns, self.CANDIDATES)
+                ).fetchall()
+            # Short words are checked here; relevance also rewards queries that cover more of the title
+            rows = [row[:6] + (row[6] * (0.5 + len(text) / max(len(row[2]), len(text))),) for row in rows
+                    if all(word in f"{row[2]} {row[3]}".lower() for word in words)]
+            fuzzy = not rows
+            if fuzzy:
+                rows = self._fuzzy_candidates(db, text)
+        results = [{"kind": kind, "target": target, "title": title, "queries": keywords.split("\n") if kind == "resolution" else [],
+                    "plays": plays, "last_used": last_used, "score": relevance * (1.0 + 0.25 * math.log1p(plays))}
+                   for kind, target, title, keywords, plays, last_used, relevance in rows]
+        results.sort(key=lambda result: result["score"], reverse=True)
+        return results[:limit], fuzzy
+
+    def _fuzzy_candidates(self, db: sqlite3.Connection, text: str) -> list[tuple]:
+        # Caller holds self.lock
+        query_trigrams = set().union(*(trigrams(word) for word in text.split()))
+        if not query_trigrams:
+            return []
+        if self.fts:
+            expression = " OR ".join('"' + trigram.replace('"', '""') + '"' for trigram in query_trigrams)
+            rows = db.execute(
+                "SELECT e.kind, e.target, e.title, e.keywords, e.plays, e.last_used FROM search_fts "
+                "JOIN search_entries e ON e.id = search_fts.rowid WHERE search_fts MATCH ? ORDER BY bm25(search_fts) LIMIT ?",
+                (expression, self.CANDIDATES)
+            ).fetchall()
+        else:
+            rows = db.execute("SELECT kind, target, title, keywords, plays, last_used FROM search_entries").fetchall()
+        candidates = []
+        for row in rows:
+            similarity = len(query_trigrams & trigrams(f"{row[2]} {row[3]}".lower())) / len(query_trigrams)
+            if similarity >= self.FUZZY_MIN_SIMILARITY:
+                candidates.append(row + (similarity,))
+        return candidates
+
+    def lookup(self, query: str) -> dict | None:
+        """
+        Strong match for a `play` query: a library file that contains every
+        word, or a past resolution found by the same query (or whose title the
+        query mostly covers). Fuzzy matches are never played automatically.
+        """
+        text = normalize_search_query(query)
+        if not text:
+            return None
+        results, fuzzy = self.search(text, limit=5)
+        if fuzzy:
+            return None
+        for result in results:
+            if result["kind"] == "library":
+                if CONFIG.get("library_folders") and os.path.exists(result["target"]):
+                    return result
+            elif text in result["queries"] or len(text) >= self.STRONG_MATCH_COVERAGE * len(result["title"]):
+                return result
+        return None
+
+    def count(self) -> int:
+        with self.lock:
+            return self._connection().execute("SELECT COUNT(*) FROM search_entries").fetchone()[0]
+
+
+search_index = SearchIndex(APP_DB_PATH)
+event_bus.subscribe(TRACK_STARTED, search_index.on_track_started)
+
+def format_search_result(result: dict) -> str:
+    label = "library" if result["kind"] == "library" else "youtube"
+    if result["plays"]:
+        label += f", played {result['plays']}x"
+    return f"[{label}] {result['title']}"
+
+def find_local_match(query: str) -> list[str] | None:
+    """
+    Streams for a `play` query from the local search index: the library file,
+    a still-valid stream URL resolved earlier, or a fresh one resolved from the
+    remembered video page (skipping the YouTube search). None if no strong match.
+    """
+    if not CONFIG.get("local_search", True) or not normalize_search_query(query):
+        return None
+    started = time.perf_counter()
+    try:
+        with metrics.timer("search.lookup"):
+            match = search_index.lookup(query)
+    except Exception as e:
+        library_log.error("Local search lookup failed for '%s': %s", query, e)
+        return None
+    if not match:
+        return None
+    if match["kind"] == "library":
+        metrics.incr("search.library_hits")
+        library_log.info("Playing '%s' from the local library: %s", query, match["target"])
+        history.note_resolution(match["target"], "local", (time.perf_counter() - started) * 1000.0)
+        return [match["target"]]
+    metrics.incr("search.resolution_hits")
+    fresh_url = stream_sources.find_fresh(match["target"], CONFIG.get("stream_expiry_margin", 300))
+    if fresh_url:
+        resolve_log.info("Reusing a cached stream for '%s': %s", query, match["title"])
+        history.note_resolution(fresh_url, "cache", (time.perf_counter() - started) * 1000.0)
+        return [fresh_url]
+    resolve_log.info("Resolved '%s' locally to %s (%s); fetching its stream.", query, match["title"], match["target"])
+    return get_stream_url(match["target"])
+
+
+# --- Play History ---
+class HistoryStore:
+    """
+    One SQLite row per play: where the stream came from (local file, cached
+    stream URL or a network resolution) and how long resolving took, the time
+    to first audio, how long it played, the bytes VLC read, and how it ended
+    (finished/skipped/stopped/error). Event handlers only put records on a
+    queue; the "history_writer" thread commits them in batched transactions,
+    so recording never blocks the playback loop or the event bus.
+    """
+    BATCH_SIZE = 100 # Records per transaction at most
+    BATCH_WINDOW = 1.0 # seconds to wait for more records before committing a batch
+    MAX_PENDING_RESOLUTIONS = 1000 # Resolved-but-not-yet-played stream URLs remembered for attribution
+    OUTCOMES = {"ended": "finished", "skipped": "skipped", "stopped": "stopped", "released": "stopped", "error": "error"}
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.records: queue.SimpleQueue[tuple | None] = queue.SimpleQueue()
+        self.thread: threading.Thread | None = None
+        self.lock = threading.Lock() # Guards resolutions and the play counter
+        self.resolutions: collections.OrderedDict[str, tuple[str, float]] = collections.OrderedDict() # url -> (origin, resolve_ms)
+        self.play_ids = itertools.count(1)
+        self.current: dict[str, int] = {} # url -> play id of the track currently playing from it
+        self.db: sqlite3.Connection | None = None # Writer thread only
+        self.row_ids: dict[int, int] = {} # play id -> rowid; writer thread only
+        self.stopped = threading.Event()
+
+    def note_resolution(self, url: str, origin: str, resolve_ms: float):
+        """Remembers how `url` was obtained ("local", "cache" or "network") for when it starts playing."""
+        with self.lock:
+            self.resolutions[url] = (origin, resolve_ms)
+            self.resolutions.move_to_end(url)
+            while len(self.resolutions) > self.MAX_PENDING_RESOLUTIONS:
+                self.resolutions.popitem(last=False)
+
+    def on_track_started(self, event: str, payload: dict):
+        url = payload["url"]
+        info = stream_sources.get(url) or {}
+        with self.lock:
+            origin, resolve_ms = self.resolutions.pop(url, (None, None))
+            play_id = next(self.play_ids)
+            self.current[url] = play_id
+        if origin is None: # Queued earlier or replayed by loop mode; nothing was resolved for this play
+            origin = "cache" if url.startswith(("http://", "https://")) else "local"
+        self.records.put(("started", play_id, time.time(), url, info.get("source") or url, payload.get("title") or info.get("title"),
+                          origin, resolve_ms, payload.get("first_audio_ms")))
+
+    def on_track_ended(self, event: str, payload: dict):
+        with self.lock:
+            play_id = self.current.pop(payload["url"], None)
+        if play_id is not None:
+            self.records.put(("ended", play_id, time.time(), self.OUTCOMES.get(payload["state"], payload["state"]),
+                              payload.get("played_ms"), payload.get("bytes")))
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="history_writer", daemon=True)
+            self.thread.start()
+
+    def close(self, timeout: float = 2.0):
+        """Commits everything queued so far (called at shutdown)."""
+        if self.thread is not None and self.thread.is_alive():
+            self.records.put(None)
+            self.stopped.wait(timeout)
+
+    def _connection(self) -> sqlite3.Connection:
+        # Writer thread only
+        if self.db is None:
+            os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+            db = sqlite3.connect(self.db_path)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("""
+                CREATE TABLE IF NOT EXISTS play_history (
+                    id INTEGER PRIMARY KEY,
+                    started_at REAL NOT NULL,
+                    ended_at REAL,
+                    url TEXT NOT NULL,
+                    source TEXT NOT NULL, -- Video page URL, search query or file path
+                    title TEXT,
+                    origin TEXT NOT NULL, -- "local", "cache" or "network"
+                    outcome TEXT NOT NULL, -- "playing", "finished", "skipped", "stopped", "error" or "interrupted"
+                    resolve_ms REAL,
+                    first_audio_ms REAL,
+                    played_ms INTEGER,
+                    bytes INTEGER
+                )""")
+            db.execute("CREATE INDEX IF NOT EXISTS play_history_started_at ON play_history (started_at)")
+            with db:
+                db.execute("UPDATE play_history SET outcome = 'interrupted' WHERE outcome = 'playing'") # Left over from a crash
+            self.db = db
+        return self.db
+
+    def run(self):
+        while True:
+            batch = [self.records.get()]
+            deadline = time.monotonic() + self.BATCH_WINDOW
+            while batch[-1] is not None and len(batch) < self.BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.records.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            records = [record for record in batch if record is not None]
+            try:
+                with metrics.timer("history.write"):
+                    self._write(records)
+            except Exception as e:
+                logging.error("Failed to write %s play history record(s): %s", len(records), e)
+            if batch[-1] is None:
+                self.stopped.set()
+                return
+
+    def _write(self, records: list[tuple]):
+        if not records:
+            return
+        db = self._connection()
+        with db:
+            for record in records:
+                if record[0] == "started":
+                    cursor = db.execute(
+                        "INSERT INTO play_history (started_at, url, source, title, origin, outcome, resolve_ms, first_audio_ms) "
+                        "VALUES (?, ?, ?, ?, ?, 'playing', ?, ?)", record[2:])
+                    self.row_ids[record[1]] = cursor.lastrowid
+                else:
+                    row_id = self.row_ids.pop(record[1], None)
+                    if row_id is not None:
+                        db.execute("UPDATE play_history SET ended_at = ?, outcome = ?, played_ms = ?, bytes = ? WHERE id = ?",
+                                   (*record[2:], row_id))
+
+    def _read(self, sql: str, parameters: tuple = ()) -> list[tuple]:
+        # Readers use their own short-lived connection; WAL lets them run alongside the writer
+        if not os.path.exists(self.db_path):
+            return []
+        with contextlib.closing(sqlite3.connect(self.db_path)) as db:
+            try:
+                return db.execute(sql, parameters).fetchall()
+            except sqlite3.OperationalError: # Table not created yet
+                return []
+
+    def recent(self, limit: int = 20) -> list[tuple]:
+        return self._read("SELECT started_at, title, source, origin, outcome, resolve_ms, first_audio_ms, played_ms, bytes "
+                          "FROM play_history ORDER BY id DESC LIMIT ?", (limit,))
+
+    def format_recent(self, limit: int = 20) -> str:
+        rows = self.recent(limit)
+        if not rows:
+            return "No plays recorded yet."
+        lines = [f"\n--- Last {len(rows)} Plays ---"]
+        for started_at, title, source, origin, outcome, resolve_ms, first_audio_ms, played_ms, size in rows:
+            details = [origin]
+            if resolve_ms is not None:
+                details.append(f"resolve {resolve_ms:.0f}ms")
+            if first_audio_ms is not None:
+                details.append(f"first audio {first_audio_ms:.0f}ms")
+            if played_ms:
+                details.append(f"played {played_ms // 60000}:{played_ms // 1000 % 60:02d}")
+            if size:
+                details.append(f"{size / 1048576:.1f} MB")
+            lines.append(f"  {time.strftime('%m-%d %H:%M', time.localtime(started_at))} [{outcome}] {(title or source)[:50]} ({', '.join(details)})")
+        lines.append("-------------------------\n")
+        return "\n".join(lines)
+
+    def format_stats(self, days: int = 30) -> str:
+        """Per-origin play counts and resolve/first-audio latency percentiles over the last `days` days."""
+        since = time.time() - days * 86400
+        rows = self._read("SELECT origin, outcome, resolve_ms, first_audio_ms, bytes FROM play_history WHERE started_at >= ?", (since,))
+        if not rows:
+            return f"No plays recorded in the last {days} days."
+        by_origin: dict[str, list[tuple]] = collections.defaultdict(list)
+        for row in rows:
+            by_origin[row[0]].append(row)
+        outcomes = collections.Counter(row[1] for row in rows)
+        lines = [f"\n--- Play History ({days} days) ---",
+                 f"Plays: {len(rows)}  " + "  ".join(f"{outcome.capitalize()}: {count}" for outcome, count in outcomes.most_common()),
+                 f"Transferred: {sum(row[4] or 0 for row in rows) / 1048576:.1f} MB"]
+        for origin, origin_rows in sorted(by_origin.items()):
+            parts = [f"  {origin:<8} {len(origin_rows):>5} plays"]
+            for label, index in (("resolve", 2), ("first audio", 3)):
+                values = sorted(row[index] for row in origin_rows if row[index] is not None)
+                if values:
+                    p50 = values[int(0.50 * (len(values) - 1))]
+                    p95 = values[int(0.95 * (len(values) - 1))]
+                    parts.append(f"{label} p50 {p50:.0f}ms p95 {p95:.0f}ms")
+            lines.append("  ".join(parts))
+        lines.append("-------------------------\n")
+        return "\n".join(lines)
+
+
+history = HistoryStore(APP_DB_PATH)
+if CONFIG.get("history_enabled", True):
+    event_bus.subscribe(TRACK_STARTED, history.on_track_started)
+    event_bus.subscribe(TRACK_ENDED, history.on_track_ended)
+
+
+# --- Playlist Management ---
+class QueueSnapshot(NamedTuple):
+    """Immutable view of the queue state, published atomically after every change."""
+    version: int
+    items: tuple[str, ...]
+    current_song_url: str | None
+    loop_queue: bool
+
+class PlaylistManager:
+    """
+    Queue state with copy-on-write snapshots: writers serialize on `lock` and
+    publish a new immutable QueueSnapshot when done; readers just grab
+    `self.snapshot` (a single atomic attribute read) and never take the lock.
+    """
+    def __init__(self):
+        self.playlist: list[str] = [] # Writer-side state; only touch while holding self.lock
+        self.lock = threading.Lock()
+        self.current_song_url: str | None = None
+        self.loop_queue = False
+        self.clear_count = 0 # Bumped whenever the queue is emptied or replaced, so pending retries can tell
+        self.snapshot = QueueSnapshot(0, (), None, False)
+        self.listeners: list[Callable[[QueueSnapshot], None]] = []
+        # Playlist directory ensured during config load
+
+    @contextlib.contextmanager
+    def _mutation(self):
+        """Holds the writer lock for the block, then publishes and announces the new snapshot."""
+        with self.lock:
+            try:
+                yield
+            finally: # Publish even if the block failed part-way, so readers never see stale state
+                snapshot = self._publish()
+        if snapshot is not None:
+            self._notify(snapshot)
+
+    def _publish(self) -> QueueSnapshot | None:
+        """Publishes the current state if it changed (caller holds the lock). Returns the new snapshot or None."""
+        previous = self.snapshot
+        items = tuple(self.playlist)
+        if items == previous.items and self.current_song_url == previous.current_song_url and self.loop_queue == previous.loop_queue:
+            return None
+        self.snapshot = QueueSnapshot(previous.version + 1, items, self.current_song_url, self.loop_queue)
+        return self.snapshot
+
+    def subscribe(self, listener: Callable[[QueueSnapshot], None]):
+        """Registers `listener(snapshot)` to be called (outside the lock) after every queue change."""
+        self.listeners.append(listener)
+
+    def _notify(self, snapshot: QueueSnapshot):
+        for listener in list(self.listeners):
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logging.error(f"Error in queue change listener {listener}: {e}")
+
+    def add_song(self, url: str):
+        with self._mutation():
+            self.playlist.append(url)
+            queue_log.info("Added to queue: %s...", url[:50])
+
+    def add_songs(self, urls: list[str]):
+        with self._mutation():
+            self.playlist.extend(urls)
+            queue_log.info("Added %s songs to the queue.", len(urls))
+
+    def get_next_song(self) -> str | None:
+        # Method unchanged
+        with self._mutation():
+            if not self.playlist:
+                if self.loop_queue and self.current_song_url:
+                    queue_log.info("Looping: Re-playing last song.")
+                    return self.current_song_url
+                else:
+                    self.current_song_url = None
+                    return None
+            next_song_url = self.playlist.pop(0)
+            if self.loop_queue and self.current_song_url:
+                if not self.playlist or self.playlist[-1] != self.current_song_url:
+                    self.playlist.append(self.current_song_url)
+            self.current_song_url = next_song_url
+            return self.current_song_url
+
+    def toggle_loop(self):
+        # Method unchanged
+        with self._mutation():
+            self.loop_queue = not self.loop_queue
+            status = "ON" if self.loop_queue else "OFF"
             logging.info(f"Loop queue toggled: {status}")
             if self.loop_queue and self.current_song_url and self.current_song_url not in self.playlist:
                  self.playlist.append(self.current_song_url)
@@ -411,20 +2883,19 @@ class PlaylistManager:
 
     def clear(self):
         # Method unchanged
-        with self.lock:
+        with self._mutation():
             self.playlist.clear()
             self.current_song_url = None
+            self.clear_count += 1
             logging.info("Playlist cleared.")
 
     def is_empty(self) -> bool:
-        # Method unchanged
-        with self.lock:
-            return not bool(self.playlist)
+        return not self.snapshot.items
 
     # --- NEW/MODIFIED METHODS for Queue Management ---
     def shuffle(self):
         """Shuffles the current playlist."""
-        with self.lock:
+        with self._mutation():
             if not self.playlist:
                 logging.info("Playlist is empty, cannot shuffle.")
                 print("Playlist is empty, cannot shuffle.")
@@ -462,15 +2933,12 @@ class PlaylistManager:
         return os.path.join(PLAYLISTS_DIR, basename)
 
     def save_queue(self, filename: str):
-        """Saves the current playlist URLs to a file."""
+        """Saves the current playlist URLs to a file. Raises CommandError if it can't."""
         filepath = self._get_playlist_filepath(filename)
         if not filepath:
-            play_error_sound()
-            print("Error: Invalid playlist filename.")
-            return
+            raise CommandError("Error: Invalid playlist filename.")
 
-        with self.lock:
-            playlist_copy = list(self.playlist)
+        playlist_copy = self.snapshot.items
 
         if not playlist_copy:
             logging.warning("Queue is empty, nothing to save.")
@@ -485,26 +2953,20 @@ class PlaylistManager:
             print(f"Playlist saved as '{os.path.basename(filepath)}'")
         except IOError as e:
             logging.error(f"Error saving playlist to {filepath}: {e}")
-            print(f"Error: Could not save playlist file: {e}")
-            play_error_sound()
+            raise CommandError(f"Error: Could not save playlist file: {e}") from e
         except Exception as e:
             logging.error(f"Unexpected error saving playlist: {e}")
-            print(f"Error: An unexpected error occurred while saving: {e}")
-            play_error_sound()
+            raise CommandError(f"Error: An unexpected error occurred while saving: {e}") from e
 
     def load_queue(self, filename: str, append: bool = False):
-        """Loads playlist URLs from a file, replacing or appending to the current queue."""
+        """Loads playlist URLs from a file, replacing or appending to the current queue. Raises CommandError if it can't."""
         filepath = self._get_playlist_filepath(filename)
         if not filepath:
-            play_error_sound()
-            print("Error: Invalid playlist filename.")
-            return
+            raise CommandError("Error: Invalid playlist filename.")
 
         if not os.path.exists(filepath):
             logging.error(f"Playlist file not found: {filepath}")
-            print(f"Error: Playlist file '{os.path.basename(filepath)}' not found.")
-            play_error_sound()
-            return
+            raise CommandError(f"Error: Playlist file '{os.path.basename(filepath)}' not found.")
 
         loaded_urls = []
         try:
@@ -514,177 +2976,1084 @@ class PlaylistManager:
                     if url and not url.startswith('#'): # Ignore empty lines and comments
                         loaded_urls.append(url)
 
-            if not loaded_urls:
-                logging.warning(f"Playlist file '{filepath}' is empty or contains no valid URLs.")
-                print(f"Playlist file '{os.path.basename(filepath)}' is empty.")
+            if not loaded_urls:
+                logging.warning(f"Playlist file '{filepath}' is empty or contains no valid URLs.")
+                print(f"Playlist file '{os.path.basename(filepath)}' is empty.")
+                return
+
+            with self._mutation():
+                if not append:
+                    self.playlist.clear()
+                    self.current_song_url = None
+                    self.clear_count += 1
+                    action_msg = "replaced"
+                else:
+                    action_msg = "appended to"
+                self.playlist.extend(loaded_urls)
+
+            logging.info(f"Playlist loaded from {filepath} ({len(loaded_urls)} tracks), {action_msg} queue.")
+            print(f"Loaded {len(loaded_urls)} tracks from '{os.path.basename(filepath)}'. Queue {action_msg}.")
+
+        except IOError as e:
+            logging.error(f"Error loading playlist from {filepath}: {e}")
+            raise CommandError(f"Error: Could not load playlist file: {e}") from e
+        except Exception as e:
+            logging.error(f"Unexpected error loading playlist: {e}")
+            raise CommandError(f"Error: An unexpected error occurred while loading: {e}") from e
+
+    def restore(self, items: list[str], loop_queue: bool):
+        """Replaces the whole queue state (used when restoring the previous session)."""
+        with self._mutation():
+            self.playlist = list(items)
+            self.current_song_url = None
+            self.loop_queue = loop_queue
+            self.clear_count += 1
+
+    def view_queue(self) -> tuple[str, ...]:
+        """Returns the current (immutable) playlist without locking."""
+        return self.snapshot.items
+
+    def set_current_song(self, url: str):
+        """Replaces the current song URL (e.g. after re-resolving an expired stream)."""
+        with self._mutation():
+            self.current_song_url = url
+
+    def remove_at(self, index: int) -> str | None:
+        """Removes a song at the specified index (0-based). Returns the URL of the removed song or None."""
+        with self._mutation():
+            if 0 <= index < len(self.playlist):
+                removed_url = self.playlist.pop(index)
+                logging.info(f"Removed item at index {index}: {removed_url[:70]}...")
+                return removed_url
+            else:
+                logging.warning(f"Invalid index for removal: {index}. Queue size: {len(self.playlist)}")
+                return None
+
+    def push_front(self, url: str, clear_count: int | None = None) -> bool:
+        """
+        Queues `url` to play next (used to retry a failed entry). With
+        `clear_count`, does nothing if the queue was cleared or replaced since
+        that count was read. Returns whether `url` was queued.
+        """
+        with self._mutation():
+            if clear_count is not None and clear_count != self.clear_count:
+                return False
+            self.playlist.insert(0, url)
+            return True
+
+    def discard_current(self):
+        """Forgets the current song so loop mode does not re-append it (e.g. after it failed for good)."""
+        with self._mutation():
+            self.current_song_url = None
+
+    def replace_entry(self, old_url: str, new_url: str) -> bool:
+        """Replaces the first queued occurrence of `old_url` (e.g. with a re-resolved stream URL)."""
+        with self._mutation():
+            try:
+                index = self.playlist.index(old_url)
+            except ValueError:
+                return False
+            self.playlist[index] = new_url
+            return True
+
+    def remove_entry(self, url: str) -> bool:
+        """Removes the first queued occurrence of `url`. Returns False if it is no longer queued."""
+        with self._mutation():
+            try:
+                self.playlist.remove(url)
+                return True
+            except ValueError:
+                return False
+
+    def get_current_song_title(self) -> str | None:
+        """Attempts to get a displayable title for the current song."""
+        current_song_url = self.snapshot.current_song_url
+        if not current_song_url:
+            return None
+        try:
+            if os.path.isabs(current_song_url): # Local library file
+                return library.title_for(current_song_url) or os.path.splitext(os.path.basename(current_song_url))[0]
+            if "googlevideo.com" in current_song_url and "title=" in current_song_url:
+                title_part = current_song_url.split('title=')[1].split('&')[0]
+                return urllib.parse.unquote_plus(title_part)
+            # Add more parsers here for other URL types if needed
+        except Exception as e:
+            logging.debug(f"Could not parse title from current_song_url: {e}")
+        return current_song_url # Fallback to URL
+    # --- End Queue Management Methods ---
+
+
+# Initialize playlist manager
+playlist_manager = PlaylistManager()
+playlist_manager.subscribe(lambda snapshot: event_bus.publish(QUEUE_CHANGED, snapshot=snapshot))
+
+
+# --- Queue Journal ---
+def diff_queue(old: tuple[str, ...], new: tuple[str, ...]) -> list[dict]:
+    """Splice records that turn `old` into `new`; an advance (pop front, maybe re-append in loop mode) stays small."""
+    if old == new:
+        return []
+    kept = len(old) - 1
+    if old and old[1:] == new[:kept]:
+        records = [{"op": "splice", "at": 0, "delete": 1, "insert": []}]
+        if len(new) > kept:
+            records.append({"op": "splice", "at": kept, "delete": 0, "insert": list(new[kept:])})
+        return records
+    limit = min(len(old), len(new))
+    prefix = 0
+    while prefix < limit and old[prefix] == new[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < limit - prefix and old[-1 - suffix] == new[-1 - suffix]:
+        suffix += 1
+    return [{"op": "splice", "at": prefix, "delete": len(old) - prefix - suffix, "insert": list(new[prefix:len(new) - suffix])}]
+
+
+class QueueJournal:
+    """
+    Crash-safe record of the queue. Every published QueueSnapshot is diffed
+    against the last journaled one by the "queue_journal" thread and appended
+    to QUEUE_JOURNAL_PATH as JSON lines (splice/current/loop records, the
+    source page of each new stream URL, and the playback position every few
+    seconds). Each batch is flushed to the OS, so a crash or os._exit loses at
+    most the last position tick. Once enough records pile up the file is
+    compacted in the background into a single "reset" record (written to a
+    temp file, fsynced and swapped in). On launch the journal is replayed to
+    restore the queue, with the interrupted track first and its position
+    handed to the playback loop for resuming.
+    """
+    COMPACT_AFTER = 1000 # Records appended before the journal is rewritten as one reset record
+    POSITION_INTERVAL = 5 # seconds between playback position records
+
+    def __init__(self, path: str):
+        self.path = path
+        self.updates: queue.SimpleQueue[tuple | None] = queue.SimpleQueue()
+        self.thread: threading.Thread | None = None
+        self.closed = False
+        self.stopped = threading.Event()
+        self.file = None # Writer thread only
+        self.last = QueueSnapshot(-1, (), None, False) # Last journaled snapshot; writer thread only
+        self.sourced: set[str] = set() # Queued URLs whose source is already journaled; writer thread only
+        self.position: tuple[str, int] | None = None # (url, ms) last journaled
+        self.records_written = 0
+        self.resume: tuple[str, str | None, int] | None = None # (url, source, ms) to seek to once that track starts
+
+    # --- Restore ---
+    def replay(self) -> dict:
+        """Reads the journal into {"items", "current", "loop", "sources", "position"}; stops at a torn last line."""
+        state = {"items": [], "current": None, "loop": False, "sources": {}, "position": None}
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        queue_log.warning("Queue journal ends with a partial record (interrupted write); ignoring it.")
+                        break
+                    op = record["op"]
+                    if op == "reset":
+                        state = {"items": record["items"], "current": record["current"], "loop": record["loop"],
+                                 "sources": record["sources"], "position": record.get("position")}
+                    elif op == "splice":
+                        state["items"][record["at"]:record["at"] + record["delete"]] = record["insert"]
+                    elif op == "current":
+                        state["current"] = record["url"]
+                    elif op == "loop":
+                        state["loop"] = record["on"]
+                    elif op == "sources":
+                        state["sources"].update(record["map"])
+                    elif op == "position":
+                        state["position"] = [record["url"], record["ms"]]
+        except FileNotFoundError:
+            pass
+        return state
+
+    def restore(self) -> int:
+        """Restores the journaled queue (interrupted track first). Returns the number of restored entries."""
+        started = time.perf_counter()
+        try:
+            state = self.replay()
+        except Exception as e:
+            queue_log.error("Could not read the queue journal %s: %s", self.path, e)
+            return 0
+        items = ([state["current"]] if state["current"] else []) + state["items"]
+        if not items:
+            return 0
+        for url in items:
+            source = state["sources"].get(url)
+            if source:
+                stream_sources.record(url, source[0], source[1])
+        if state["position"] and state["position"][0] == state["current"]:
+            url, ms = state["position"]
+            self.resume = (url, (state["sources"].get(url) or [None])[0], ms)
+        playlist_manager.restore(items, state["loop"])
+        elapsed_ms = (time.perf_counter() - started) * 1000.0
+        metrics.observe("queue.restore", elapsed_ms)
+        queue_log.info("Restored %s queue entries from the last session in %.1f ms%s.", len(items), elapsed_ms,
+                       f" (resuming at {self.resume[2] // 1000}s)" if self.resume else "")
+        return len(items)
+
+    def take_resume_position(self, url: str) -> int | None:
+        """Position (ms) to resume `url` at, once; also matches a re-resolved stream URL of the same source."""
+        if self.resume is None:
+            return None
+        resume_url, source, ms = self.resume
+        if url != resume_url and (source is None or (stream_sources.get(url) or {}).get("source") != source):
+            return None
+        self.resume = None
+        return ms
+
+    # --- Recording ---
+    def on_queue_changed(self, snapshot: QueueSnapshot):
+        if not self.closed:
+            self.updates.put(("snapshot", snapshot))
+
+    def record_position(self):
+        """Scheduler job: journals the current track's playback position when it moved."""
+        snapshot = playlist_manager.snapshot
+        if self.closed or not snapshot.current_song_url:
+            return
+        ms = playback_backend.get_time()
+        if ms and ms > 0:
+            self.updates.put(("position", snapshot.current_song_url, int(ms)))
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="queue_journal", daemon=True)
+            self.thread.start()
+            scheduler.schedule("queue_position", self.record_position, self.POSITION_INTERVAL, interval=self.POSITION_INTERVAL)
+
+    def close(self, timeout: float = 2.0):
+        """Journals the final position and stops recording, so shutdown's own stop/clear is not journaled."""
+        if self.thread is None or self.closed:
+            return
+        self.record_position()
+        self.closed = True
+        self.updates.put(None)
+        self.stopped.wait(timeout)
+
+    def run(self):
+        try:
+            self._compact(playlist_manager.snapshot)
+        except Exception as e:
+            queue_log.error("Could not write the queue journal %s: %s", self.path, e)
+        while True:
+            batch = [self.updates.get()]
+            while True:
+                try:
+                    batch.append(self.updates.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with metrics.timer("queue.journal_write"):
+                    self._write(batch)
+                if self.records_written >= self.COMPACT_AFTER:
+                    with metrics.timer("queue.journal_compact"):
+                        self._compact(self.last)
+            except Exception as e:
+                queue_log.error("Queue journal write failed: %s", e)
+            if None in batch:
+                if self.file is not None:
+                    self.file.flush()
+                    os.fsync(self.file.fileno())
+                self.stopped.set()
+                return
+
+    def _write(self, batch: list[tuple | None]):
+        records = []
+        snapshots = [update[1] for update in batch if update is not None and update[0] == "snapshot"]
+        latest = max(snapshots, key=lambda snapshot: snapshot.version, default=None)
+        if latest is not None and latest.version > self.last.version: # Coalesce; older snapshots are already superseded
+            records.extend(diff_queue(self.last.items, latest.items))
+            if latest.current_song_url != self.last.current_song_url:
+                records.append({"op": "current", "url": latest.current_song_url})
+            if latest.loop_queue != self.last.loop_queue:
+                records.append({"op": "loop", "on": latest.loop_queue})
+            sources = self._new_sources(latest)
+            if sources:
+                records.append({"op": "sources", "map": sources})
+            self.last = latest
+        positions = [update for update in batch if update is not None and update[0] == "position"]
+        if positions and tuple(positions[-1][1:]) != self.position:
+            self.position = tuple(positions[-1][1:])
+            records.append({"op": "position", "url": self.position[0], "ms": self.position[1]})
+        if records:
+            self.file.write("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records))
+            self.file.flush()
+            self.records_written += len(records)
+
+    def _new_sources(self, snapshot: QueueSnapshot) -> dict:
+        sources = {}
+        for url in (*snapshot.items, snapshot.current_song_url):
+            if url and url not in self.sourced:
+                self.sourced.add(url)
+                info = stream_sources.get(url)
+                if info:
+                    sources[url] = [info["source"], info["title"]]
+        return sources
+
+    def _compact(self, snapshot: QueueSnapshot):
+        """Rewrites the journal as a single reset record for `snapshot`."""
+        self.sourced.clear()
+        sources = self._new_sources(snapshot)
+        position = list(self.position) if self.position and self.position[0] == snapshot.current_song_url else None
+        record = {"op": "reset", "items": list(snapshot.items), "current": snapshot.current_song_url,
+                  "loop": snapshot.loop_queue, "sources": sources, "position": position}
+        if self.file is not None:
+            self.file.close() # Windows cannot replace a file that is still open
+            self.file = None
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.path)
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.last = snapshot
+        self.records_written = 0
+
+
+queue_journal = QueueJournal(QUEUE_JOURNAL_PATH)
+playlist_manager.subscribe(queue_journal.on_queue_changed)
+
+def start_queue_journal():
+    """Restores the previous session (if enabled) and starts journaling queue changes."""
+    if CONFIG.get("restore_session", True):
+        queue_journal.restore()
+    queue_journal.start()
+
+
+# --- Queue Prefetcher ---
+class QueuePrefetcher:
+    """
+    Validates the next few queue entries in the background so dead or expiring
+    stream URLs are re-resolved (or dropped) before they reach the player.
+    A URL is bad if its `expire=` timestamp is within the margin, or if a cheap
+    HEAD (falling back to a 1-byte range GET) returns a client error.
+    Passes run on the prefetcher's own thread, since probes and re-resolution
+    can block for seconds; the scheduler job and kick() only wake it.
+    """
+    PROBE_TIMEOUT = 5 # seconds
+    REVALIDATE_AFTER = 600 # seconds a successful probe is trusted for
+    PROBE_HEADERS = {"User-Agent": "Mozilla/5.0"}
+
+    def __init__(self, lookahead: int, interval: int, expiry_margin: int):
+        self.lookahead = lookahead
+        self.interval = interval
+        self.expiry_margin = expiry_margin
+        self.job: ScheduledJob | None = None
+        self.thread: threading.Thread | None = None
+        self.wake_event = threading.Event()
+        self.validated_until: dict[str, float] = {} # stream URL -> time until which it is trusted
+
+    def kick(self):
+        """Requests a validation pass now (e.g. after the queue changed); bursts of kicks coalesce into one pass."""
+        if self.thread is not None:
+            self.wake_event.set()
+
+    def start(self):
+        if self.lookahead <= 0:
+            logging.info("Queue prefetcher disabled (prefetch_lookahead <= 0 in config).")
+            return
+        logging.info(f"Queue prefetcher started: validating the next {self.lookahead} entries every {self.interval}s.")
+        self.thread = threading.Thread(target=self.run, name="prefetcher", daemon=True)
+        self.thread.start()
+        self.job = scheduler.schedule("prefetch", self.wake_event.set, self.interval, interval=self.interval)
+
+    def run(self):
+        while True:
+            self.wake_event.wait()
+            self.wake_event.clear()
+            try:
+                self.check_upcoming()
+            except Exception as e:
+                logging.error(f"Error in queue prefetcher: {e}", exc_info=True)
+
+    def check_upcoming(self):
+        now = time.time()
+        upcoming = playlist_manager.view_queue()[:self.lookahead]
+        # Forget validations for entries that have left the queue
+        self.validated_until = {url: until for url, until in self.validated_until.items() if url in upcoming}
+        for url in upcoming:
+            if self.validated_until.get(url, 0) > now:
+                continue
+            with metrics.timer("prefetch.validate"):
+                ok = self.validate(url)
+            if ok is not False:
+                expires_at = parse_stream_expiry(url)
+                trust_until = now + self.REVALIDATE_AFTER
+                if expires_at:
+                    trust_until = min(trust_until, expires_at - self.expiry_margin)
+                self.validated_until[url] = trust_until
+                continue
+
+            metrics.incr("prefetch.bad_entries")
+            fresh_url = re_resolve_stream(url)
+            if fresh_url and playlist_manager.replace_entry(url, fresh_url):
+                logging.info(f"Prefetcher: replaced dead/expiring stream with a fresh one ({url[:50]}... -> {fresh_url[:50]}...)")
+                metrics.incr("prefetch.replaced")
+            elif playlist_manager.remove_entry(url):
+                logging.warning(f"Prefetcher: dropped unplayable queue entry {url[:70]}...")
+                metrics.incr("prefetch.dropped")
+            stream_sources.forget(url)
+
+    def validate(self, url: str) -> bool | None:
+        """True if playable, False if dead/expiring, None if unknown (e.g. network down; keep the entry)."""
+        if not url.startswith(("http://", "https://")):
+            return os.path.exists(url) if os.path.isabs(url) else None
+        expires_at = parse_stream_expiry(url)
+        if expires_at is not None and expires_at - time.time() < self.expiry_margin:
+            return False
+        for method, extra_headers in (("HEAD", {}), ("GET", {"Range": "bytes=0-0"})):
+            request = urllib.request.Request(url, method=method, headers={**self.PROBE_HEADERS, **extra_headers})
+            try:
+                with urllib.request.urlopen(request, timeout=self.PROBE_TIMEOUT) as response:
+                    return 200 <= response.status < 300
+            except urllib.error.HTTPError as e:
+                if e.code in (405, 501) and method == "HEAD":
+                    continue # HEAD not supported; retry with a range GET
+                return False if 400 <= e.code < 500 else None
+            except Exception as e:
+                logging.debug(f"Prefetch probe failed for {url[:50]}...: {e}")
+                return None
+        return None
+
+
+prefetcher = QueuePrefetcher(
+    CONFIG.get("prefetch_lookahead", 3), CONFIG.get("prefetch_interval", 30), CONFIG.get("stream_expiry_margin", 300)
+)
+event_bus.subscribe(QUEUE_CHANGED, lambda event, payload: prefetcher.kick())
+
+# --- Playback Backends ---
+class PlaybackState(enum.Enum):
+    """Player state, independent of the backend."""
+    IDLE = "idle" # Nothing open (never opened, or closed)
+    OPENING = "opening"
+    BUFFERING = "buffering"
+    PLAYING = "playing"
+    PAUSED = "paused"
+    STOPPED = "stopped"
+    ENDED = "ended"
+    ERROR = "error"
+
+
+class PlaybackBackend(abc.ABC):
+    """
+    Plays one track at a time. playback_loop and the playback control
+    functions only use this interface, so the engine runs the same on VLC and
+    on the simulated backend. Implementations must be safe to call from any
+    thread; listeners registered with subscribe() are called with the new
+    PlaybackState from the backend's own thread and must not block.
+    """
+    name = "base"
+
+    def __init__(self):
+        self.listeners: list[Callable[[PlaybackState], None]] = []
+
+    def subscribe(self, listener: Callable[[PlaybackState], None]):
+        self.listeners.append(listener)
+
+    def _notify(self, state: PlaybackState):
+        for listener in list(self.listeners):
+            try:
+                listener(state)
+            except Exception as e:
+                playback_log.error("Error in playback state listener %s: %s", listener, e)
+
+    @abc.abstractmethod
+    def open(self, url: str):
+        """Loads `url`, closing whatever was open. Playback starts with play()."""
+
+    @abc.abstractmethod
+    def play(self) -> bool:
+        """Starts or resumes playback. False if it could not be started."""
+
+    @abc.abstractmethod
+    def pause(self):
+        ...
+
+    @abc.abstractmethod
+    def stop(self):
+        ...
+
+    @abc.abstractmethod
+    def close(self):
+        """Stops and releases the open track; state() is IDLE afterwards."""
+
+    @abc.abstractmethod
+    def state(self) -> PlaybackState:
+        ...
+
+    def is_active(self) -> bool:
+        return self.state() is not PlaybackState.IDLE
+
+    @abc.abstractmethod
+    def get_time(self) -> int | None:
+        """Playback position in ms, or None if unknown."""
+
+    @abc.abstractmethod
+    def set_time(self, ms: int):
+        ...
+
+    @abc.abstractmethod
+    def is_seekable(self) -> bool:
+        ...
+
+    @abc.abstractmethod
+    def get_volume(self) -> int | None:
+        ...
+
+    @abc.abstractmethod
+    def set_volume(self, volume: int) -> bool:
+        """Sets the volume (0-100). False if the backend refused it."""
+
+    @abc.abstractmethod
+    def stats(self) -> tuple[int | None, int | None]:
+        """
+        (position in ms, bytes read) of the current track; None where the
+        backend cannot tell. Still reports where the track was after stop(),
+        close() or its end, so the caller can record how long it played.
+        """
+
+
+class VlcBackend(PlaybackBackend):
+    """
+    python-vlc backend. One libvlc instance is kept; each open() creates a
+    fresh media player and releases the previous one. Every player call is
+    made under `lock`, so a control call from another thread can never hit a
+    player that is being released. VLC's event callbacks only report the state
+    their event implies and never take the lock (VLC may fire them while
+    stop() holds it).
+    """
+    name = "vlc"
+    EVENT_STATES = (("MediaPlayerPlaying", PlaybackState.PLAYING), ("MediaPlayerEndReached", PlaybackState.ENDED),
+                    ("MediaPlayerStopped", PlaybackState.STOPPED), ("MediaPlayerEncounteredError", PlaybackState.ERROR))
+
+    def __init__(self):
+        super().__init__()
+        self.lock = threading.Lock()
+        self.instance = None
+        self.player = None
+        self.state_map: dict | None = None # vlc.State -> PlaybackState; built on first use as vlc loads lazily
+        self.final_stats: tuple[int | None, int | None] | None = None # Last stats before a stop; VLC reports -1 afterwards
+
+    def _read_stats(self) -> tuple[int | None, int | None]:
+        # Caller holds self.lock and self.player is not None
+        position = bytes_read = None
+        try:
+            position = self.player.get_time()
+            position = position if position is not None and position >= 0 else None
+            stats = vlc.MediaStats()
+            media = self.player.get_media()
+            if media is not None and media.get_stats(stats):
+                bytes_read = stats.read_bytes
+        except Exception as e:
+            playback_log.debug("Could not read playback stats: %s", e)
+        return position, bytes_read
+
+    def _keep_final_stats(self):
+        # Caller holds self.lock; called before the player stops and forgets its position
+        if self.player is not None:
+            stats = self._read_stats()
+            if stats[0] is not None:
+                self.final_stats = stats
+
+    def _release(self):
+        # Caller holds self.lock
+        if self.player is not None:
+            self._keep_final_stats()
+            self.player.stop()
+            self.player.release()
+            self.player = None
+
+    def open(self, url: str):
+        with self.lock:
+            self._release()
+            self.final_stats = None
+            if self.instance is None:
+                self.instance = vlc.Instance("--no-xlib") # --no-xlib for headless, add other options if needed
+            player = self.instance.media_player_new()
+            player.set_media(self.instance.media_new(url))
+            # media.add_option("network-caching=1500") # Example: increase network cache
+            player_events = player.event_manager()
+            for event_name, state in self.EVENT_STATES:
+                player_events.event_attach(getattr(vlc.EventType, event_name), lambda _vlc_event, state=state: self._notify(state))
+            self.player = player
+
+    def play(self) -> bool:
+        with self.lock:
+            self.final_stats = None
+            return self.player is not None and self.player.play() != -1
+
+    def pause(self):
+        with self.lock:
+            if self.player is not None:
+                self.player.set_pause(1)
+
+    def stop(self):
+        with self.lock:
+            if self.player is not None:
+                self._keep_final_stats()
+                self.player.stop()
+
+    def close(self):
+        with self.lock:
+            self._release()
+
+    def state(self) -> PlaybackState:
+        with self.lock:
+            if self.player is None:
+                return PlaybackState.IDLE
+            vlc_state = self.player.get_state()
+        if self.state_map is None:
+            self.state_map = {vlc.State.NothingSpecial: PlaybackState.OPENING, vlc.State.Opening: PlaybackState.OPENING,
+                              vlc.State.Buffering: PlaybackState.BUFFERING, vlc.State.Playing: PlaybackState.PLAYING,
+                              vlc.State.Paused: PlaybackState.PAUSED, vlc.State.Stopped: PlaybackState.STOPPED,
+                              vlc.State.Ended: PlaybackState.ENDED, vlc.State.Error: PlaybackState.ERROR}
+        return self.state_map.get(vlc_state, PlaybackState.OPENING)
+
+    def get_time(self) -> int | None:
+        with self.lock:
+            position = self.player.get_time() if self.player is not None else None
+        return position if position is not None and position >= 0 else None
+
+    def set_time(self, ms: int):
+        with self.lock:
+            if self.player is not None:
+                self.player.set_time(ms)
+
+    def is_seekable(self) -> bool:
+        with self.lock:
+            return self.player is not None and bool(self.player.is_seekable())
+
+    def get_volume(self) -> int | None:
+        with self.lock:
+            volume = self.player.audio_get_volume() if self.player is not None else None
+        return volume if volume is not None and volume >= 0 else None
+
+    def set_volume(self, volume: int) -> bool:
+        with self.lock:
+            return self.player is not None and self.player.audio_set_volume(volume) == 0 # libvlc returns 0 on success
+
+    def stats(self) -> tuple[int | None, int | None]:
+        with self.lock:
+            if self.player is None:
+                return self.final_stats or (None, None)
+            position, bytes_read = self._read_stats()
+            if position is None and self.final_stats is not None: # Stopped
+                position, bytes_read = self.final_stats[0], bytes_read if bytes_read is not None else self.final_stats[1]
+            elif position is None and self.state_map is not None and self.state_map.get(self.player.get_state()) is PlaybackState.ENDED:
+                length = self.player.get_length() # Ended: the input is gone, but it played to the end
+                position = length if length and length > 0 else None
+        return position, bytes_read
+
+
+class SimulatedBackend(PlaybackBackend):
+    """
+    Headless backend on a virtual clock: no audio device, codecs or network.
+    Every opened URL is a `track_ms` long track that ends by itself. Virtual
+    time runs `speed` times faster than real time (speed=1e6 gets through
+    thousands of tracks per second), or only moves on advance() when speed is
+    0, for deterministic tests. A share of `error_rate` play() calls ends in
+    ERROR, to exercise the failure paths.
+    """
+    name = "simulated"
+    BYTES_PER_MS = 20 # ~160 kbit/s, for the bytes-read stat
+
+    def __init__(self, speed: float = 1.0, track_ms: int = 180000, error_rate: float = 0.0, seed: int | None = None):
+        super().__init__()
+        self.speed = speed
+        self.track_ms = track_ms
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.condition = threading.Condition()
+        self.url: str | None = None
+        self.current_state = PlaybackState.IDLE
+        self.volume = 100
+        self.position = 0.0 # Virtual ms at `anchor`
+        self.anchor = time.monotonic()
+        self.final_position: float | None = None # Where the track was when it was stopped or closed
+        self.thread: threading.Thread | None = None
+
+    def _position(self) -> float:
+        # Caller holds self.condition
+        if self.current_state is PlaybackState.PLAYING and self.speed > 0:
+            return min(self.track_ms, self.position + (time.monotonic() - self.anchor) * 1000.0 * self.speed)
+        return self.position
+
+    def _set_state(self, state: PlaybackState, position: float | None = None):
+        # Caller holds self.condition
+        self.position = self._position() if position is None else position
+        self.anchor = time.monotonic()
+        self.current_state = state
+        self.condition.notify_all() # The clock thread recomputes when the track ends
+
+    def _ended(self) -> bool:
+        # Caller holds self.condition
+        if self.current_state is PlaybackState.PLAYING and self._position() >= self.track_ms:
+            self._set_state(PlaybackState.ENDED)
+            return True
+        return False
+
+    def open(self, url: str):
+        with self.condition:
+            self.url = url
+            self.final_position = None
+            self._set_state(PlaybackState.OPENING, 0.0)
+
+    def play(self) -> bool:
+        with self.condition:
+            if self.url is None:
+                return False
+            if self.current_state is PlaybackState.PLAYING:
+                return True
+            restart = self.current_state in (PlaybackState.OPENING, PlaybackState.STOPPED, PlaybackState.ENDED)
+            self.final_position = None
+            if restart and self.error_rate and self.random.random() < self.error_rate:
+                state = PlaybackState.ERROR
+            else:
+                state = PlaybackState.PLAYING
+            self._set_state(state, 0.0 if restart else None)
+            if self.thread is None and self.speed > 0:
+                self.thread = threading.Thread(target=self._run_clock, name="simulated_clock", daemon=True)
+                self.thread.start()
+        self._notify(state)
+        return True
+
+    def pause(self):
+        with self.condition:
+            if self.current_state is not PlaybackState.PLAYING or self._ended():
+                return
+            self._set_state(PlaybackState.PAUSED)
+        self._notify(PlaybackState.PAUSED)
+
+    def stop(self):
+        with self.condition:
+            if self.url is None:
                 return
+            if self.current_state is not PlaybackState.STOPPED:
+                self.final_position = self._position()
+            self._set_state(PlaybackState.STOPPED, 0.0)
+        self._notify(PlaybackState.STOPPED)
+
+    def close(self):
+        with self.condition:
+            was_open = self.url is not None
+            if was_open and self.current_state is not PlaybackState.STOPPED:
+                self.final_position = self._position()
+            self.url = None
+            self._set_state(PlaybackState.IDLE, 0.0)
+        if was_open:
+            self._notify(PlaybackState.IDLE)
+
+    def state(self) -> PlaybackState:
+        with self.condition:
+            ended = self._ended()
+            state = self.current_state
+        if ended:
+            self._notify(state)
+        return state
+
+    def advance(self, ms: float):
+        """Moves virtual time forward by `ms` (for speed=0 runs)."""
+        with self.condition:
+            if self.current_state is not PlaybackState.PLAYING:
+                return
+            self._set_state(PlaybackState.PLAYING, self._position() + ms)
+            ended = self._ended()
+        if ended:
+            self._notify(PlaybackState.ENDED)
+
+    def _run_clock(self):
+        """Fires ENDED when the playing track's virtual time runs out."""
+        while True:
+            with self.condition:
+                while True:
+                    if self.current_state is PlaybackState.PLAYING and self.speed > 0:
+                        remaining = (self.track_ms - self._position()) / (1000.0 * self.speed)
+                        if remaining <= 0:
+                            self._set_state(PlaybackState.ENDED)
+                            break
+                        self.condition.wait(remaining)
+                    else:
+                        self.condition.wait()
+            self._notify(PlaybackState.ENDED)
+
+    def get_time(self) -> int | None:
+        with self.condition:
+            return int(self._position()) if self.url is not None else None
+
+    def set_time(self, ms: int):
+        with self.condition:
+            if self.url is not None and self.current_state not in (PlaybackState.STOPPED, PlaybackState.ENDED):
+                self._set_state(self.current_state, float(max(0, min(ms, self.track_ms)))) # Like VLC, no seeking once stopped/ended
+
+    def is_seekable(self) -> bool:
+        with self.condition:
+            return self.url is not None
+
+    def get_volume(self) -> int | None:
+        with self.condition:
+            return self.volume if self.url is not None else None
+
+    def set_volume(self, volume: int) -> bool:
+        with self.condition:
+            if self.url is None or not 0 <= volume <= 100:
+                return False
+            self.volume = volume
+            return True
+
+    def stats(self) -> tuple[int | None, int | None]:
+        with self.condition:
+            if self.url is None or self.current_state is PlaybackState.STOPPED:
+                if self.final_position is None:
+                    return None, None
+                position = int(self.final_position)
+            else:
+                position = int(self._position())
+        return position, position * self.BYTES_PER_MS
 
-            with self.lock:
-                if not append:
-                    self.playlist.clear()
-                    self.current_song_url = None
-                    action_msg = "replaced"
-                else:
-                    action_msg = "appended to"
-                self.playlist.extend(loaded_urls)
 
-            logging.info(f"Playlist loaded from {filepath} ({len(loaded_urls)} tracks), {action_msg} queue.")
-            print(f"Loaded {len(loaded_urls)} tracks from '{os.path.basename(filepath)}'. Queue {action_msg}.")
+PLAYBACK_BACKENDS: dict[str, type[PlaybackBackend]] = {"vlc": VlcBackend, "simulated": SimulatedBackend}
 
-        except IOError as e:
-            logging.error(f"Error loading playlist from {filepath}: {e}")
-            print(f"Error: Could not load playlist file: {e}")
-            play_error_sound()
-        except Exception as e:
-            logging.error(f"Unexpected error loading playlist: {e}")
-            print(f"Error: An unexpected error occurred while loading: {e}")
-            play_error_sound()
+playback_backend: PlaybackBackend = PLAYBACK_BACKENDS[CONFIG.get("playback_backend", "vlc")]()
+
+
+# --- Playback Failure Tracking ---
+class FailureTracker:
+    """
+    Per-entry playback failure bookkeeping. Entries are keyed by their source
+    (page URL or query) when known, so a re-resolved stream URL shares the
+    failure count of the one it replaced.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries: dict[str, dict] = {}
+        self.totals: collections.Counter = collections.Counter()
+
+    @staticmethod
+    def key_for(url: str) -> str:
+        info = stream_sources.get(url)
+        return info["source"] if info else url
+
+    def record_failure(self, url: str, reason: str) -> int:
+        """Records a failure and returns the entry's consecutive failure count."""
+        key = self.key_for(url)
+        info = stream_sources.get(url)
+        with self.lock:
+            entry = self.entries.setdefault(key, {"consecutive": 0, "failures": 0, "retries": 0, "gave_up": False, "title": None})
+            entry["consecutive"] += 1
+            entry["failures"] += 1
+            entry["last_error"] = reason
+            entry["last_failed_at"] = time.time()
+            entry["title"] = (info or {}).get("title") or entry["title"]
+            self.totals["failures"] += 1
+            return entry["consecutive"]
+
+    def record_retry(self, url: str, re_resolved: bool):
+        with self.lock:
+            entry = self.entries.get(self.key_for(url))
+            if entry:
+                entry["retries"] += 1
+            self.totals["retries"] += 1
+            if re_resolved:
+                self.totals["re_resolved"] += 1
+
+    def record_give_up(self, url: str):
+        with self.lock:
+            entry = self.entries.get(self.key_for(url))
+            if entry:
+                entry["gave_up"] = True
+                entry["consecutive"] = 0
+            self.totals["gave_up"] += 1
 
-    def view_queue(self) -> list[str]:
-        """Returns a copy of the current playlist."""
+    def record_success(self, url: str):
         with self.lock:
-            return list(self.playlist)
+            entry = self.entries.get(self.key_for(url))
+            if entry:
+                entry["consecutive"] = 0
+                entry["gave_up"] = False
 
-    def remove_at(self, index: int) -> str | None:
-        """Removes a song at the specified index (0-based). Returns the URL of the removed song or None."""
+    def reset(self):
         with self.lock:
-            if 0 <= index < len(self.playlist):
-                removed_url = self.playlist.pop(index)
-                logging.info(f"Removed item at index {index}: {removed_url[:70]}...")
-                return removed_url
-            else:
-                logging.warning(f"Invalid index for removal: {index}. Queue size: {len(self.playlist)}")
-                return None
+            self.entries.clear()
+            self.totals.clear()
 
-    def get_current_song_title(self) -> str | None:
-        """Attempts to get a displayable title for the current song."""
-        if not self.current_song_url:
-            return None
-        try:
-            if "googlevideo.com" in self.current_song_url and "title=" in self.current_song_url:
-                title_part = self.current_song_url.split('title=')[1].split('&')[0]
-                return urllib.parse.unquote_plus(title_part)
-            # Add more parsers here for other URL types if needed
-        except Exception as e:
-            logging.debug(f"Could not parse title from current_song_url: {e}")
-        return self.current_song_url # Fallback to URL
-    # --- End Queue Management Methods ---
+    def format_summary(self, limit: int = 10) -> str:
+        with self.lock:
+            totals = dict(self.totals)
+            worst = sorted(self.entries.items(), key=lambda kv: kv[1]["failures"], reverse=True)[:limit]
+        lines = ["\n--- Playback Failures ---",
+                 f"Failures: {totals.get('failures', 0)}  Retries: {totals.get('retries', 0)}  "
+                 f"Re-resolved: {totals.get('re_resolved', 0)}  Skipped: {totals.get('gave_up', 0)}"]
+        for key, entry in worst:
+            status = "skipped" if entry["gave_up"] else "retrying" if entry["consecutive"] else "recovered"
+            name = entry["title"] or key
+            lines.append(f"  {entry['failures']}x [{status}] {name[:60]} - {entry.get('last_error', '')[:60]}")
+        lines.append("-------------------------\n")
+        return "\n".join(lines)
+
+
+failure_tracker = FailureTracker()
+
+def retry_failed_entry(url: str, clear_count: int):
+    """
+    Re-resolves a failed stream off the playback thread and queues it to play
+    next, unless the queue was cleared (stop, clear) while it was resolving.
+    """
+    fresh_url = re_resolve_stream(url)
+    if not playlist_manager.push_front(fresh_url or url, clear_count):
+        playback_log.info("Queue was cleared while re-resolving; dropping the retry of %s...", url[:70])
+        return
+    failure_tracker.record_retry(url, fresh_url is not None)
+    if fresh_url:
+        playback_log.info("Re-resolved failed stream; retrying next: %s...", fresh_url[:70])
+    else:
+        playback_log.info("Retrying failed stream as-is next: %s...", url[:70])
 
+def handle_playback_failure(url: str, reason: str):
+    """
+    Per-entry failure handling: while the entry has retry budget left it is
+    retried (re-resolved first when its source is known) after the playback
+    loop has moved on, otherwise it is skipped. Never sleeps, so one bad track
+    cannot stall the queue.
+    """
+    attempts = failure_tracker.record_failure(url, reason)
+    budget = CONFIG.get("playback_retry_budget", 2)
+    playlist_manager.discard_current() # Loop mode must not re-append a failing entry
+    retryable = url.startswith(("http://", "https://"))
+    if retryable and attempts <= budget:
+        playback_log.warning("Playback failed (%s), attempt %s/%s; retrying in the background.", reason, attempts, budget + 1)
+        threading.Thread(target=retry_failed_entry, args=(url, playlist_manager.clear_count), name="retry_failed_entry", daemon=True).start()
+        return
+    failure_tracker.record_give_up(url)
+    playback_log.error("Giving up on queue entry after %s failed attempt(s) (%s): %s...", attempts, reason, url[:70])
+    play_error_sound()
 
-# Initialize playlist manager
-playlist_manager = PlaylistManager()
 
 # --- Playback Control Functions ---
 # ... (play_stream, skip_song, pause_song, resume_song, stop_song, set_volume, adjust_volume, seek remain the same) ...
+class CommandError(Exception):
+    """
+    Raised by command helpers to reject a command (bad input, missing file...).
+    handle_command prints the message, plays the error sound and reports the
+    command as failed. An empty message means the helper already told the user.
+    """
+
 def play_stream(urls: list[str]):
     """Add song(s) to the queue."""
-    global last_activity_time
-    last_activity_time = time.time()
     if urls:
         playlist_manager.add_songs(urls)
     else:
-        logging.warning("play_stream called with no URLs.")
+        queue_log.warning("play_stream called with no URLs.")
         play_error_sound()
 
+skip_requested = threading.Event() # Tells playback_loop the next stop was a skip
+
 def skip_song():
     """Skip the current song."""
-    global player, last_activity_time
-    last_activity_time = time.time()
-    logging.info("Skip requested.")
-    if player:
-        player.stop()
+    playback_log.info("Skip requested.")
+    metrics.incr("tracks.skipped")
+    if playback_backend.is_active():
+        skip_requested.set()
+        playback_backend.stop()
 
 def pause_song():
     """Pause the current song."""
-    global player, last_activity_time
-    last_activity_time = time.time()
-    if player and player.is_playing():
-        player.pause()
-        logging.info("Playback paused.")
+    if playback_backend.state() is PlaybackState.PLAYING:
+        playback_backend.pause()
+        playback_log.info("Playback paused.")
+        event_bus.publish(PLAYBACK_PAUSED)
 
 def resume_song():
     """Resume the paused song."""
-    global player, last_activity_time
-    last_activity_time = time.time()
-    if player and not player.is_playing():
-        player.play()
-        logging.info("Playback resumed.")
+    if playback_backend.state() is PlaybackState.PAUSED:
+        playback_backend.play()
+        playback_log.info("Playback resumed.")
+        event_bus.publish(PLAYBACK_RESUMED)
 
 def stop_song():
     """Stop the current song and clear the queue."""
-    global player, last_activity_time
-    last_activity_time = time.time()
     logging.info("Stop requested. Clearing queue and stopping playback.")
     playlist_manager.clear()
-    if player:
-        player.stop()
-        player.release()
-        player = None
+    playback_backend.close()
 
 def set_volume(volume_level_str: str):
-    """Set the volume of the current song."""
-    global player, last_activity_time
-    last_activity_time = time.time()
+    """Set the volume of the current song. Raises CommandError for invalid input."""
     try:
         vol = int(volume_level_str)
-        if 0 <= vol <= 100:
-            if player:
-                player.audio_set_volume(vol)
-                logging.info(f"Volume set to {vol}")
-            else:
-                logging.warning("Cannot set volume: No player active.")
-        else:
-            logging.warning(f"Invalid volume level: {vol}. Must be between 0 and 100.")
-            play_error_sound()
     except ValueError:
-        logging.error(f"Invalid volume input: '{volume_level_str}'. Must be a number.")
-        play_error_sound()
+        raise CommandError(f"Invalid volume input: '{volume_level_str}'. Must be a number.") from None
+    if not 0 <= vol <= 100:
+        raise CommandError(f"Invalid volume level: {vol}. Must be between 0 and 100.")
+    if playback_backend.is_active():
+        if playback_backend.set_volume(vol):
+            playback_log.info("Volume set to %s", vol)
+            event_bus.publish(VOLUME_CHANGED, volume=vol)
+        else:
+            playback_log.warning("The player refused volume %s.", vol)
+    else:
+        playback_log.warning("Cannot set volume: No player active.")
 
 def adjust_volume(delta: int):
     """Adjust volume up or down."""
-    global player, last_activity_time
-    last_activity_time = time.time()
-    if player:
-        current_volume = player.audio_get_volume()
+    current_volume = playback_backend.get_volume()
+    if current_volume is not None:
         new_volume = max(0, min(100, current_volume + delta))
-        player.audio_set_volume(new_volume)
-        logging.info(f"Volume adjusted to {new_volume}")
+        if playback_backend.set_volume(new_volume):
+            playback_log.info("Volume adjusted to %s", new_volume)
+            event_bus.publish(VOLUME_CHANGED, volume=new_volume)
     else:
-         logging.warning("Cannot adjust volume: No player active.")
+         playback_log.warning("Cannot adjust volume: No player active.")
 
 def seek(delta_ms: int):
     """Seek forward or backward in the current song."""
-    global player, last_activity_time
-    last_activity_time = time.time()
-    if player and player.is_seekable():
-        current_time = player.get_time()
+    if playback_backend.is_seekable():
+        current_time = playback_backend.get_time() or 0
         new_time = max(0, current_time + delta_ms)
-        player.set_time(new_time)
+        playback_backend.set_time(new_time)
         direction = "forward" if delta_ms > 0 else "backward"
-        logging.info(f"Seek {direction} by {abs(delta_ms)//1000}s. New time: {new_time//1000}s")
-    elif player:
-        logging.warning("Cannot seek: Stream is not seekable or player not active.")
+        playback_log.info("Seek %s by %ss. New time: %ss", direction, abs(delta_ms)//1000, new_time//1000)
+    elif playback_backend.is_active():
+        playback_log.warning("Cannot seek: Stream is not seekable or player not active.")
+    else:
+        playback_log.warning("Cannot seek: No player active.")
+
+
+def toggle_profiler():
+    """Starts the sampling profiler, or stops it and writes the profile (hotkey target)."""
+    if profiler.is_running():
+        path = profiler.stop(output_format=CONFIG.get("profiler_format", "speedscope"))
+        print(f"Profile written to '{path}'")
     else:
-        logging.warning("Cannot seek: No player active.")
+        profiler.start(CONFIG.get("profiler_rate_hz", 100))
+        print("Profiler started.")
 
 
 # --- Command Handling ---
-def handle_command(command: str):
-    """Process commands entered in the GUI or potentially other sources."""
-    global last_activity_time, playlist_manager # Ensure playlist_manager is accessible
-    last_activity_time = time.time()
+def handle_command(command: str, source: str = "console") -> bool:
+    """
+    Process commands entered in the GUI or potentially other sources.
+    Returns False if the command was unknown, rejected (CommandError) or failed with an error.
+    """
+    global playlist_manager # Ensure playlist_manager is accessible
     command = command.strip()
     if not command:
-        return
+        return False
 
     parts = command.split(" ", 1)
     verb = parts[0].lower()
     args_str = parts[1].strip() if len(parts) > 1 else ""
 
+    def usage_error(usage: str):
+        raise CommandError(usage)
+
     # --- Helper for queue display ---
     def display_queue_helper(args_str: str = ""): # Accept args_str for verbosity
         verbose = args_str.strip().lower() == "-v" or args_str.strip().lower() == "--verbose"
-        queue_items = playlist_manager.view_queue()
+        snapshot = playlist_manager.snapshot # One consistent view for the whole listing
+        queue_items = snapshot.items
         current_song_title = playlist_manager.get_current_song_title()
 
         if not queue_items and not current_song_title:
@@ -695,11 +4064,11 @@ def handle_command(command: str):
         print("\n--- Current Queue ---")
         if current_song_title:
             now_playing_str = f"Now Playing: {current_song_title[:100]}"
-            if verbose and playlist_manager.current_song_url and playlist_manager.current_song_url != current_song_title:
-                now_playing_str += f" (URL: {playlist_manager.current_song_url[:70]}...)"
+            if verbose and snapshot.current_song_url and snapshot.current_song_url != current_song_title:
+                now_playing_str += f" (URL: {snapshot.current_song_url[:70]}...)"
             print(now_playing_str)
-        elif playlist_manager.current_song_url: # Fallback if title parsing failed but URL exists
-            print(f"Now Playing: {playlist_manager.current_song_url[:100]}")
+        elif snapshot.current_song_url: # Fallback if title parsing failed but URL exists
+            print(f"Now Playing: {snapshot.current_song_url[:100]}")
 
 
         if not queue_items:
@@ -727,11 +4096,12 @@ def handle_command(command: str):
     # --- Helper for remove ---
     def remove_from_queue_helper(index_str: str):
          if not index_str:
-             print("Usage: remove <index_number_from_queue_view>")
-             play_error_sound()
-             return
+             raise CommandError("Usage: remove <index_number_from_queue_view>")
          try:
              index = int(index_str)
+         except ValueError:
+             raise CommandError(f"Invalid index: '{index_str}'. Please provide a number.") from None
+         try:
              removed_item_url = playlist_manager.remove_at(index)
              if removed_item_url:
                  removed_title = removed_item_url # Fallback to URL
@@ -742,16 +4112,146 @@ def handle_command(command: str):
                  except Exception:
                      pass # Ignore decoding errors, use URL as title
                  print(f"Removed from queue: {removed_title[:70]}")
-             else:
-                 play_error_sound()
-                 print(f"Failed to remove item: Invalid index {index}. Use 'queue' or 'list' command to see valid indices.")
-         except ValueError:
-             play_error_sound()
-             print(f"Invalid index: '{index_str}'. Please provide a number.")
          except Exception as e:
-             play_error_sound()
-             print(f"Error removing item: {e}")
              logging.error(f"Error in remove command: {e}")
+             raise CommandError(f"Error removing item: {e}") from e
+         if not removed_item_url:
+             raise CommandError(f"Failed to remove item: Invalid index {index}. Use 'queue' or 'list' command to see valid indices.")
+
+    # --- Helper for stats ---
+    def stats_helper(args: str):
+        sub_parts = args.strip().split(" ", 1)
+        sub = sub_parts[0].lower()
+        if not sub:
+            print(metrics.format_stats())
+            if CONFIG.get("stream_proxy_enabled"):
+                print(stream_proxy.format_stats())
+        elif sub == "reset":
+            metrics.reset()
+            print("Timing stats reset.")
+        elif sub == "dump":
+            path = sub_parts[1].strip() if len(sub_parts) > 1 else CONFIG.get("metrics_dump_path") or os.path.join("lib", "metrics.json")
+            try:
+                metrics.dump(path)
+                print(f"Timing stats written to '{path}'")
+            except Exception as e:
+                logging.error(f"Failed to dump metrics to {path}: {e}")
+                raise CommandError(f"Error: Could not write stats file: {e}") from e
+        else:
+            raise CommandError("Usage: stats [reset|dump [file]]")
+
+    # --- Helper for library ---
+    def library_helper(args: str):
+        sub_parts = args.strip().split(" ", 1)
+        sub = sub_parts[0].lower()
+        folders = CONFIG.get("library_folders")
+        if not folders:
+            raise CommandError("No library folders configured. Add paths to \"library_folders\" in lib/config/config.json.")
+        elif not sub:
+            scan = library.last_scan
+            last = time.strftime("%H:%M:%S", time.localtime(scan["finished_at"])) if scan else "not yet"
+            print(f"Library: {library.count()} tracks in {len(folders)} folder(s); last scan: {last}"
+                  + (" (scan running)" if library.scan_lock.locked() else ""))
+        elif sub == "rescan":
+            if library.start_rescan(folders, announce=True):
+                print("Library rescan started.")
+            else:
+                print("A library scan is already running.")
+        elif sub == "find" and len(sub_parts) > 1:
+            tracks = library.search(sub_parts[1], limit=20)
+            if not tracks:
+                print(f"No library tracks match '{sub_parts[1]}'.")
+            for i, track in enumerate(tracks):
+                print(f"{i+1}. {format_library_track(track)}")
+        else:
+            raise CommandError("Usage: library [rescan | find <text>]")
+
+    # --- Helper for search ---
+    def search_helper(args: str):
+        query = args.strip()
+        if not query:
+            raise CommandError("Usage: search <text>")
+        results, fuzzy = search_index.search(query, limit=15)
+        if not results:
+            print(f"Nothing in the local index matches '{query}'.")
+            return
+        print(f"\n--- Local matches for '{query}'{' (fuzzy)' if fuzzy else ''} ---")
+        for i, result in enumerate(results):
+            print(f"{i+1}. {format_search_result(result)}")
+        print("-------------------------\n")
+
+    # --- Helper for history ---
+    def history_helper(args: str):
+        sub_parts = args.strip().split()
+        try:
+            if not sub_parts:
+                print(history.format_recent())
+            elif sub_parts[0].isdigit():
+                print(history.format_recent(max(1, int(sub_parts[0]))))
+            elif sub_parts[0].lower() == "stats":
+                print(history.format_stats(int(sub_parts[1]) if len(sub_parts) > 1 else 30))
+            else:
+                raise ValueError(args)
+        except ValueError:
+            raise CommandError("Usage: history [count | stats [days]]") from None
+
+    # --- Helper for api ---
+    def api_helper(args: str):
+        if control_api.server is not None:
+            print(control_api.format_status())
+        elif not CONFIG.get("control_api_enabled"):
+            print("The control API is disabled. Set control_api_enabled to true in config.json and restart.")
+        else:
+            print(f"The control API is not running (port {CONFIG.get('control_api_port')} unavailable?). See the log for details.")
+
+    # --- Helper for download ---
+    def download_helper(args: str):
+        query = args.strip()
+        current = playlist_manager.snapshot.current_song_url
+        if not query and not (current and current.startswith(("http://", "https://"))):
+            raise CommandError("Usage: download <query/url> (or play something first to download the current song)")
+        def run():
+            stream_urls = resolve_query_streams(query) if query else [current]
+            if stream_urls:
+                print(f"Downloading {len(stream_urls)} track(s) to '{DOWNLOADS_DIR}'...")
+                download_streams(stream_urls)
+        threading.Thread(target=run, name="download", daemon=True).start()
+
+    # --- Helper for failures ---
+    def failures_helper(args: str):
+        sub = args.strip().lower()
+        if not sub:
+            print(failure_tracker.format_summary())
+        elif sub == "reset":
+            failure_tracker.reset()
+            print("Failure counters reset.")
+        else:
+            raise CommandError("Usage: failures [reset]")
+
+    # --- Helper for profile ---
+    def profile_helper(args: str):
+        sub_parts = args.strip().split(" ", 1)
+        sub = sub_parts[0].lower()
+        sub_arg = sub_parts[1].strip() if len(sub_parts) > 1 else ""
+        if sub == "start":
+            try:
+                rate = int(sub_arg) if sub_arg else CONFIG.get("profiler_rate_hz", 100)
+            except ValueError:
+                raise CommandError(f"Invalid sample rate: '{sub_arg}'. Please provide a number (Hz).") from None
+            if profiler.start(rate):
+                print(f"Profiler started at {profiler.rate_hz} Hz. Use 'profile stop' to write the profile.")
+            else:
+                print("Profiler is already running.")
+        elif sub == "stop":
+            path = profiler.stop(sub_arg or None, CONFIG.get("profiler_format", "speedscope"))
+            if path:
+                print(f"Profile written to '{path}' ({profiler.sample_count} samples).")
+            else:
+                print("Profiler is not running.")
+        elif sub == "status":
+            print(f"Profiler is {'running' if profiler.is_running() else 'stopped'}.")
+        else:
+            raise CommandError("Usage: profile start [rate_hz] | profile stop [filename] | profile status")
 
      # --- Helper for loadqueue ---
     def load_queue_helper(args: str):
@@ -765,16 +4265,14 @@ def handle_command(command: str):
             filename = parts[1].strip() if len(parts) > 1 else ""
 
         if not filename: # Check if filename is empty after potential flag stripping
-            print("Usage: loadqueue [--append|-a] <filename>")
-            play_error_sound()
-            return
+            raise CommandError("Usage: loadqueue [--append|-a] <filename>")
         playlist_manager.load_queue(filename, append=append)
 
     # --- Command Actions Dictionary ---
     command_actions = {
-        "play": lambda query: play_spotify_or_youtube_search(query) if query else print("Usage: play <query/url>"),
-        "volume": lambda level: set_volume(level) if level else print("Usage: volume <0-100>"),
-        "vol": lambda level: set_volume(level) if level else print("Usage: vol <0-100>"), # Alias
+        "play": lambda query: play_spotify_or_youtube_search(query) if query else usage_error("Usage: play <query/url>"),
+        "volume": lambda level: set_volume(level) if level else usage_error("Usage: volume <0-100>"),
+        "vol": lambda level: set_volume(level) if level else usage_error("Usage: vol <0-100>"), # Alias
         "loop": lambda _: playlist_manager.toggle_loop(),
         "clear": lambda _: playlist_manager.clear(),
         "skip": lambda _: skip_song(),
@@ -785,19 +4283,35 @@ def handle_command(command: str):
         "exit": lambda _: terminate_program(),
         "quit": lambda _: terminate_program(), #Alias
         "shuffle": lambda _: playlist_manager.shuffle(),
-        "savequeue": lambda filename: playlist_manager.save_queue(filename) if filename else print("Usage: savequeue <filename>"),
+        "savequeue": lambda filename: playlist_manager.save_queue(filename) if filename else usage_error("Usage: savequeue <filename>"),
         "loadqueue": load_queue_helper,
         "queue": display_queue_helper,
         "list": display_queue_helper,  # Alias
         "remove": remove_from_queue_helper,
+        "stats": stats_helper,
+        "profile": profile_helper,
+        "failures": failures_helper,
+        "download": download_helper,
+        "search": search_helper,
+        "history": history_helper,
+        "api": api_helper,
+        "library": library_helper,
         "help": lambda _: display_help(), # New help command
     }
 
     action = command_actions.get(verb)
+    ok = action is not None
     if action:
         try:
             action(args_str) # Pass the argument string (args_str)
+        except CommandError as e:
+            ok = False
+            logging.info(f"Command '{verb}' rejected: {e}")
+            if str(e):
+                print(e)
+                play_error_sound()
         except TypeError as e:
+            ok = False
             # Check if the error is due to unexpected arguments for no-arg functions
             # (e.g., calling `clear` with an argument)
             # This is a bit fragile as it depends on the error message string.
@@ -805,6 +4319,7 @@ def handle_command(command: str):
                 logging.warning(f"Command '{verb}' does not accept arguments. Argument '{args_str}' ignored.")
                 try:
                     action("") # Retry with no arguments
+                    ok = True
                 except Exception as retry_e:
                     logging.error(f"Error re-executing command '{verb}' without arguments: {retry_e}", exc_info=True)
                     play_error_sound()
@@ -816,12 +4331,15 @@ def handle_command(command: str):
                  logging.error(f"TypeError executing command '{verb} {args_str}': {e}", exc_info=True)
                  play_error_sound()
         except Exception as e:
+            ok = False
             logging.error(f"Error executing command '{verb} {args_str}': {e}", exc_info=True)
             play_error_sound()
     else:
         logging.warning(f"Unknown command: '{command}'")
         print(f"Unknown command: '{command}'. Type 'help' for a list of commands.")
         play_error_sound()
+    event_bus.publish(COMMAND_EXECUTED, command=verb, args=args_str, source=source)
+    return ok
 
 def display_help():
     """Displays a list of available commands and their basic usage."""
@@ -840,6 +4358,14 @@ def display_help():
         "remove <index>": "Removes a song from the queue by its index (from 'queue' command).",
         "savequeue <filename>": "Saves the current queue to a file in 'lib/playlists/'.",
         "loadqueue [--append|-a] <filename>": "Loads a queue from a file. Use --append or -a to add to existing queue.",
+        "stats [reset|dump [file]]": "Shows p50/p95 timings per stage (resolve, spotify, buffering...).",
+        "library [rescan | find <text>]": "Shows the local library status, rescans it, or lists matching tracks.",
+        "search <text>": "Lists ranked local matches (library, past plays and resolutions) without going online.",
+        "history [count | stats [days]]": "Lists recent plays, or play counts and resolve/first-audio latency per source.",
+        "api": "Shows the control API address and connected event clients.",
+        "download [query/url]": "Downloads the current song (or the given query/URL) to lib/downloads using parallel range requests.",
+        "failures [reset]": "Shows per-entry playback failures, retries and skipped entries.",
+        "profile start [hz] | stop [file]": "Samples all thread stacks; writes a speedscope/collapsed profile to 'lib/profiles/'.",
         "exit | quit": "Exits the application.",
         "help": "Displays this help message."
     }
@@ -850,169 +4376,586 @@ def display_help():
 
 
 def play_spotify_or_youtube_search(query: str):
+    """Resolves a query or Spotify/YouTube URL (see resolve_query_streams) and adds the streams to the playlist."""
+    if not query:
+        resolve_log.warning("Play command received with no query/URL.")
+        raise CommandError("Usage: play <query/URL>")
+
+    stream_urls_to_play = resolve_query_streams(query, prefer_local=True)
+    if not stream_urls_to_play:
+        raise CommandError() # Errors already logged and user informed by now
+    resolve_log.info("Adding %s stream(s) to playback queue.", len(stream_urls_to_play))
+    play_stream(stream_urls_to_play) # play_stream handles adding to PlaylistManager
+
+def resolve_query_streams(query: str, prefer_local: bool = False) -> list[str]:
     """
     Determines if the query is a Spotify URL to fetch track names,
     or a general query/YouTube URL to search/fetch directly from YouTube.
-    Then adds the found stream URLs to the playlist.
+    With `prefer_local`, each track is looked up in the local search index first.
+    Returns the found stream URLs or file paths (empty after reporting the error).
     """
-    if not query:
-        logging.warning("Play command received with no query/URL.")
-        print("Usage: play <query/URL>")
-        play_error_sound()
-        return
-
     stream_urls_to_play = []
 
     if is_spotify_url(query):
-        logging.info(f"Processing Spotify URL: {query}")
+        resolve_log.info("Processing Spotify URL: %s", query)
         search_queries_for_yt = get_spotify_track_search_queries(query) # Returns list of "Title Artist" strings
         if search_queries_for_yt:
-            logging.info(f"Found {len(search_queries_for_yt)} track(s) from Spotify URL. Now searching on YouTube.")
+            resolve_log.info("Found %s track(s) from Spotify URL. Now searching on YouTube.", len(search_queries_for_yt))
             for i, yt_query in enumerate(search_queries_for_yt):
-                logging.info(f"Searching YouTube for Spotify track {i+1}/{len(search_queries_for_yt)}: '{yt_query}'")
+                local_urls = find_local_match(yt_query) if prefer_local else None
+                if local_urls:
+                    stream_urls_to_play.append(local_urls[0])
+                    continue
+                resolve_log.info("Searching YouTube for Spotify track %s/%s: '%s'", i+1, len(search_queries_for_yt), yt_query)
                 # Get single best match from YouTube for each Spotify track
                 # Modifying ydl_opts for single search might be too complex here,
                 # rely on yt-dlp's default search behavior (ytsearch1:)
                 yt_stream_urls = get_stream_url(f"ytsearch1:{yt_query}") # Explicitly search YouTube
                 if yt_stream_urls: # get_stream_url returns a list
                     stream_urls_to_play.append(yt_stream_urls[0]) # Add first result
-                    logging.info(f"Found YouTube stream for '{yt_query}': {yt_stream_urls[0][:70]}...")
+                    resolve_log.info("Found YouTube stream for '%s': %s...", yt_query, yt_stream_urls[0][:70])
                 else:
-                    logging.warning(f"Could not find a YouTube stream for Spotify track: '{yt_query}'")
+                    resolve_log.warning("Could not find a YouTube stream for Spotify track: '%s'", yt_query)
                     print(f"Warning: Could not find YouTube stream for: {yt_query[:50]}...") # User feedback
             if not stream_urls_to_play:
-                 logging.error(f"Could not find any playable YouTube streams for tracks from Spotify URL: {query}")
+                 resolve_log.error("Could not find any playable YouTube streams for tracks from Spotify URL: %s", query)
                  print(f"Error: No YouTube streams found for tracks from the Spotify link.")
                  play_error_sound()
         else:
-            logging.error(f"Could not get track info from Spotify URL: {query}")
+            resolve_log.error("Could not get track info from Spotify URL: %s", query)
             print(f"Error: Could not process Spotify link.")
             play_error_sound()
     else:
         # General query or direct YouTube URL
-        logging.info(f"Processing as direct query/YouTube URL: {query}")
+        local_urls = find_local_match(query) if prefer_local else None
+        if local_urls:
+            return local_urls
+        resolve_log.info("Processing as direct query/YouTube URL: %s", query)
         yt_stream_urls = get_stream_url(query)
         if yt_stream_urls:
             stream_urls_to_play.extend(yt_stream_urls)
         else:
-            logging.error(f"Could not find any playable stream(s) for query/URL: {query}")
+            resolve_log.error("Could not find any playable stream(s) for query/URL: %s", query)
             print(f"Error: Could not find anything for: {query[:70]}...")
             play_error_sound()
+    return stream_urls_to_play
+
+
+# --- Control API ---
+CONTROL_API_PROGRESS = "progress" # url, position_ms; sent to event clients only, never on the bus
+CONTROL_API_TOKEN_PARAM = re.compile(r"([?&]token=)[^&\s]*")
+
+class ThreadOutputRouter:
+    """
+    sys.stdout replacement that sends the prints of a thread inside capture()
+    to that thread's buffer and everything else to the real stdout (which the
+    windowed build does not have). API requests collect the output of
+    handle_command this way without swallowing other threads' prints.
+    """
+    def __init__(self, target):
+        self.target = target
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def capture(self):
+        buffer = io.StringIO()
+        previous = getattr(self.local, "buffer", None)
+        self.local.buffer = buffer
+        try:
+            yield buffer
+        finally:
+            self.local.buffer = previous
+
+    def write(self, text: str) -> int:
+        buffer = getattr(self.local, "buffer", None)
+        if buffer is not None:
+            return buffer.write(text)
+        if self.target is not None:
+            return self.target.write(text)
+        return len(text)
+
+    def flush(self):
+        if self.target is not None:
+            self.target.flush()
+
+    def __getattr__(self, name: str):
+        return getattr(self.target, name) # encoding, isatty(), fileno(), ...
+
+
+class ThreadLogCapture(logging.Handler):
+    """
+    Root handler that copies WARNING+ records emitted on a thread inside
+    ThreadOutputRouter.capture() into that thread's buffer, so an API client
+    sees "No player active" and similar warnings along with the printed output.
+    """
+    def __init__(self, router: ThreadOutputRouter):
+        super().__init__(logging.WARNING)
+        self.router = router
+        self.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+
+    def emit(self, record: logging.LogRecord):
+        buffer = getattr(self.router.local, "buffer", None)
+        if buffer is not None:
+            buffer.write(self.format(record) + "\n")
+
+
+class ControlApiHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # Keep-alive, so scripted clients reuse one connection
+
+    def do_GET(self):
+        control_api.serve(self)
+
+    def do_POST(self):
+        control_api.serve(self)
+
+    def log_message(self, format, *args):
+        # The request line carries ?token= for event clients; never write it to the log
+        args = tuple(CONTROL_API_TOKEN_PARAM.sub(r"\1***", arg) if isinstance(arg, str) else arg for arg in args)
+        logging.debug("Control API: " + format, *args)
 
-    if stream_urls_to_play:
-        logging.info(f"Adding {len(stream_urls_to_play)} stream(s) to playback queue.")
-        play_stream(stream_urls_to_play) # play_stream handles adding to PlaylistManager
-    # else: errors already logged and user informed by now
+
+class ControlApi:
+    """
+    Optional localhost HTTP API ("control_api_enabled"). Every request needs
+    the control_api_token, as "Authorization: Bearer <token>" or as a ?token=
+    query parameter (EventSource cannot set headers), and a localhost Host
+    header, so neither other users' web pages nor DNS rebinding can reach it.
+
+      POST /commands  {"command": "..."} or {"commands": [...], "stop_on_error": false},
+                      or text/plain with one command per line. Runs them in order
+                      through handle_command and returns each one's printed output.
+      GET  /status    Now playing, playback state, position, volume and the queue.
+      GET  /events    Server-Sent Events: a "status" event on connect, then every
+                      event-bus event and a "progress" event every second while a
+                      track plays, so clients never poll.
+    """
+    MAX_BODY_BYTES = 1024 * 1024
+    MAX_BATCH = 1000 # Commands per request
+    CLIENT_QUEUE_SIZE = 256 # Events buffered per event client; a client that falls further behind is dropped
+    KEEPALIVE_INTERVAL = 15 # seconds between comment lines on an idle event stream
+    PROGRESS_INTERVAL = 1.0 # seconds between progress events while a track plays
+    DEFERRED_COMMANDS = ("exit", "quit") # Run after the response is sent; they end the process
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.server: http.server.ThreadingHTTPServer | None = None
+        self.token = ""
+        self.clients: set[queue.Queue] = set() # One bounded event queue per connected /events client
+        self.output_router: ThreadOutputRouter | None = None
+        self.progress_job = ScheduledJob("control_api_progress", self.publish_progress, self.PROGRESS_INTERVAL)
+
+    def start(self, port: int, token: str):
+        with self.lock:
+            if self.server is not None:
+                return
+            try:
+                server = http.server.ThreadingHTTPServer(("127.0.0.1", port), ControlApiHandler)
+            except OSError as e:
+                logging.error(f"Control API could not listen on 127.0.0.1:{port}: {e}")
+                return
+            server.daemon_threads = True
+            self.token = token
+            self.output_router = ThreadOutputRouter(sys.stdout)
+            sys.stdout = self.output_router
+            logging.getLogger().addHandler(ThreadLogCapture(self.output_router))
+            event_bus.subscribe(ALL_EVENTS, self.on_event)
+            threading.Thread(target=server.serve_forever, name="control_api", daemon=True).start()
+            self.server = server
+        logging.info(f"Control API listening on http://127.0.0.1:{server.server_address[1]}")
+
+    def format_status(self) -> str:
+        with self.lock:
+            client_count = len(self.clients)
+        return (f"Control API: http://127.0.0.1:{self.server.server_address[1]} ({client_count} event client(s)). "
+                f"Token: control_api_token in {CONFIG_FILE_PATH}")
+
+    # --- Requests ---
+    def _authorized(self, handler: ControlApiHandler) -> bool:
+        host = handler.headers.get("Host", "").rsplit(":", 1)[0]
+        if host not in ("127.0.0.1", "localhost"):
+            return False
+        supplied = handler.headers.get("Authorization", "")
+        supplied = supplied[7:].strip() if supplied.lower().startswith("bearer ") else ""
+        if not supplied:
+            query = urllib.parse.parse_qs(urllib.parse.urlsplit(handler.path).query)
+            supplied = query.get("token", [""])[0]
+        return bool(self.token) and hmac.compare_digest(supplied.encode("utf-8"), self.token.encode("utf-8"))
+
+    def _send_json(self, handler: ControlApiHandler, status: int, document: dict):
+        body = json.dumps(document, default=str).encode("utf-8")
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json; charset=utf-8")
+        handler.send_header("Content-Length", str(len(body)))
+        handler.send_header("Cache-Control", "no-store")
+        if status >= 400:
+            handler.send_header("Connection", "close") # The request body may not have been read
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def serve(self, handler: ControlApiHandler):
+        path = urllib.parse.urlsplit(handler.path).path.rstrip("/")
+        if not self._authorized(handler):
+            self._send_json(handler, 401, {"error": "Missing or wrong token"})
+            return
+        route = (handler.command, path)
+        if route == ("POST", "/commands"):
+            self._run_commands(handler)
+        elif route == ("GET", "/status"):
+            self._send_json(handler, 200, self.status())
+        elif route == ("GET", "/events"):
+            self._stream_events(handler)
+        else:
+            self._send_json(handler, 404, {"error": f"No route for {handler.command} {path or '/'}"})
+
+    def _parse_commands(self, handler: ControlApiHandler) -> tuple[list[str], bool]:
+        """Returns the batch and its stop_on_error flag. Raises ValueError for a malformed body."""
+        length = int(handler.headers.get("Content-Length") or 0)
+        if not 0 < length <= self.MAX_BODY_BYTES:
+            raise ValueError(f"Body must be 1 to {self.MAX_BODY_BYTES} bytes")
+        body = handler.rfile.read(length).decode("utf-8")
+        if handler.headers.get("Content-Type", "").split(";")[0].strip() != "application/json":
+            return [line.strip() for line in body.splitlines() if line.strip()], False
+        document = json.loads(body)
+        if not isinstance(document, dict):
+            raise ValueError("Expected a JSON object")
+        commands = [document["command"]] if "command" in document else document.get("commands")
+        if not isinstance(commands, list) or not all(isinstance(c, str) for c in commands):
+            raise ValueError('Expected "command": "<text>" or "commands": ["<text>", ...]')
+        return commands, bool(document.get("stop_on_error", False))
+
+    def _run_commands(self, handler: ControlApiHandler):
+        try:
+            commands, stop_on_error = self._parse_commands(handler)
+        except (ValueError, UnicodeDecodeError) as e: # json.JSONDecodeError is a ValueError
+            self._send_json(handler, 400, {"error": str(e)})
+            return
+        if len(commands) > self.MAX_BATCH:
+            self._send_json(handler, 413, {"error": f"At most {self.MAX_BATCH} commands per request"})
+            return
+
+        results = []
+        deferred = None
+        for command in commands:
+            if command.strip().split(" ", 1)[0].lower() in self.DEFERRED_COMMANDS:
+                deferred = command
+                results.append({"command": command, "ok": True, "output": "Shutting down.\n", "elapsed_ms": 0.0})
+                break
+            started = time.perf_counter()
+            with self.output_router.capture() as output:
+                ok = handle_command(command, source="api")
+            results.append({"command": command, "ok": ok, "output": output.getvalue(),
+                            "elapsed_ms": round((time.perf_counter() - started) * 1000.0, 2)})
+            if stop_on_error and not ok:
+                break
+        self._send_json(handler, 200, {"results": results, "skipped": len(commands) - len(results)})
+        if deferred:
+            handle_command(deferred, source="api")
+
+    # --- State ---
+    @staticmethod
+    def _entry(url: str) -> dict:
+        if os.path.isabs(url):
+            title = os.path.splitext(os.path.basename(url))[0]
+        else:
+            title = (stream_sources.get(url) or {}).get("title")
+        return {"url": url, "title": title}
+
+    def status(self) -> dict:
+        snapshot = playlist_manager.snapshot
+        return {
+            "state": playback_backend.state().value,
+            "now_playing": {"url": snapshot.current_song_url, "title": playlist_manager.get_current_song_title()}
+                           if snapshot.current_song_url else None,
+            "position_ms": playback_backend.get_time(),
+            "volume": playback_backend.get_volume(),
+            "loop": snapshot.loop_queue,
+            "queue_version": snapshot.version,
+            "queue": [self._entry(url) for url in snapshot.items],
+        }
+
+    def _event_data(self, event: str, payload: dict) -> dict:
+        if event == QUEUE_CHANGED:
+            snapshot = payload["snapshot"]
+            return {"version": snapshot.version, "current_song_url": snapshot.current_song_url, "loop": snapshot.loop_queue,
+                    "queue": [self._entry(url) for url in snapshot.items]}
+        return payload
+
+    # --- Events ---
+    def on_event(self, event: str, payload: dict):
+        """Event bus handler: hands the event to every client's queue without blocking the publisher."""
+        if not self.clients:
+            return
+        with self.lock:
+            clients = list(self.clients)
+        for client in clients:
+            try:
+                client.put_nowait((event, payload))
+            except queue.Full:
+                with self.lock:
+                    self.clients.discard(client) # Its writer notices on the next keepalive check
+                logging.warning("Control API event client fell behind; disconnecting it.")
+
+    def publish_progress(self):
+        """Scheduler job (runs only while event clients are connected): pushes the playback position."""
+        if playback_backend.state() is PlaybackState.PLAYING:
+            self.on_event(CONTROL_API_PROGRESS, {"url": playlist_manager.snapshot.current_song_url,
+                                                 "position_ms": playback_backend.get_time()})
+
+    def _stream_events(self, handler: ControlApiHandler):
+        client: queue.Queue = queue.Queue(self.CLIENT_QUEUE_SIZE)
+        handler.send_response(200)
+        handler.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        handler.send_header("Cache-Control", "no-store")
+        handler.send_header("Connection", "close") # The stream ends with the connection
+        handler.end_headers()
+        with self.lock:
+            self.clients.add(client)
+            if len(self.clients) == 1:
+                scheduler.reschedule(self.progress_job, self.PROGRESS_INTERVAL)
+        try:
+            self._write_event(handler, "status", self.status())
+            while True:
+                try:
+                    event, payload = client.get(timeout=self.KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    if client not in self.clients: # Dropped as too slow
+                        break
+                    handler.wfile.write(b": keepalive\n\n")
+                    continue
+                self._write_event(handler, event, self._event_data(event, payload))
+        except OSError: # Client disconnected (broken pipe / reset)
+            pass
+        finally:
+            with self.lock:
+                self.clients.discard(client)
+                if not self.clients:
+                    scheduler.cancel(self.progress_job) # No periodic wakeups while nobody listens
+
+    @staticmethod
+    def _write_event(handler: ControlApiHandler, event: str, data: dict):
+        handler.wfile.write(f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n".encode("utf-8"))
+
+
+control_api = ControlApi()
 
 
 # --- Background Threads ---
 def playback_loop():
     """Continuously play songs from the playlist."""
-    global player, last_activity_time
     default_volume = CONFIG.get("default_volume", DEFAULT_VOLUME)
-    playback_attempt_delay = 1  # seconds, initial delay for retrying playback after error
+    last_track_ended_at: float | None = None # perf_counter of the previous track's end, for transition timing
+    queue_changed = threading.Event()
+    event_bus.subscribe(QUEUE_CHANGED, lambda event, payload: queue_changed.set())
+    player_changed = threading.Event() # Set from the backend's thread on state transitions
+    playing_seen = threading.Event() # The backend reported PLAYING for the current track (even if it ended before we looked)
+
+    def on_player_state(state: PlaybackState):
+        if state is PlaybackState.PLAYING:
+            playing_seen.set()
+        player_changed.set()
+    playback_backend.subscribe(on_player_state)
 
     while True:
+        queue_changed.clear() # Before reading the queue, so an add racing with the read still wakes us
         next_song_url = playlist_manager.get_next_song()
         if next_song_url:
+            # Re-resolve up front if the stream URL has already expired
+            expires_at = parse_stream_expiry(next_song_url)
+            if expires_at is not None and expires_at < time.time() + 30:
+                playback_log.info("Stream URL expired; re-resolving before playback: %s...", next_song_url[:70])
+                fresh_url = re_resolve_stream(next_song_url)
+                if fresh_url:
+                    next_song_url = fresh_url
+                    playlist_manager.set_current_song(fresh_url)
+
             current_song_display_name = playlist_manager.get_current_song_title() or next_song_url[:70]
-            logging.info(f"Attempting to play: {current_song_display_name} (URL: {next_song_url[:70]}...)")
-            last_activity_time = time.time() # Update activity time when we start trying to play
+            playback_log.info("Attempting to play: %s (URL: %s...)", current_song_display_name, next_song_url[:70])
+            failure_reason: str | None = None
+            track_started = False
+            end_state = "released"
+            played_ms = transferred_bytes = None
+            skip_requested.clear()
 
             try:
-                if player is not None: # Ensure player is properly released if it exists
-                    player.release()
-                    player = None
-                    logging.debug("Previous player instance released.")
-
-                # Create new player instance for the new song
-                # For network streams, adding options might be beneficial for robustness
-                # e.g., "--network-caching=1000" (in ms)
-                # These options are VLC specific and passed as a list of strings
-                vlc_instance = vlc.Instance("--no-xlib") # --no-xlib for headless, add other options if needed
-                player = vlc_instance.media_player_new()
-                media = vlc_instance.media_new(next_song_url)
-                # media.add_option("network-caching=1500") # Example: increase network cache
-                player.set_media(media)
-
-                if not player.audio_set_volume(default_volume):
-                    logging.warning(f"Failed to set volume to {default_volume} for {current_song_display_name}. Current volume: {player.audio_get_volume()}")
-
-                if player.play() == -1:
-                    logging.error(f"Failed to start playback for {current_song_display_name}.")
-                    play_error_sound()
-                    # No need to release here, will be handled at the start of the next iteration or in finally
-                    time.sleep(playback_attempt_delay) # Wait before trying next song
+                with metrics.timer("media_open"):
+                    playback_backend.open(media_url_for(next_song_url)) # Releases the previous track
+
+                if not playback_backend.set_volume(default_volume):
+                    playback_log.warning("Failed to set volume to %s for %s. Current volume: %s", default_volume, current_song_display_name, playback_backend.get_volume())
+
+                play_requested_at = time.perf_counter()
+                player_changed.clear()
+                playing_seen.clear()
+                if not playback_backend.play():
+                    metrics.incr("tracks.start_failures")
+                    playback_log.error("Failed to start playback for %s.", current_song_display_name)
+                    failure_reason = "Playback could not be started"
+                    # No need to release here, will be handled in finally
                     continue
 
-                logging.info(f"Playback started for: {current_song_display_name}. Volume: {player.audio_get_volume()}")
-                playback_attempt_delay = 1 # Reset delay on successful play
+                playback_log.info("Playback started for: %s. Volume: %s", current_song_display_name, playback_backend.get_volume())
+                metrics.incr("tracks.started")
+                buffering_recorded = False
 
-                # Monitor playback state
+                # Monitor playback state; backend events wake us, the timeout is only a safety net
                 while True:
-                    if player is None: # Player might have been stopped and released by another thread (e.g. stop_song)
-                        logging.info(f"Player released externally during playback of {current_song_display_name}.")
+                    player_changed.clear()
+                    state = playback_backend.state()
+                    if state is PlaybackState.IDLE: # Closed by another thread (e.g. stop_song)
+                        playback_log.info("Player released externally during playback of %s.", current_song_display_name)
                         break
 
-                    state = player.get_state()
-                    if state == vlc.State.Playing:
-                        last_activity_time = time.time() # Update activity while playing
-                    elif state in (vlc.State.Ended, vlc.State.Stopped, vlc.State.Error):
+                    if not buffering_recorded and (state is PlaybackState.PLAYING or
+                                                   (playing_seen.is_set() and state in (PlaybackState.ENDED, PlaybackState.STOPPED))):
+                        now = time.perf_counter()
+                        metrics.observe("buffering", (now - play_requested_at) * 1000.0)
+                        if last_track_ended_at is not None:
+                            metrics.observe("track_transition", (now - last_track_ended_at) * 1000.0)
+                        buffering_recorded = True
+                        failure_tracker.record_success(next_song_url)
+                        track_started = True
+                        event_bus.publish(TRACK_STARTED, url=next_song_url, title=current_song_display_name,
+                                          first_audio_ms=(now - play_requested_at) * 1000.0)
+                        resume_ms = queue_journal.take_resume_position(next_song_url)
+                        if resume_ms and playback_backend.is_seekable():
+                            playback_backend.set_time(resume_ms)
+                            playback_log.info("Resumed %s at %ss.", current_song_display_name, resume_ms // 1000)
+                    if state in (PlaybackState.ENDED, PlaybackState.STOPPED, PlaybackState.ERROR):
+                        last_track_ended_at = time.perf_counter()
                         log_level = logging.INFO
-                        if state == vlc.State.Error:
+                        end_state = {PlaybackState.ERROR: "error", PlaybackState.ENDED: "ended"}.get(state, "skipped" if skip_requested.is_set() else "stopped")
+                        if state is PlaybackState.ERROR:
                             log_level = logging.ERROR
-                            play_error_sound() # Play error sound specifically for VLC errors
-                        elif state == vlc.State.Ended:
-                            logging.info(f"Finished playing: {current_song_display_name}")
-                        elif state == vlc.State.Stopped:
-                             logging.info(f"Playback stopped for: {current_song_display_name}")
-
-                        logging.log(log_level, f"Playback state for {current_song_display_name}: {state}")
+                            metrics.incr("tracks.errors")
+                            failure_reason = "The player reported a playback error"
+                        elif state is PlaybackState.ENDED:
+                            metrics.incr("tracks.ended")
+                            playback_log.info("Finished playing: %s", current_song_display_name)
+                        elif state is PlaybackState.STOPPED:
+                             metrics.incr("tracks.stopped")
+                             playback_log.info("Playback stopped for: %s", current_song_display_name)
+
+                        playback_log.log(log_level, "Playback state for %s: %s", current_song_display_name, state.value)
                         break # Exit inner loop to get next song or wait
-                    time.sleep(0.2) # Polling interval for player state
+                    player_changed.wait(PLAYER_STATE_RECHECK_INTERVAL)
 
             except Exception as e: # Catch-all for unexpected errors during setup or monitoring
-                logging.error(f"Unexpected error during playback processing for {current_song_display_name}: {e}", exc_info=True)
-                play_error_sound()
-                # Increase delay for retrying after an unexpected error
-                playback_attempt_delay = min(playback_attempt_delay * 2, 60) # Exponential backoff up to 1 minute
-                logging.info(f"Waiting {playback_attempt_delay}s before trying next song due to unexpected error.")
-                time.sleep(playback_attempt_delay)
+                metrics.incr("playback.unexpected_errors")
+                playback_log.error("Unexpected error during playback processing for %s: %s", current_song_display_name, e, exc_info=True)
+                failure_reason = f"Unexpected error: {e}"
             finally:
-                # Ensure player is released if it still exists and loop is about to pick next song or if an error occurred
-                if player is not None:
-                    current_state = player.get_state()
-                    if current_state not in [vlc.State.Playing, vlc.State.Paused]: # Only release if not actively playing/paused
-                        logging.debug(f"Releasing player for {current_song_display_name} in finally block. State: {current_state}")
-                        player.release()
-                        player = None
-                    else:
-                        logging.debug(f"Player for {current_song_display_name} still active (State: {current_state}), not releasing in finally block immediately.")
+                # Release the track unless it is still playing/paused (the next open() releases it then)
+                if track_started:
+                    played_ms, transferred_bytes = playback_backend.stats()
+                current_state = playback_backend.state()
+                if current_state not in (PlaybackState.PLAYING, PlaybackState.PAUSED, PlaybackState.IDLE):
+                    playback_log.debug("Releasing player for %s in finally block. State: %s", current_song_display_name, current_state.value)
+                    playback_backend.close()
+                elif current_state is not PlaybackState.IDLE:
+                    playback_log.debug("Player for %s still active (State: %s), not releasing in finally block immediately.", current_song_display_name, current_state.value)
+                if track_started:
+                    event_bus.publish(TRACK_ENDED, url=next_song_url, title=current_song_display_name, state=end_state,
+                                      played_ms=played_ms, bytes=transferred_bytes)
+                if failure_reason:
+                    handle_playback_failure(next_song_url, failure_reason) # Advances immediately; retries run in the background
         else:
-            # No song in queue, wait a bit before checking again
-            time.sleep(0.5)
+            queue_changed.wait() # Nothing queued; sleep until something is added
+
+
+class HotkeyActionQueue:
+    """
+    Bounded queue between the keyboard hook thread and one consumer thread, so
+    hotkey callbacks never touch the player on the hook thread. Consecutive
+    presses of a stepped action (volume, seek) merge into one pending entry
+    with the summed step, and debounced entries (seeks) wait for the key to
+    settle, so holding ctrl+alt+right becomes a few set_time calls instead of
+    dozens of re-buffers.
+    """
+    def __init__(self, maxsize: int = HOTKEY_QUEUE_SIZE):
+        self.maxsize = maxsize
+        self.condition = threading.Condition()
+        self.pending: collections.deque[dict] = collections.deque()
+        self.thread: threading.Thread | None = None
+
+    def submit(self, name: str, action: Callable, amount: int | None = None, debounce: bool = False):
+        """Queues `action()` (or `action(amount)` for stepped actions). Called on the keyboard hook thread; never blocks."""
+        now = time.monotonic()
+        with self.condition:
+            last = self.pending[-1] if self.pending else None
+            if amount is not None and last is not None and last["action"] is action:
+                last["amount"] += amount
+                last["last_press"] = now
+                metrics.incr("hotkeys.coalesced")
+            elif len(self.pending) >= self.maxsize:
+                metrics.incr("hotkeys.dropped")
+                logging.warning("Hotkey action queue full; dropping '%s'.", name)
+                return
+            else:
+                self.pending.append({"name": name, "action": action, "amount": amount, "debounce": debounce,
+                                     "first_press": now, "last_press": now})
+            self.condition.notify()
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name="hotkey_actions", daemon=True)
+            self.thread.start()
+
+    def run(self):
+        while True:
+            entry = self._next_entry()
+            try:
+                if entry["amount"] is None:
+                    entry["action"]()
+                else:
+                    entry["action"](entry["amount"])
+                metrics.incr("hotkeys.executed")
+            except Exception as e:
+                logging.error("Error running hotkey action '%s': %s", entry["name"], e, exc_info=True)
+            event_bus.publish(COMMAND_EXECUTED, command=entry["name"], args="" if entry["amount"] is None else str(entry["amount"]), source="hotkey")
+
+    def _next_entry(self) -> dict:
+        with self.condition:
+            while True:
+                if not self.pending:
+                    self.condition.wait()
+                    continue
+                entry = self.pending[0]
+                if entry["debounce"] and len(self.pending) == 1: # Anything queued behind it ends the wait early
+                    now = time.monotonic()
+                    wait = min(entry["last_press"] + HOTKEY_SEEK_DEBOUNCE, entry["first_press"] + HOTKEY_SEEK_MAX_DELAY) - now
+                    if wait > 0:
+                        self.condition.wait(wait)
+                        continue
+                return self.pending.popleft()
 
 
+hotkey_actions = HotkeyActionQueue()
+
+def hotkey_action(name: str, action: Callable, amount: int | None = None, debounce: bool = False) -> Callable[[], None]:
+    """Hotkey callback that queues `action` for the consumer thread instead of running it on the hook thread."""
+    return lambda: hotkey_actions.submit(name, action, amount, debounce)
+
 def listen_for_hotkeys():
     """Listen for global hotkeys defined in the config."""
     logging.info("Starting hotkey listener.")
+    hotkey_actions.start()
     try:
-        keyboard.add_hotkey(CONFIG["terminate"], terminate_program)
-        keyboard.add_hotkey(CONFIG["play"], resume_song)
-        keyboard.add_hotkey(CONFIG["pause"], pause_song)
-        keyboard.add_hotkey(CONFIG["resume"], resume_song)
-        keyboard.add_hotkey(CONFIG["skip"], skip_song)
-        keyboard.add_hotkey(CONFIG["stop"], stop_song)
-        keyboard.add_hotkey(CONFIG["volume_up"], lambda: adjust_volume(10))
-        keyboard.add_hotkey(CONFIG["volume_down"], lambda: adjust_volume(-10))
-        keyboard.add_hotkey(CONFIG["skip_forward"], lambda: seek(10000))
-        keyboard.add_hotkey(CONFIG["skip_backward"], lambda: seek(-10000))
-        keyboard.add_hotkey(CONFIG["loop_toggle"], playlist_manager.toggle_loop)
+        keyboard.add_hotkey(CONFIG["terminate"], terminate_program) # Runs immediately, even if the action queue is busy
+        keyboard.add_hotkey(CONFIG["play"], hotkey_action("play", resume_song))
+        keyboard.add_hotkey(CONFIG["pause"], hotkey_action("pause", pause_song))
+        keyboard.add_hotkey(CONFIG["resume"], hotkey_action("resume", resume_song))
+        keyboard.add_hotkey(CONFIG["skip"], hotkey_action("skip", skip_song))
+        keyboard.add_hotkey(CONFIG["stop"], hotkey_action("stop", stop_song))
+        keyboard.add_hotkey(CONFIG["volume_up"], hotkey_action("volume_up", adjust_volume, 10))
+        keyboard.add_hotkey(CONFIG["volume_down"], hotkey_action("volume_down", adjust_volume, -10))
+        keyboard.add_hotkey(CONFIG["skip_forward"], hotkey_action("skip_forward", seek, 10000, debounce=True))
+        keyboard.add_hotkey(CONFIG["skip_backward"], hotkey_action("skip_backward", seek, -10000, debounce=True))
+        keyboard.add_hotkey(CONFIG["loop_toggle"], hotkey_action("loop_toggle", playlist_manager.toggle_loop))
 
         # Register shuffle hotkey
         if CONFIG.get("shuffle_queue"):
             try:
-                keyboard.add_hotkey(CONFIG["shuffle_queue"], playlist_manager.shuffle)
+                keyboard.add_hotkey(CONFIG["shuffle_queue"], hotkey_action("shuffle_queue", playlist_manager.shuffle))
             except Exception as e:
                 logging.error(f"Failed to register hotkey 'shuffle_queue' ({CONFIG['shuffle_queue']}): {e}")
         else:
@@ -1031,12 +4974,21 @@ def listen_for_hotkeys():
         else:
             logging.warning("Config key 'view_queue_hotkey' is empty or not found. View queue hotkey disabled.")
 
+        # Register profiler toggle hotkey
+        if CONFIG.get("profile_toggle"):
+            try:
+                keyboard.add_hotkey(CONFIG["profile_toggle"], hotkey_action("profile_toggle", toggle_profiler))
+            except Exception as e:
+                logging.error(f"Failed to register hotkey 'profile_toggle' ({CONFIG['profile_toggle']}): {e}")
+        else:
+            logging.warning("Config key 'profile_toggle' is empty or not found. Profiler hotkey disabled.")
+
         logging.info("--- Hotkeys Registered ---")
         # Define which config keys are actual hotkeys
         hotkey_config_keys = [
             "terminate", "play", "pause", "resume", "skip", "stop",
             "volume_up", "volume_down", "skip_forward", "skip_backward",
-            "loop_toggle", "shuffle_queue", "view_queue_hotkey"
+            "loop_toggle", "shuffle_queue", "view_queue_hotkey", "profile_toggle"
         ]
 
         registered_hotkeys_summary = {}
@@ -1072,45 +5024,306 @@ def listen_for_hotkeys():
         # This thread might terminate, but the main app should continue.
 
 
-# ... (idle_monitor, monitor_lock_tasklist remain the same) ...
-def idle_monitor():
-    """Terminates the app if idle for too long."""
-    global last_activity_time
+class IdleTracker:
+    """
+    Derives user/playback activity from the event bus: commands, hotkeys and
+    playback state changes count as activity, and while a track is audibly
+    playing the app is never idle. QUEUE_CHANGED does not count on its own:
+    background threads (prefetch URL refreshes, retries) publish it too, and a
+    user's queue edits already arrive as COMMAND_EXECUTED.
+    """
+    ACTIVITY_EVENTS = frozenset((COMMAND_EXECUTED, VOLUME_CHANGED, TRACK_STARTED, TRACK_ENDED, PLAYBACK_PAUSED, PLAYBACK_RESUMED))
+
+    def __init__(self):
+        self.last_activity = time.time()
+        self.playing = False
+        self.job: ScheduledJob | None = None
+        self.timeout = 0
+
+    def on_event(self, event: str, payload: dict):
+        if event not in self.ACTIVITY_EVENTS:
+            return
+        self.last_activity = time.time()
+        playing = {TRACK_STARTED: True, PLAYBACK_RESUMED: True, TRACK_ENDED: False, PLAYBACK_PAUSED: False}.get(event, self.playing)
+        if playing != self.playing:
+            self.playing = playing
+            if not playing and self.job is not None:
+                scheduler.reschedule(self.job, self.timeout) # Playback stopped; the idle clock starts now
+
+    def start(self, timeout: int):
+        self.timeout = timeout
+        self.job = scheduler.schedule("idle_check", self.check, timeout)
+
+    def check(self):
+        """Scheduled at the idle deadline; re-arms itself if there was activity in the meantime."""
+        deadline = self.idle_deadline(self.timeout)
+        if deadline is None:
+            return # Playing; re-armed when playback stops
+        remaining = deadline - time.time()
+        if remaining > 0:
+            scheduler.reschedule(self.job, remaining)
+            return
+        logging.info(f"Idle timeout ({self.timeout}s) reached. Terminating application.")
+        terminate_program()
+
+    def idle_deadline(self, timeout: int) -> float | None:
+        """Wall-clock time at which the app counts as idle, or None while playing."""
+        return None if self.playing else self.last_activity + timeout
+
+
+idle_tracker = IdleTracker()
+event_bus.subscribe(ALL_EVENTS, idle_tracker.on_event)
+
+def start_idle_monitor():
+    """Terminates the app if idle for too long (checked by the scheduler at the idle deadline)."""
     timeout = CONFIG.get("idle_timeout", DEFAULT_IDLE_TIMEOUT)
     if timeout <= 0:
         logging.info("Idle timeout disabled (timeout <= 0 in config).")
         return
     logging.info(f"Idle monitor started with timeout: {timeout} seconds.")
-    while True:
+    idle_tracker.start(timeout)
+
+def preload_modules():
+    """Imports the heavy playback/resolution modules in the background after the UI is up."""
+    process_resolver = CONFIG.get("resolver_backend") == "process"
+    if process_resolver:
+        resolver_pool.start() # yt-dlp is loaded by the workers, not here
+    for module in (vlc, keyboard) if process_resolver else (vlc, youtube_dl, keyboard):
         try:
-            idle_duration = time.time() - last_activity_time
-            if idle_duration > timeout:
-                logging.info(f"Idle timeout ({timeout}s) reached. Terminating application.")
-                terminate_program()
+            module._load()
         except Exception as e:
-            logging.error(f"Error in idle monitor loop: {e}")
-        time.sleep(5)
+            logging.error(f"Failed to preload module '{module._name}': {e}")
+    error_sound.start() # Preload the error sound player
 
-def monitor_lock_tasklist():
-    """Terminates the app if Windows lock screen (LogonUI.exe) is detected."""
-    logging.info("Windows lock screen monitor started.")
-    while True:
+def start_metrics_dump():
+    """Periodically writes the metrics snapshot to the configured JSON file."""
+    path = CONFIG.get("metrics_dump_path")
+    if not path:
+        return
+    interval = CONFIG.get("metrics_dump_interval", 60)
+    logging.info(f"Metrics dump enabled: writing to {path} every {interval} seconds.")
+
+    def dump_metrics():
         try:
-            startupinfo = subprocess.STARTUPINFO()
-            startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-            startupinfo.wShowWindow = subprocess.SW_HIDE
-            output = subprocess.check_output(
-                "TASKLIST", shell=True, encoding="cp850", errors="ignore", startupinfo=startupinfo
-            )
-            if "LogonUI.exe" in output:
-                logging.info("Windows lock screen detected (LogonUI.exe running). Terminating.")
-                terminate_program()
-        except FileNotFoundError:
-             logging.error("TASKLIST command not found. Cannot monitor lock screen.")
-             return
+            metrics.dump(path)
+        except Exception as e:
+            logging.error(f"Error writing metrics dump to {path}: {e}")
+
+    scheduler.schedule("metrics_dump", dump_metrics, interval, interval=interval)
+
+# --- Session Lock Detection ---
+class LockDetector(abc.ABC):
+    """Answers "is the Windows session locked?". Subclasses implement one detection method."""
+    name = "base"
+
+    @abc.abstractmethod
+    def is_locked(self) -> bool | None:
+        """True if locked, False if not, None if the state could not be determined."""
+
+
+class WtsLockDetector(LockDetector):
+    """
+    Asks the Terminal Services API for the current session's lock flag
+    (WTSQuerySessionInformationW / WTSSessionInfoEx). One in-process call, no
+    process spawn. Windows 7 reports the flag inverted, so "auto" prefers it only
+    on Windows 8 and later.
+    """
+    name = "wts"
+    WTS_CURRENT_SERVER_HANDLE = None
+    WTS_CURRENT_SESSION = 0xFFFFFFFF
+    WTS_SESSION_INFO_EX = 25 # WTS_INFO_CLASS.WTSSessionInfoEx
+    WTS_SESSIONSTATE_LOCK = 0
+    WTS_SESSIONSTATE_UNLOCK = 1
+
+    def __init__(self):
+        self.wtsapi32 = ctypes.WinDLL("wtsapi32")
+        self.wtsapi32.WTSQuerySessionInformationW.argtypes = [
+            ctypes.c_void_p, ctypes.c_ulong, ctypes.c_int, ctypes.POINTER(ctypes.c_void_p), ctypes.POINTER(ctypes.c_ulong)
+        ]
+        self.wtsapi32.WTSFreeMemory.argtypes = [ctypes.c_void_p]
+
+    def is_locked(self) -> bool | None:
+        buffer = ctypes.c_void_p()
+        size = ctypes.c_ulong()
+        if not self.wtsapi32.WTSQuerySessionInformationW(
+            self.WTS_CURRENT_SERVER_HANDLE, self.WTS_CURRENT_SESSION, self.WTS_SESSION_INFO_EX,
+            ctypes.byref(buffer), ctypes.byref(size)
+        ):
+            raise ctypes.WinError()
+        try:
+            # WTSINFOEXW: DWORD Level, then (8-byte aligned) WTSINFOEX_LEVEL1_W: SessionId, SessionState, SessionFlags
+            level, _padding, _session_id, _state, flags = ctypes.cast(buffer, ctypes.POINTER(ctypes.c_long * 5)).contents
+        finally:
+            self.wtsapi32.WTSFreeMemory(buffer)
+        if level != 1:
+            return None
+        return {self.WTS_SESSIONSTATE_LOCK: True, self.WTS_SESSIONSTATE_UNLOCK: False}.get(flags)
+
+
+class ProcessEntry32W(ctypes.Structure):
+    _fields_ = [
+        ("dwSize", ctypes.c_ulong), ("cntUsage", ctypes.c_ulong), ("th32ProcessID", ctypes.c_ulong),
+        ("th32DefaultHeapID", ctypes.c_size_t), ("th32ModuleID", ctypes.c_ulong), ("cntThreads", ctypes.c_ulong),
+        ("th32ParentProcessID", ctypes.c_ulong), ("pcPriClassBase", ctypes.c_long), ("dwFlags", ctypes.c_ulong),
+        ("szExeFile", ctypes.c_wchar * 260),
+    ]
+
+
+class InputDesktopLockDetector(LockDetector):
+    """
+    Checks which desktop receives input: "Default" while the user is at the
+    desktop, "Winlogon" while the secure desktop is up. UAC prompts and the
+    Ctrl+Alt+Del screen use the secure desktop too, so a check only counts as
+    locked if LogonUI.exe is running (not the case for UAC), and the session is
+    reported locked after two such checks in a row (Ctrl+Alt+Del is usually
+    dismissed before the next one). No access to the input desktop is "unknown".
+    """
+    name = "input_desktop"
+    DESKTOP_READOBJECTS = 0x0001
+    UOI_NAME = 2
+    TH32CS_SNAPPROCESS = 0x00000002
+    INVALID_HANDLE_VALUE = ctypes.c_void_p(-1).value
+    LOCKED_CHECKS = 2
+
+    def __init__(self):
+        self.user32 = ctypes.WinDLL("user32", use_last_error=True)
+        self.user32.OpenInputDesktop.restype = ctypes.c_void_p
+        self.user32.OpenInputDesktop.argtypes = [ctypes.c_ulong, ctypes.c_bool, ctypes.c_ulong]
+        self.user32.GetUserObjectInformationW.argtypes = [
+            ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p, ctypes.c_ulong, ctypes.POINTER(ctypes.c_ulong)
+        ]
+        self.user32.CloseDesktop.argtypes = [ctypes.c_void_p]
+        self.kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+        self.kernel32.CreateToolhelp32Snapshot.restype = ctypes.c_void_p
+        self.kernel32.CreateToolhelp32Snapshot.argtypes = [ctypes.c_ulong, ctypes.c_ulong]
+        self.kernel32.Process32FirstW.argtypes = [ctypes.c_void_p, ctypes.POINTER(ProcessEntry32W)]
+        self.kernel32.Process32NextW.argtypes = [ctypes.c_void_p, ctypes.POINTER(ProcessEntry32W)]
+        self.kernel32.CloseHandle.argtypes = [ctypes.c_void_p]
+        self.consecutive_locked = 0
+
+    def _logonui_running(self) -> bool:
+        """In-process process list (Toolhelp snapshot), without spawning TASKLIST."""
+        snapshot = self.kernel32.CreateToolhelp32Snapshot(self.TH32CS_SNAPPROCESS, 0)
+        if not snapshot or snapshot == self.INVALID_HANDLE_VALUE:
+            raise ctypes.WinError(ctypes.get_last_error())
+        try:
+            entry = ProcessEntry32W()
+            entry.dwSize = ctypes.sizeof(ProcessEntry32W)
+            found = self.kernel32.Process32FirstW(snapshot, ctypes.byref(entry))
+            while found:
+                if entry.szExeFile.lower() == "logonui.exe":
+                    return True
+                found = self.kernel32.Process32NextW(snapshot, ctypes.byref(entry))
+            return False
+        finally:
+            self.kernel32.CloseHandle(snapshot)
+
+    def _desktop_name(self) -> str | None:
+        desktop = self.user32.OpenInputDesktop(0, False, self.DESKTOP_READOBJECTS)
+        if not desktop:
+            return None # Access denied: the secure desktop is up, but that may just be a UAC prompt
+        try:
+            name = ctypes.create_unicode_buffer(64)
+            needed = ctypes.c_ulong()
+            if not self.user32.GetUserObjectInformationW(desktop, self.UOI_NAME, name, ctypes.sizeof(name), ctypes.byref(needed)):
+                return None
+            return name.value.lower()
+        finally:
+            self.user32.CloseDesktop(desktop)
+
+    def is_locked(self) -> bool | None:
+        name = self._desktop_name()
+        if name is None:
+            return None
+        if name == "winlogon" and self._logonui_running():
+            self.consecutive_locked += 1
+            return True if self.consecutive_locked >= self.LOCKED_CHECKS else None
+        self.consecutive_locked = 0
+        return False
+
+
+class TasklistLockDetector(LockDetector):
+    """Fallback: looks for LogonUI.exe in TASKLIST output. Spawns a shell and enumerates all processes per check."""
+    name = "tasklist"
+
+    def is_locked(self) -> bool | None:
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        startupinfo.wShowWindow = subprocess.SW_HIDE
+        output = subprocess.check_output(
+            "TASKLIST", shell=True, encoding="cp850", errors="ignore", startupinfo=startupinfo
+        )
+        return "LogonUI.exe" in output
+
+
+LOCK_DETECTOR_CLASSES = {cls.name: cls for cls in (WtsLockDetector, InputDesktopLockDetector, TasklistLockDetector)}
+
+def create_lock_detector(backend: str) -> LockDetector | None:
+    """
+    Builds the configured lock detector. "auto" tries the in-process backends
+    first and keeps the first one that answers, falling back to TASKLIST.
+    """
+    if backend == "off":
+        return None
+    candidates = [backend] if backend != "auto" else list(LOCK_DETECTION_BACKENDS)
+    if backend == "auto" and sys.getwindowsversion() < (6, 2):
+        candidates.remove("wts") # Windows 7 reports the WTS lock flag inverted
+    for name in candidates:
+        try:
+            detector = LOCK_DETECTOR_CLASSES[name]()
+            if detector.is_locked() is None and name != candidates[-1]:
+                logging.info(f"Lock detection backend '{name}' cannot determine the session state; trying the next one.")
+                continue
+            return detector
         except Exception as e:
-            logging.error(f"Error checking TASKLIST for lock screen: {e}")
-        time.sleep(10)
+            logging.warning(f"Lock detection backend '{name}' unavailable: {e}")
+    return None
+
+lock_detector: LockDetector | None = None
+
+def check_session_lock() -> bool | None:
+    """Terminates the app if the Windows session is locked. Scheduled every LOCK_CHECK_INTERVAL seconds."""
+    global lock_detector
+    try:
+        if lock_detector.is_locked():
+            logging.info(f"Windows lock screen detected ({lock_detector.name} backend). Terminating.")
+            terminate_program()
+    except FileNotFoundError:
+        logging.error("TASKLIST command not found. Cannot monitor lock screen.")
+        return False # Stop checking
+    except Exception as e:
+        logging.error(f"Error checking the lock screen with the '{lock_detector.name}' backend: {e}")
+        if not isinstance(lock_detector, TasklistLockDetector):
+            logging.warning("Falling back to TASKLIST lock detection.")
+            lock_detector = TasklistLockDetector()
+    return None
+
+def start_lock_monitor():
+    """Picks the lock detection backend and schedules the periodic check."""
+    global lock_detector
+    lock_detector = create_lock_detector(CONFIG.get("lock_detection_backend", "auto"))
+    if lock_detector is None:
+        logging.info("Windows lock screen monitor disabled (no usable lock_detection_backend).")
+        return
+    logging.info(f"Windows lock screen monitor started ({lock_detector.name} backend).")
+    scheduler.schedule("lock_check", check_session_lock, LOCK_CHECK_INTERVAL, interval=LOCK_CHECK_INTERVAL)
+
+def start_background_jobs():
+    """Registers the periodic jobs with the scheduler and starts its thread."""
+    start_idle_monitor()
+    prefetcher.start()
+    start_metrics_dump()
+    start_library_rescans()
+    if CONFIG.get("history_enabled", True):
+        history.start()
+    if CONFIG.get("control_api_enabled"):
+        control_api.start(CONFIG.get("control_api_port", 8765), CONFIG.get("control_api_token", ""))
+    scheduler.schedule("spotify_cache_evict", evict_stale_spotify_metadata, SPOTIFY_CACHE_EVICT_INTERVAL, interval=SPOTIFY_CACHE_EVICT_INTERVAL)
+    if os.name == 'nt':
+        start_lock_monitor()
+    else:
+        logging.info("Windows lock screen monitor not started (not on Windows).")
+    scheduler.start()
 
 
 # --- GUI / Tray Icon ---
@@ -1161,6 +5374,17 @@ def setup_tray_icon(root_window: tk.Tk) -> PystrayIconType:
     icon = pystray.Icon(TRAY_ICON_NAME.lower().replace(" ", "_"), create_tray_image(), TRAY_ICON_NAME, menu)
     return icon
 
+def bind_tray_to_events(icon: PystrayIconType):
+    """Keeps the tray tooltip showing the current track."""
+    def on_track_started(event: str, payload: dict):
+        icon.title = f"{TRAY_ICON_NAME} - {payload['title']}"[:100] # Windows caps tooltips at 128 chars
+
+    def on_track_ended(event: str, payload: dict):
+        icon.title = TRAY_ICON_NAME
+
+    event_bus.subscribe(TRACK_STARTED, on_track_started)
+    event_bus.subscribe(TRACK_ENDED, on_track_ended)
+
 def hide_window(root_window: tk.Tk):
     """Hide the main window."""
     logging.debug("Hiding main window.")
@@ -1180,15 +5404,16 @@ def on_enter_pressed(event: tk.Event, input_widget: tk.Entry):
 def terminate_program():
     """Cleanly shuts down the application."""
     logging.info("Initiating shutdown sequence...")
-    global player
-    if player:
-        try:
-            player.stop()
-            player.release()
-            player = None
-            logging.info("VLC Player stopped and released.")
-        except Exception as e:
-            logging.error(f"Error stopping/releasing VLC player: {e}")
+    queue_journal.close() # Before stopping the player, so the position is kept and the stop is not journaled
+    try:
+        if playback_backend.is_active():
+            playback_backend.close()
+            logging.info("Player stopped and released.")
+    except Exception as e:
+        logging.error(f"Error stopping/releasing the player: {e}")
+    history.close() # Commit queued history and search index writes before the hard exit
+    search_index.flush()
+    spotify_cache.save_if_dirty()
     try:
         if root and root.winfo_exists():
             root.destroy()
@@ -1196,12 +5421,14 @@ def terminate_program():
     except Exception as e:
         logging.warning(f"Error destroying Tkinter window: {e}")
     logging.info("Exiting application.")
+    shutdown_logging()
     os._exit(0)
 
 
 # --- Main Execution ---
 if __name__ == "__main__":
-    # --- Tkinter GUI Setup ---
+    # --- Stage 1: Tkinter GUI and tray (no heavy imports) ---
+    ui_phase_start = time.perf_counter()
     root = tk.Tk()
     root.title(WINDOW_TITLE)
     root.resizable(False, False)
@@ -1217,33 +5444,36 @@ if __name__ == "__main__":
     input_field = tk.Entry(root, bg="gray10", fg="white", insertbackground="white", font=("Consolas", 10))
     input_field.pack(fill=tk.X, padx=5, pady=5, expand=True)
     input_field.bind("<Return>", lambda event: on_enter_pressed(event, input_field))
+    startup_trace.record("tk window", ui_phase_start)
 
     # --- System Tray Setup ---
-    tray_icon = setup_tray_icon(root)
-    tray_thread = threading.Thread(target=tray_icon.run, daemon=True)
-    tray_thread.start()
+    with startup_trace.phase("tray icon"):
+        tray_icon = setup_tray_icon(root)
+        bind_tray_to_events(tray_icon)
+        tray_thread = threading.Thread(target=tray_icon.run, name="tray", daemon=True)
+        tray_thread.start()
     logging.info("System tray icon thread started.")
 
     root.withdraw() # Start hidden
 
+    # --- Stage 2: Heavy modules and the Spotify client load in the background ---
+    start_spotify_client_init()
+    threading.Thread(target=preload_modules, name="preload_modules", daemon=True).start()
+
     # --- Start Background Threads ---
-    playback_thread = threading.Thread(target=playback_loop, daemon=True)
+    start_queue_journal() # Restore the last session before the playback loop picks the first track
+    playback_thread = threading.Thread(target=playback_loop, name="playback_loop", daemon=True)
     playback_thread.start()
     logging.info("Playback loop thread started.")
 
-    hotkey_thread = threading.Thread(target=listen_for_hotkeys, daemon=True)
+    hotkey_thread = threading.Thread(target=listen_for_hotkeys, name="listen_for_hotkeys", daemon=True)
     hotkey_thread.start()
 
-    idle_thread = threading.Thread(target=idle_monitor, daemon=True)
-    idle_thread.start()
-
-    if os.name == 'nt':
-        lock_thread = threading.Thread(target=monitor_lock_tasklist, daemon=True)
-        lock_thread.start()
-    else:
-        logging.info("Windows lock screen monitor not started (not on Windows).")
+    # Idle check, prefetch, cache eviction, metrics dump and lock check share one scheduler thread
+    start_background_jobs()
 
     # --- Start GUI Main Loop ---
+    startup_trace.record("ready", PROCESS_START)
     logging.info(f"{APP_NAME} started successfully. Main window is hidden.")
     logging.info("Use tray icon to show/exit or hotkeys for control.")
     try:
@@ -6,7 +6,12 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[('lib', 'lib')],
-    hiddenimports=[],
+    hiddenimports=[
+        # Imported lazily through LazyModule in main.py, so PyInstaller cannot see them
+        'keyboard', 'pystray', 'spotipy', 'spotipy.oauth2', 'spotipy.cache_handler', 'vlc', 'yt_dlp',
+        'PIL.Image', 'PIL.ImageDraw', 'requests', 'requests.adapters', 'urllib3.util.retry',
+        'resolver_worker',
+    ],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
@@ -0,0 +1,93 @@
+"""
+Stream resolution worker for Profex Player.
+
+`extract(query)` runs yt-dlp for a search query or URL and returns a compact,
+JSON-serialisable record instead of yt-dlp's full info dict:
+
+  {"status": "ok" | "empty" | "no_stream" | "download_error" | "error",
+   "entries": [[stream_url, webpage_url, title], ...],
+   "skipped": <entries without a stream URL>,
+   "error": <message or null>,
+   "elapsed_ms": <extraction time>}
+
+main.py calls it in-process ("inline" resolver backend) or keeps a warm pool
+of worker processes running `serve()` ("process" backend), so the CPU-heavy
+extraction never competes for the GIL with the UI, hotkey and playback threads.
+
+Usage (normally started by main.py, one JSON request per line on stdin):
+  python resolver_worker.py
+  main.exe --resolver-worker        (frozen builds)
+"""
+import json
+import os
+import sys
+import time
+
+YDL_OPTS = {
+    "format": "bestaudio/best",
+    "quiet": True,
+    "extract_audio": True,
+    "noplaylist": True,
+    "no_warnings": True,
+    "source_address": "0.0.0.0",
+    "default_search": "ytsearch1",
+    "skip_download": True,
+    "logtostderr": False,
+    "ignoreerrors": True,  # Suppress yt-dlp's own error messages to console for unavailable videos
+    # "verbose": True, # Uncomment for debugging yt-dlp issues
+    # "dump_json": True, # Uncomment to see full JSON extract for debugging
+}
+
+
+def extract(query: str) -> dict:
+    """Resolves `query` with yt-dlp and returns a compact result record (never raises)."""
+    import yt_dlp  # Deferred so importing this module stays cheap
+
+    started = time.perf_counter()
+    record = {"status": "ok", "entries": [], "skipped": 0, "error": None}
+    try:
+        with yt_dlp.YoutubeDL(YDL_OPTS) as ydl:
+            info_dict = ydl.extract_info(query, download=False)
+        if not info_dict:
+            record["status"] = "empty"
+        elif info_dict.get("entries"):  # Playlists or multiple search results
+            for entry in info_dict["entries"]:
+                if entry and entry.get("url"):  # 'url' here is the direct streamable URL
+                    record["entries"].append([entry["url"], entry.get("webpage_url"), entry.get("title")])
+                else:
+                    record["skipped"] += 1
+        elif info_dict.get("url"):  # Single video
+            record["entries"].append([info_dict["url"], info_dict.get("webpage_url"), info_dict.get("title")])
+        else:
+            record["status"] = "no_stream"  # Metadata but no streamable format
+    except yt_dlp.utils.DownloadError as e:
+        record["status"] = "download_error"
+        record["error"] = str(e)
+    except Exception as e:
+        record["status"] = "error"
+        record["error"] = f"{type(e).__name__}: {e}"
+    record["elapsed_ms"] = (time.perf_counter() - started) * 1000.0
+    return record
+
+
+def serve():
+    """Answers {"id", "query"} requests from stdin with {"id", **record} lines on stdout until stdin closes."""
+    # Windowed frozen builds start without sys.std* objects, so fall back to the raw pipe descriptors
+    protocol_in = sys.stdin or open(0, "r", closefd=False)
+    protocol_out = sys.stdout or open(1, "w", closefd=False)
+    sys.stdout = sys.stderr or open(os.devnull, "w")  # Anything yt-dlp prints must not corrupt the protocol stream
+    import yt_dlp  # noqa: F401  (warm up before the first request)
+
+    protocol_out.write(json.dumps({"id": None, "status": "ready"}) + "\n")
+    protocol_out.flush()
+    for line in protocol_in:
+        if not line.strip():
+            continue
+        request = json.loads(line)
+        response = {"id": request["id"], **extract(request["query"])}
+        protocol_out.write(json.dumps(response, separators=(",", ":")) + "\n")
+        protocol_out.flush()
+
+
+if __name__ == "__main__":
+    serve()
@@ -0,0 +1,532 @@
+"""
+Concurrency stress harness for Profex Player.
+
+Runs the real queue and playback engine from main.py (playback_loop,
+PlaylistManager, HotkeyActionQueue, handle_command) on the simulated playback
+backend, while worker threads fire randomized console commands, hotkey actions
+and direct queue mutations at it, the way the Tk, keyboard hook, tray and
+background threads do in the app. Nothing is persisted: the queue journal,
+play history and search index are detached before the run.
+
+Reported:
+  * throughput        - operations per second by kind (command / hotkey / mutation), tracks started per second
+  * latency           - wall time of each operation kind, as seen by the calling thread
+  * lock waits        - acquire wait p50/p95/max and contention for the engine's locks (wrapped in TimedLock)
+  * invariants        - violations, e.g. backend state touched without holding its lock (the
+                        "player released while another thread sets the volume" class of bug),
+                        overlapping tracks, queue snapshots out of step with the writer state
+  * log records       - WARNING/ERROR records by message; unexpected errors also count as violations
+
+The process exits with status 1 if any invariant was violated.
+
+Usage:
+  python stress_engine.py [--threads 8] [--seconds 10] [--seed 1] [--output stress.json]
+  python stress_engine.py --compare old.json new.json
+"""
+import argparse
+import collections
+import contextlib
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import sys
+import threading
+import time
+
+# main.py resolves lib/ paths relative to the working directory
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+os.chdir(BASE_DIR)
+
+import main  # noqa: E402  (must be imported after chdir)
+from bench_playback import compare_reports, environment_info, summarize  # noqa: E402
+
+LATENCY_SAMPLES = 20000  # Per operation kind and worker; older samples are dropped
+LOCK_WAIT_SAMPLES = 200000  # Per lock
+CHECK_INTERVAL = 0.002  # seconds between invariant checker passes
+STEP_TIMEOUT = 10.0  # seconds, give up waiting for the engine to settle after this long
+
+
+# --- Instrumentation ---
+class TimedLock:
+    """
+    Drop-in replacement for threading.Lock (also usable under a
+    threading.Condition) that records how long each acquire waited and which
+    thread holds it. Adds some overhead to every acquire, so absolute numbers
+    are only comparable between runs of this harness.
+    """
+    def __init__(self, name: str):
+        self.name = name
+        self.lock = threading.Lock()
+        self.owner: int | None = None
+        self.acquisitions = 0
+        self.contended = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.waits_ms: collections.deque[float] = collections.deque(maxlen=LOCK_WAIT_SAMPLES)
+
+    def acquire(self, blocking: bool = True, timeout: float = -1) -> bool:
+        waited_ms = 0.0
+        if not self.lock.acquire(False):
+            if not blocking:
+                return False
+            started = time.perf_counter()
+            if not self.lock.acquire(True, timeout):
+                return False
+            waited_ms = (time.perf_counter() - started) * 1000.0
+            self.contended += 1
+        # Everything below runs with the lock held, so the bookkeeping needs no lock of its own
+        self.owner = threading.get_ident()
+        self.acquisitions += 1
+        self.total_wait_ms += waited_ms
+        self.max_wait_ms = max(self.max_wait_ms, waited_ms)
+        self.waits_ms.append(waited_ms)
+        return True
+
+    def release(self):
+        self.owner = None
+        self.lock.release()
+
+    def __enter__(self) -> bool:
+        return self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    def locked(self) -> bool:
+        return self.lock.locked()
+
+    def _is_owned(self) -> bool:
+        # Used by threading.Condition instead of its acquire(False) probe
+        return self.owner == threading.get_ident()
+
+    def report(self) -> dict:
+        waits = list(self.waits_ms)
+        summary = summarize(waits)
+        summary.update({
+            "acquisitions": self.acquisitions,
+            "contended": self.contended,
+            "contended_pct": round(self.contended / self.acquisitions * 100.0, 2) if self.acquisitions else 0.0,
+            "total_wait_ms": round(self.total_wait_ms, 3),
+            "max_ms": round(self.max_wait_ms, 3),
+        })
+        return summary
+
+
+class ViolationLog:
+    """Counts invariant violations by kind and keeps the first few details of each."""
+    EXAMPLES_PER_KIND = 5
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts: collections.Counter = collections.Counter()
+        self.examples: dict[str, list[str]] = {}
+
+    def record(self, kind: str, detail: str = ""):
+        with self.lock:
+            self.counts[kind] += 1
+            examples = self.examples.setdefault(kind, [])
+            if len(examples) < self.EXAMPLES_PER_KIND:
+                examples.append(f"[{threading.current_thread().name}] {detail}"[:300])
+
+    def report(self) -> dict:
+        with self.lock:
+            return {"total": sum(self.counts.values()), "by_kind": dict(self.counts), "examples": dict(self.examples)}
+
+
+class LogRecorder(logging.Handler):
+    """Counts WARNING+ records by message template; unexpected errors are also recorded as violations."""
+    NUMBER_PATTERN = re.compile(r"\d+")  # f-string messages ("Invalid index for removal: 3 ...") group as one template
+    UNEXPECTED_PREFIXES = ("Unexpected error", "Error in", "Error running")
+
+    def __init__(self, violations: ViolationLog):
+        super().__init__(logging.WARNING)
+        self.violations = violations
+        self.counts: collections.Counter = collections.Counter()
+
+    def emit(self, record: logging.LogRecord):
+        template = self.NUMBER_PATTERN.sub("N", str(record.msg))[:80]
+        self.counts[f"{record.levelname}: {template}"] += 1
+        if record.levelno >= logging.ERROR and (record.exc_info or template.startswith(self.UNEXPECTED_PREFIXES)):
+            try:
+                message = record.getMessage()
+            except Exception:
+                message = template
+            self.violations.record("unexpected error logged", message)
+
+
+class CheckedSimulatedBackend(main.SimulatedBackend):
+    """SimulatedBackend on a TimedLock that flags any access to its state from a thread not holding that lock."""
+    def __init__(self, violations: ViolationLog, **kwargs):
+        super().__init__(**kwargs)
+        self.timed_lock = TimedLock("backend")
+        self.condition = threading.Condition(self.timed_lock)
+        self.violations = violations
+
+    def _position(self) -> float:
+        if not self.timed_lock._is_owned():
+            self.violations.record("backend state read without its lock", f"state={self.current_state.value}")
+        return super()._position()
+
+    def _set_state(self, state: main.PlaybackState, position: float | None = None):
+        if not self.timed_lock._is_owned():
+            self.violations.record("backend state changed without its lock", f"{self.current_state.value} -> {state.value}")
+        super()._set_state(state, position)
+
+
+# --- Invariant Checks ---
+class TrackObserver:
+    """
+    Event-bus subscriber that checks TRACK_STARTED / TRACK_ENDED strictly
+    alternate for the same URL, and that every ended track reports how long it
+    played (the full length if it finished).
+    """
+    def __init__(self, violations: ViolationLog, track_ms: int):
+        self.violations = violations
+        self.track_ms = track_ms
+        self.lock = threading.Lock()
+        self.playing_url: str | None = None
+        self.started = 0
+        self.end_states: collections.Counter = collections.Counter()
+        self.started_event = threading.Event()
+        self.ended_event = threading.Event()
+        self.last_ended: dict | None = None
+
+    def on_track_started(self, event: str, payload: dict):
+        with self.lock:
+            if self.playing_url is not None:
+                self.violations.record("track started while another was playing", f"{self.playing_url} -> {payload['url']}")
+            self.playing_url = payload["url"]
+            self.started += 1
+        self.started_event.set()
+
+    def on_track_ended(self, event: str, payload: dict):
+        with self.lock:
+            if self.playing_url != payload["url"]:
+                self.violations.record("track ended that was not playing", f"playing={self.playing_url} ended={payload['url']}")
+            self.playing_url = None
+            self.end_states[payload["state"]] += 1
+            played_ms = payload.get("played_ms")
+            if played_ms is None:
+                self.violations.record("track ended without a played time", f"{payload['state']} {payload['url']}")
+            elif payload["state"] == "ended" and played_ms < self.track_ms:
+                self.violations.record("finished track reports less than its length", f"{played_ms} < {self.track_ms} ms")
+            self.last_ended = payload
+        self.ended_event.set()
+
+
+def check_queue_consistency(violations: ViolationLog):
+    """Under the writer lock, the published snapshot must match the writer-side state exactly."""
+    manager = main.playlist_manager
+    with manager.lock:
+        snapshot = manager.snapshot
+        if (tuple(manager.playlist) != snapshot.items or manager.current_song_url != snapshot.current_song_url
+                or manager.loop_queue != snapshot.loop_queue):
+            violations.record("queue snapshot out of step with writer state",
+                              f"version={snapshot.version} items={len(snapshot.items)} playlist={len(manager.playlist)}")
+
+
+def run_checker(backend: CheckedSimulatedBackend, playback_thread: threading.Thread, violations: ViolationLog, stop: threading.Event):
+    """Polls the invariants that are not tied to a particular operation until `stop` is set."""
+    last_version = -1
+    passes = 0
+    while not stop.is_set():
+        version = main.playlist_manager.snapshot.version
+        if version < last_version:
+            violations.record("queue snapshot version went backwards", f"{last_version} -> {version}")
+        last_version = version
+        with backend.condition:
+            volume = backend.volume
+        if not 0 <= volume <= 100:
+            violations.record("volume out of range", str(volume))
+        if len(main.hotkey_actions.pending) > main.hotkey_actions.maxsize:
+            violations.record("hotkey queue over capacity", str(len(main.hotkey_actions.pending)))
+        if not playback_thread.is_alive():
+            violations.record("playback loop died")
+            return
+        passes += 1
+        if passes % 5 == 0:
+            check_queue_consistency(violations)
+        stop.wait(CHECK_INTERVAL)
+
+
+# --- Workload ---
+track_ids = itertools.count(1)  # next() on a count is atomic, so workers can share it
+
+
+def new_track_url() -> str:
+    return f"sim://track/{next(track_ids)}"
+
+
+def random_volume(rng: random.Random) -> str:
+    if rng.random() < 0.05:
+        return rng.choice(("150", "-5", "loud"))  # Exercise the rejection paths too
+    return str(rng.randint(0, 100))
+
+
+# (command template, weight); "{}" is filled in per call. Commands that touch
+# the network, disk or process lifetime (play, download, search, exit, ...) are left out.
+COMMANDS = (
+    ("skip", 8), ("next", 2), ("pause", 5), ("resume", 5), ("volume {}", 5), ("vol {}", 2),
+    ("loop", 1), ("shuffle", 2), ("queue", 2), ("remove {}", 3), ("clear", 1), ("stop", 1),
+    ("stats", 1), ("failures", 1),
+)
+
+# (name, action, amount, debounce, weight), mirroring listen_for_hotkeys()
+HOTKEYS = (
+    ("play", main.resume_song, None, False, 4), ("pause", main.pause_song, None, False, 4),
+    ("resume", main.resume_song, None, False, 2), ("skip", main.skip_song, None, False, 6),
+    ("stop", main.stop_song, None, False, 1), ("volume_up", main.adjust_volume, 10, False, 5),
+    ("volume_down", main.adjust_volume, -10, False, 5), ("skip_forward", main.seek, 10000, True, 3),
+    ("skip_backward", main.seek, -10000, True, 3), ("loop_toggle", main.playlist_manager.toggle_loop, None, False, 1),
+    ("shuffle_queue", main.playlist_manager.shuffle, None, False, 1),
+)
+
+
+def run_command(rng: random.Random, max_queue: int) -> str:
+    template = rng.choices([c for c, _ in COMMANDS], [w for _, w in COMMANDS])[0]
+    name = template.split(" ", 1)[0]
+    if "{}" in template:
+        argument = random_volume(rng) if name in ("volume", "vol") else str(rng.randint(0, 8))
+        template = template.format(argument)
+    main.handle_command(template, source="stress")
+    return name
+
+
+def press_hotkey(rng: random.Random, max_queue: int) -> str:
+    name, action, amount, debounce, _ = rng.choices(HOTKEYS, [h[4] for h in HOTKEYS])[0]
+    main.hotkey_action(name, action, amount, debounce)()  # What the keyboard hook thread does on a press
+    return name
+
+
+def mutate_queue(rng: random.Random, max_queue: int) -> str:
+    manager = main.playlist_manager
+    snapshot = manager.snapshot
+    roll = rng.random()
+    if len(snapshot.items) < max_queue and (roll < 0.35 or not snapshot.items):
+        if rng.random() < 0.5:
+            manager.add_songs([new_track_url() for _ in range(rng.randint(1, 5))])
+            return "add_songs"
+        if rng.random() < 0.5:
+            manager.add_song(new_track_url())
+            return "add_song"
+        manager.push_front(new_track_url())
+        return "push_front"
+    if roll < 0.55:
+        manager.remove_at(rng.randrange(len(snapshot.items) + 1))  # Sometimes out of range on purpose
+        return "remove_at"
+    if roll < 0.65 and snapshot.items:
+        manager.replace_entry(rng.choice(snapshot.items), new_track_url())  # May already be gone; that is fine
+        return "replace_entry"
+    if roll < 0.75 and snapshot.items:
+        manager.remove_entry(rng.choice(snapshot.items))
+        return "remove_entry"
+    if roll < 0.8:
+        manager.shuffle()
+        return "shuffle"
+    if roll < 0.82:
+        manager.toggle_loop()
+        return "toggle_loop"
+    manager.view_queue()
+    manager.get_current_song_title()
+    manager.is_empty()
+    return "read"
+
+
+OPERATIONS = (("command", run_command, 4), ("hotkey", press_hotkey, 3), ("mutation", mutate_queue, 4))
+
+
+def run_worker(index: int, seed: int, max_queue: int, stop: threading.Event, violations: ViolationLog, results: list):
+    rng = random.Random(seed * 1000 + index)
+    counts: collections.Counter = collections.Counter()
+    latencies = {kind: collections.deque(maxlen=LATENCY_SAMPLES) for kind, _, _ in OPERATIONS}
+    weights = [w for _, _, w in OPERATIONS]
+    while not stop.is_set():
+        kind, operation, _ = rng.choices(OPERATIONS, weights)[0]
+        started = time.perf_counter()
+        try:
+            name = operation(rng, max_queue)
+        except Exception as e:
+            violations.record(f"exception escaped {kind}", f"{type(e).__name__}: {e}")
+            name = "failed"
+        latencies[kind].append((time.perf_counter() - started) * 1000.0)
+        counts[kind] += 1
+        counts[f"{kind}.{name}"] += 1
+    results[index] = (counts, latencies)
+
+
+# --- Run ---
+def detach_side_effects():
+    """Keeps the run from touching the user's journal, history database, search index, log file and speakers."""
+    main.CONFIG["idle_timeout"] = 0  # Never let the idle monitor fire mid-run
+    main.error_sound.available = False
+    main.queue_journal.closed = True
+    main.event_bus.unsubscribe(main.TRACK_STARTED, main.history.on_track_started)
+    main.event_bus.unsubscribe(main.TRACK_ENDED, main.history.on_track_ended)
+    main.event_bus.unsubscribe(main.TRACK_STARTED, main.search_index.on_track_started)
+    main.shutdown_logging()
+    root_logger = logging.getLogger()
+    for handler in list(root_logger.handlers):
+        root_logger.removeHandler(handler)
+
+
+def instrument_locks() -> dict[str, TimedLock]:
+    """Swaps the engine's shared locks for TimedLocks; must run before any engine thread starts."""
+    locks = {name: TimedLock(name) for name in ("queue", "hotkey_queue", "metrics", "failure_tracker")}
+    main.playlist_manager.lock = locks["queue"]
+    main.hotkey_actions.condition = threading.Condition(locks["hotkey_queue"])
+    main.metrics.lock = locks["metrics"]
+    main.failure_tracker.lock = locks["failure_tracker"]
+    return locks
+
+
+def wait_until(predicate, timeout: float = STEP_TIMEOUT) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.01)
+    return predicate()
+
+
+def run_stress(args) -> dict:
+    violations = ViolationLog()
+    detach_side_effects()
+    log_recorder = LogRecorder(violations)
+    logging.getLogger().addHandler(log_recorder)
+    logging.getLogger().setLevel(logging.WARNING)
+    for logger_name in ("profex.playback", "profex.resolve", "profex.queue"):
+        logging.getLogger(logger_name).setLevel(logging.NOTSET)
+
+    def on_thread_exception(hook_args):
+        violations.record("thread died", f"{hook_args.thread.name if hook_args.thread else '?'}: "
+                                         f"{hook_args.exc_type.__name__}: {hook_args.exc_value}")
+    threading.excepthook = on_thread_exception
+
+    locks = instrument_locks()
+    backend = CheckedSimulatedBackend(violations, speed=args.speed, track_ms=args.track_ms,
+                                      error_rate=args.error_rate, seed=args.seed)
+    locks["backend"] = backend.timed_lock
+    main.playback_backend = backend
+    observer = TrackObserver(violations, args.track_ms)
+    main.event_bus.subscribe(main.TRACK_STARTED, observer.on_track_started)
+    main.event_bus.subscribe(main.TRACK_ENDED, observer.on_track_ended)
+    main.metrics.reset()
+
+    playback_thread = threading.Thread(target=main.playback_loop, name="playback_loop", daemon=True)
+    playback_thread.start()
+    main.hotkey_actions.start()
+    main.playlist_manager.add_songs([new_track_url() for _ in range(20)])
+
+    stop_workers = threading.Event()
+    stop_checker = threading.Event()
+    checker = threading.Thread(target=run_checker, args=(backend, playback_thread, violations, stop_checker),
+                               name="stress_checker", daemon=True)
+    results: list = [None] * args.threads
+    workers = [threading.Thread(target=run_worker, args=(i, args.seed, args.max_queue, stop_workers, violations, results),
+                                name=f"stress_worker_{i}", daemon=True) for i in range(args.threads)]
+
+    print(f"Running {args.threads} workers for {args.seconds}s...", file=sys.stderr)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):  # Commands print their output
+        checker.start()
+        started = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        time.sleep(args.seconds)
+        stop_workers.set()
+        for worker in workers:
+            worker.join(STEP_TIMEOUT)
+            if worker.is_alive():
+                violations.record("worker did not finish", worker.name)
+        elapsed = time.perf_counter() - started
+        tracks_started = observer.started
+
+        # Quiesce: let queued hotkeys drain, then confirm the engine still plays a fresh queue
+        if not wait_until(lambda: not main.hotkey_actions.pending):
+            violations.record("hotkey queue did not drain", str(len(main.hotkey_actions.pending)))
+        print("Checking the engine still plays after the storm...", file=sys.stderr)
+        backend.error_rate = 0.0
+        main.stop_song()
+        observer.started_event.clear()
+        main.playlist_manager.add_songs([new_track_url() for _ in range(3)])
+        if not observer.started_event.wait(STEP_TIMEOUT):
+            violations.record("playback loop stalled", f"state={backend.state().value} queue={len(main.playlist_manager.snapshot.items)}")
+        elif args.speed > 0:
+            # A skip part-way into a track must still report how long it played
+            observer.ended_event.clear()
+            time.sleep(args.track_ms / args.speed / 4000.0)
+            main.skip_song()
+            if observer.ended_event.wait(STEP_TIMEOUT) and not (observer.last_ended or {}).get("played_ms"):
+                violations.record("skipped track reports no played time", str(observer.last_ended))
+        main.stop_song()
+        stop_checker.set()
+        checker.join(STEP_TIMEOUT)
+        check_queue_consistency(violations)
+
+    counts: collections.Counter = collections.Counter()
+    latencies: dict[str, list[float]] = collections.defaultdict(list)
+    for worker_result in results:
+        if worker_result is None:
+            continue
+        worker_counts, worker_latencies = worker_result
+        counts.update(worker_counts)
+        for kind, samples in worker_latencies.items():
+            latencies[kind].extend(samples)
+
+    total_operations = sum(counts[kind] for kind, _, _ in OPERATIONS)
+    counters = main.metrics.snapshot()["counters"]
+    return {
+        "environment": environment_info(),
+        "parameters": vars(args),
+        "results": {
+            "elapsed_s": round(elapsed, 3),
+            "throughput": {
+                "operations": total_operations,
+                "operations_per_s": round(total_operations / elapsed, 1),
+                "by_kind": {kind: {"count": counts[kind], "per_s": round(counts[kind] / elapsed, 1)} for kind, _, _ in OPERATIONS},
+                "by_operation": {name: count for name, count in sorted(counts.items()) if "." in name},
+                "tracks_started": tracks_started,
+                "tracks_per_s": round(tracks_started / elapsed, 1),
+                "track_end_states": dict(observer.end_states),
+            },
+            "latency": {kind: summarize(samples) for kind, samples in latencies.items()},
+            "hotkeys": {key: counters.get(f"hotkeys.{key}", 0) for key in ("executed", "coalesced", "dropped")},
+            "lock_waits": {name: lock.report() for name, lock in locks.items()},
+            "log_records": dict(log_recorder.counts.most_common()),
+            "violations": violations.report(),
+        },
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profex Player concurrency stress test (simulated playback backend)")
+    parser.add_argument("--threads", type=int, default=8, help="Worker threads firing operations")
+    parser.add_argument("--seconds", type=float, default=10.0, help="How long the workers run")
+    parser.add_argument("--speed", type=float, default=50.0, help="Simulated playback speed (virtual ms per real ms)")
+    parser.add_argument("--track-ms", type=int, default=1000, help="Virtual length of every simulated track")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="Share of simulated tracks that fail to play")
+    parser.add_argument("--max-queue", type=int, default=200, help="Workers stop adding tracks above this queue length")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for the workload and the simulated backend")
+    parser.add_argument("--output", help="Write the JSON report to this file instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two saved reports and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare_reports(*args.compare)
+        sys.exit(0)
+
+    report = run_stress(args)
+    report["parameters"].pop("compare", None)
+    output = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        print(f"Stress report written to {args.output}", file=sys.stderr)
+    else:
+        print(output)
+    violation_count = report["results"]["violations"]["total"]
+    if violation_count:
+        print(f"{violation_count} invariant violation(s); see results.violations.", file=sys.stderr)
+    os._exit(1 if violation_count else 0)  # Engine threads are daemons blocked on waits